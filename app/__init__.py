@@ -1,4 +1,4 @@
-from flask import Flask, render_template, g
+from flask import Flask, render_template, g, flash, redirect, request, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager, current_user
@@ -59,6 +59,19 @@ def create_app(config_class=Config, instance_path=None):
     # Assign the app instance to the global variable before scheduler setup
     _current_flask_app = app
     
+    # Add the tables and columns of newer versions to an existing database before anything queries it
+    from app.utils.schema_upgrade import upgrade_schema
+    try:
+        with app.app_context():
+            added, converted = upgrade_schema()
+        if added or converted:
+            print(f"SCHEMA_UPGRADE: Added {len(added)} column(s), converted {converted} port finding(s)", file=sys.stdout)
+            sys.stdout.flush()
+    except Exception as e:
+        app.logger.error(f"CRITICAL: Database schema upgrade failed; run 'flask upgrade-db' for details: {str(e)}", exc_info=True)
+        print(f"SCHEMA_ERROR: Database schema upgrade failed: {str(e)}", file=sys.stdout)
+        sys.stdout.flush()
+    
     # Configure login
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
@@ -272,7 +285,7 @@ def create_app(config_class=Config, instance_path=None):
                 app.logger.info(f"Primary worker (PID={process_id}) initializing nmap worker pool")
                 print(f"WORKER_POOL_INIT: Primary worker PID={process_id} initializing nmap worker pool", file=sys.stdout)
                 sys.stdout.flush()
-                worker_manager.initialize_worker_pool()
+                worker_manager.initialize_worker_pool(app)
                 app.logger.info(f"Primary worker (PID={process_id}) completed worker pool initialization")
                 print(f"WORKER_POOL_INIT: Primary worker PID={process_id} completed worker pool initialization", file=sys.stdout)
                 sys.stdout.flush()
@@ -335,6 +348,7 @@ def create_app(config_class=Config, instance_path=None):
     from app.controllers.admin import admin_bp
     from app.controllers.profile import profile_bp
     from app.controllers.api import api_bp
+    from app.controllers.agents import agents_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
@@ -344,6 +358,8 @@ def create_app(config_class=Config, instance_path=None):
     app.register_blueprint(admin_bp)
     app.register_blueprint(profile_bp)
     app.register_blueprint(api_bp)
+    app.register_blueprint(agents_bp)
+    csrf.exempt(agents_bp)  # Agents authenticate with their API token instead of a session
     
     # Register custom template filters
     from app.utils.filters import register_filters
@@ -419,6 +435,12 @@ def register_error_handlers(app):
     @app.errorhandler(403)
     def forbidden(e):
         return render_template('errors/403.html'), 403
+    
+    @app.errorhandler(413)
+    def request_entity_too_large(e):
+        # Uploads over MAX_CONTENT_LENGTH, e.g. Nmap XML archives imported on a task page
+        flash(f"The upload is larger than the {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB limit (MAX_UPLOAD_MB).", 'danger')
+        return redirect(request.referrer or url_for('main.index'))
 
 # Import models to ensure they are registered with SQLAlchemy
-from app.models import user, target, task, report
+from app.models import user, target, task, report, agent
@@ -0,0 +1,322 @@
+"""
+asyncio execution backend: a single supervisor thread in the primary worker launches and
+monitors many concurrent Nmap processes with asyncio.create_subprocess_exec.
+
+Only the Nmap children are separate processes; database work (preparation, PID/progress
+updates, report ingestion) runs on the event loop's default thread pool inside an app context.
+"""
+import sys
+import json
+import shlex
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from functools import partial
+
+from app import db
+from app.models.task import ScanRun
+from app.utils.decorators import acquire_sqlite_lock, release_sqlite_lock
+from app.tasks.nmap_tasks import prepare_nmap_scan, create_report_ingester, finalize_scan_run, discard_streamed_report, run_prepared_sweep_scan
+from app.tasks.scan_engines import ENGINE_SWEEP
+from app.tasks.result_cache import complete_from_cache
+from app.tasks.sharded_scan import build_shard_commands, merge_shard_outputs, salvage_shard_outputs
+from app.tasks.scan_deadline import start_scan_deadline
+from app.tasks.process_monitor import SIGNIFICANT_OUTPUT_RE, OUTPUT_BUFFER_LINES
+from app.tasks.nmap_events import ScanPhaseTracker, PROGRESS_EVENTS, combine_phase_trackers
+from app.tasks.progress import get_progress_reporter
+
+logger = logging.getLogger(__name__)
+
+# Maximum length of a single line of Nmap output
+STREAM_LINE_LIMIT = 1024 * 1024
+
+class AsyncScanSupervisor:
+    """
+    Runs Nmap scans as asyncio subprocesses on a dedicated event loop thread.
+
+    submit() may be called from any thread; each scan becomes an asyncio task that acquires
+    the same per-task lock as run_nmap_scan, launches Nmap (one process per shard), tracks
+    progress, finalizes the report and reports the outcome through the worker_manager callbacks.
+    """
+
+    def __init__(self, app, max_concurrent_scans=32, result_callback=None):
+        self.app = app
+        self.max_concurrent_scans = max_concurrent_scans
+        self.result_callback = result_callback
+        self.loop = None
+        self._thread = None
+        self._semaphore = None
+        self._scans = {}
+        self._ready = threading.Event()
+
+    def start(self):
+        """Start the event loop thread"""
+        self._thread = threading.Thread(target=self._run_loop, name='nmap-async-supervisor', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logger.info("Async scan supervisor started (max %s concurrent scans).", self.max_concurrent_scans)
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_scans)
+        self.loop.create_task(self._progress_flusher())
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    def submit(self, scan_run_id, scan_task_id_for_lock):
+        """Schedule a scan run on the supervisor. Returns True if it was accepted."""
+        if self.loop is None or not self.loop.is_running():
+            return False
+        self.loop.call_soon_threadsafe(self._create_scan_task, scan_run_id, scan_task_id_for_lock)
+        return True
+
+    def cancel(self, scan_run_id):
+        """Cancel a running scan; its Nmap processes are killed and the run is marked failed"""
+        if self.loop is None:
+            return False
+        task = self._scans.get(scan_run_id)
+        if task is None:
+            return False
+        self.loop.call_soon_threadsafe(task.cancel)
+        return True
+
+    def active_scan_count(self):
+        return len(self._scans)
+
+    def shutdown(self):
+        """Cancel all scans and stop the event loop"""
+        if self.loop is None or not self.loop.is_running():
+            return
+        for task in list(self._scans.values()):
+            self.loop.call_soon_threadsafe(task.cancel)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=10)
+        logger.info("Async scan supervisor stopped.")
+
+    def _create_scan_task(self, scan_run_id, scan_task_id_for_lock):
+        task = self.loop.create_task(self._supervise(scan_run_id, scan_task_id_for_lock))
+        self._scans[scan_run_id] = task
+        task.add_done_callback(lambda _: self._scans.pop(scan_run_id, None))
+
+    def _call_in_app(self, func, *args, **kwargs):
+        with self.app.app_context():
+            return func(*args, **kwargs)
+
+    async def _in_app(self, func, *args, **kwargs):
+        """Run a blocking function with an app context on the default executor"""
+        return await self.loop.run_in_executor(None, partial(self._call_in_app, func, *args, **kwargs))
+
+    async def _progress_flusher(self):
+        """Periodically write coalesced progress of all supervised runs in one transaction"""
+        interval = self.app.config.get('NMAP_MONITOR_TIMEOUT', 1.0)
+        reporter = self._call_in_app(get_progress_reporter)
+        while True:
+            await asyncio.sleep(interval)
+            if reporter.is_due():
+                try:
+                    await self._in_app(reporter.flush)
+                except Exception as e:
+                    logger.error(f"Error flushing scan progress: {e}")
+
+    async def _supervise(self, scan_run_id, scan_task_id_for_lock):
+        lock_key = f"lock:run_nmap_scan:task_id_{scan_task_id_for_lock}"
+        if not await self._in_app(acquire_sqlite_lock, lock_key):
+            await self._report_result(scan_run_id, None)
+            return
+
+        result = None
+        try:
+            async with self._semaphore:
+                result = await self._execute(scan_run_id)
+        except asyncio.CancelledError:
+            result = {'status': 'failed', 'message': 'Scan cancelled', 'scan_run_id': scan_run_id}
+            await self._mark_failed(scan_run_id, 'Scan cancelled')
+        except Exception as e:
+            logger.error(f"[ScanRun {scan_run_id}] Unhandled exception in async supervisor: {e}", exc_info=True)
+            result = {'status': 'failed', 'message': str(e), 'scan_run_id': scan_run_id}
+            await self._mark_failed(scan_run_id, str(e))
+        finally:
+            await self._in_app(release_sqlite_lock, lock_key)
+        await self._report_result(scan_run_id, result)
+
+    async def _report_result(self, scan_run_id, result):
+        if self.result_callback is not None:
+            await self.loop.run_in_executor(None, self.result_callback, scan_run_id, result)
+
+    async def _mark_failed(self, scan_run_id, message):
+        def mark():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run and scan_run.status not in ('completed', 'failed'):
+                scan_run.status = 'failed'
+                scan_run.error_message = message
+                scan_run.completed_at = datetime.utcnow()
+                db.session.commit()
+        await self._in_app(mark)
+
+    async def _record_pids(self, scan_run_id, pids):
+        def record():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run:
+                scan_run.status = 'running'
+                scan_run.nmap_pid = pids[0]
+                scan_run.shard_pids = json.dumps(pids) if len(pids) > 1 else None
+                db.session.commit()
+        await self._in_app(record)
+        print(f"TASK_EVENT: [ScanRun {scan_run_id}] (async) Committed PIDs {pids} and status 'running'.", file=sys.stdout)
+        sys.stdout.flush()
+
+    async def _execute(self, scan_run_id):
+        plan, failure = await self._in_app(prepare_nmap_scan, scan_run_id)
+        if plan is None:
+            return failure
+        if plan['cached_only']:
+            return await self._in_app(complete_from_cache, scan_run_id, plan['nmap_args'])
+        if plan['engine'] == ENGINE_SWEEP:
+            # The two stages of the sweep engine run their processes on an executor thread
+            return await self._in_app(run_prepared_sweep_scan, scan_run_id, plan)
+
+        xml_output = plan['xml_output']
+        normal_output = plan['normal_output']
+        if plan['shards']:
+            commands = build_shard_commands(plan['shard_base_cmd'], plan['shards'], plan['scan_id'], plan['reports_dir'], plan['shard_args'])
+            weights = [count for _, count in plan['shards']]
+        else:
+            commands = [(plan['cmd'], xml_output, normal_output)]
+            weights = [1]
+
+        # Sharded runs start at most shard_parallel shards at once; the next starts whenever one exits
+        max_parallel = max(1, min(plan['shard_parallel'], len(commands)))
+
+        ingester = await self._in_app(create_report_ingester, scan_run_id, xml_output, normal_output)
+        processes = []
+        pids = []
+        launch_errors = []
+        try:
+            deadline = await self._in_app(start_scan_deadline, plan['deadline_seconds'])
+            if ingester:
+                for _, xml_path, _ in commands:
+                    ingester.watch(xml_path)
+                await self._in_app(ingester.start)
+
+            reporter = await self._in_app(get_progress_reporter)
+            trackers = [ScanPhaseTracker() for _ in commands]
+            buffers = [deque(maxlen=OUTPUT_BUFFER_LINES) for _ in commands]
+            slots = asyncio.Semaphore(max_parallel)
+
+            async def read_output(index, process):
+                async for raw_line in process.stdout:
+                    line = raw_line.decode('utf-8', errors='replace').strip()
+                    if not line:
+                        continue
+                    if SIGNIFICANT_OUTPUT_RE.search(line):
+                        print(f"NMAP_OUTPUT: [ScanRun {scan_run_id}] [{index + 1}/{len(commands)}] {line}", file=sys.stdout)
+                        sys.stdout.flush()
+                    buffers[index].append(line)
+                    event = trackers[index].feed(line)
+                    if event is None or event.kind not in PROGRESS_EVENTS:
+                        continue
+                    if reporter.record(scan_run_id, *combine_phase_trackers(trackers, weights)):
+                        await self._in_app(reporter.flush)
+
+            async def run_command(index):
+                """Start one command once a slot is free and read its output; returns its exit code"""
+                async with slots:
+                    # Shards not started before the deadline or a failed start are skipped
+                    if launch_errors or deadline.reached:
+                        return None
+                    cmd = commands[index][0]
+                    logger.info(f"[ScanRun {scan_run_id}] (async) Executing Nmap command: {cmd}")
+                    try:
+                        process = await asyncio.create_subprocess_exec(
+                            *shlex.split(cmd),
+                            stdout=asyncio.subprocess.PIPE,
+                            stderr=asyncio.subprocess.STDOUT,
+                            limit=STREAM_LINE_LIMIT
+                        )
+                    except Exception as e:
+                        launch_errors.append(e)
+                        for running in processes:
+                            if running.returncode is None:
+                                running.kill()
+                        return None
+                    processes.append(process)
+                    pids.append(process.pid)
+                    await self._record_pids(scan_run_id, [p.pid for p in processes if p.returncode is None])
+                    await read_output(index, process)
+                    return await process.wait()
+
+            async def enforce_deadline():
+                while True:
+                    await asyncio.sleep(1)
+                    deadline.check(pids)
+
+            watchdog = asyncio.ensure_future(enforce_deadline()) if deadline.seconds else None
+            try:
+                return_codes = await asyncio.gather(*(run_command(i) for i in range(len(commands))))
+            finally:
+                if watchdog:
+                    watchdog.cancel()
+            if launch_errors:
+                await self._in_app(discard_streamed_report, ingester, None)
+                await self._mark_failed(scan_run_id, str(launch_errors[0]))
+                return {'status': 'failed', 'message': f'Error starting Nmap process: {str(launch_errors[0])}', 'scan_run_id': scan_run_id}
+            await self._in_app(reporter.finish, scan_run_id)
+            print(f"TASK_EVENT: [ScanRun {scan_run_id}] (async) Nmap exited with return codes {return_codes}", file=sys.stdout)
+            sys.stdout.flush()
+
+            pid_label = ','.join(str(pid) for pid in pids)
+            failed_index = next((i for i, code in enumerate(return_codes) if code != 0), None)
+            if deadline.reached:
+                # Keep the hosts completed before the deadline, whatever the exit status
+                return_code, nmap_done = 0, False
+                output_buffer = [line for buffer in buffers for line in buffer]
+                if plan['shards']:
+                    if ingester:
+                        await self._in_app(ingester.stop)
+                    error_msg = await self._in_app(
+                        salvage_shard_outputs,
+                        scan_run_id,
+                        [xml_path for _, xml_path, _ in commands],
+                        [normal_path for _, _, normal_path in commands],
+                        xml_output,
+                        normal_output
+                    )
+                    if error_msg:
+                        output_buffer = output_buffer + [error_msg]
+            elif failed_index is not None:
+                return_code, output_buffer, nmap_done = return_codes[failed_index], list(buffers[failed_index]), False
+            else:
+                return_code, nmap_done = 0, all(tracker.done for tracker in trackers)
+                output_buffer = [line for buffer in buffers for line in buffer]
+                if plan['shards']:
+                    if ingester:
+                        await self._in_app(ingester.stop)
+                    if nmap_done:
+                        error_msg = await self._in_app(
+                            merge_shard_outputs,
+                            scan_run_id,
+                            [xml_path for _, xml_path, _ in commands],
+                            [normal_path for _, _, normal_path in commands],
+                            xml_output,
+                            normal_output
+                        )
+                        if error_msg:
+                            return_code, nmap_done = 1, False
+                            output_buffer = output_buffer + [error_msg]
+
+            result = await self._in_app(
+                finalize_scan_run, scan_run_id, return_code, output_buffer, xml_output, normal_output, pid_label,
+                nmap_done=nmap_done, ingester=ingester, resumed=plan['resumed'], deadline_reached=deadline.reached
+            )
+            await self._in_app(discard_streamed_report, ingester, result)
+            return result
+        except asyncio.CancelledError:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+            if ingester:
+                await self._in_app(discard_streamed_report, ingester, None)
+            raise
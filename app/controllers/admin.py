@@ -6,8 +6,11 @@ from app.models.user import User
 from app.models.target import TargetGroup
 from app.models.task import ScanTask, ScanRun
 from app.models.settings import SystemSettings
+from app.models.agent import ScanAgent
 from app.utils.forms import UserForm, SystemSettingsForm
 from app.utils.decorators import admin_required
+from app.tasks.resource_limits import get_resource_limits, sample_scan_resource_usage
+from app.tasks.nmap_preflight import get_nmap_capabilities, describe_nmap_capabilities
 import psutil
 import platform
 from datetime import datetime
@@ -28,7 +31,8 @@ def index():
     settings = {
         'max_concurrent_tasks': SystemSettings.get_int('max_concurrent_tasks', 4),
         'max_reports_per_task': SystemSettings.get_int('max_reports_per_task', 15),
-        'pagination_rows': SystemSettings.get_int('pagination_rows', 20)
+        'pagination_rows': SystemSettings.get_int('pagination_rows', 20),
+        'global_max_rate': SystemSettings.get_int('global_max_rate', 0)
     }
     
     # Get system information
@@ -54,7 +58,8 @@ def index():
         # Platform information
         'platform': platform.platform(),
         'python_version': platform.python_version(),
-        'flask_version': getattr(current_app, 'version', 'Unknown')
+        'flask_version': getattr(current_app, 'version', 'Unknown'),
+        'nmap': describe_nmap_capabilities(get_nmap_capabilities())
     }
     
     # Format uptime as days, hours, minutes
@@ -64,11 +69,27 @@ def index():
     minutes, seconds = divmod(remainder, 60)
     system_info['uptime_formatted'] = f"{days}d {hours}h {minutes}m {seconds}s"
     
+    # Resource usage of the Nmap processes of running scans and the limits they run under
+    scan_usage = sample_scan_resource_usage()
+    resource_limits = get_resource_limits(None)
+    
+    # Registered remote scan agents with the runs they currently hold
+    agents = []
+    for agent in ScanAgent.query.order_by(ScanAgent.name).all():
+        agents.append({
+            'agent': agent,
+            'online': agent.is_online(2 * current_app.config.get('AGENT_LEASE_SECONDS', 120)),
+            'active_runs': agent.scan_runs.filter(ScanRun.status.in_(['starting', 'running'])).count()
+        })
+    
     return render_template('admin/index.html', 
                           title='Admin Dashboard',
                           stats=stats,
                           settings=settings,
-                          system_info=system_info)
+                          system_info=system_info,
+                          scan_usage=scan_usage,
+                          resource_limits=resource_limits,
+                          agents=agents)
 
 @admin_bp.route('/users')
 @login_required
@@ -190,6 +211,9 @@ def system_settings():
         form.max_concurrent_tasks.data = SystemSettings.get_int('max_concurrent_tasks', 4)
         form.max_reports_per_task.data = SystemSettings.get_int('max_reports_per_task', 15)
         form.pagination_rows.data = SystemSettings.get_int('pagination_rows', 20)
+        form.liveness_skip_down_runs.data = SystemSettings.get_int('liveness_skip_down_runs', 3)
+        form.liveness_full_sweep_days.data = SystemSettings.get_int('liveness_full_sweep_days', 7)
+        form.global_max_rate.data = SystemSettings.get_int('global_max_rate', 0)
     
     if form.validate_on_submit():
         # Save settings to database
@@ -199,6 +223,12 @@ def system_settings():
                                  'Default maximum number of reports to keep for each task')
         SystemSettings.set_setting('pagination_rows', form.pagination_rows.data,
                                  'Default number of items to display per page in listings')
+        SystemSettings.set_setting('liveness_skip_down_runs', form.liveness_skip_down_runs.data,
+                                 'Scheduled scans skip addresses down in this many consecutive runs (0 = never)')
+        SystemSettings.set_setting('liveness_full_sweep_days', form.liveness_full_sweep_days.data,
+                                 'Days between full sweeps that scan skipped addresses again')
+        SystemSettings.set_setting('global_max_rate', form.global_max_rate.data,
+                                 'Total packets per second shared by all concurrent scans (0 = no limit)')
         
         flash('System settings updated successfully!', 'success')
         return redirect(url_for('admin.system_settings'))
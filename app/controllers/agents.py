@@ -0,0 +1,122 @@
+from functools import wraps
+import hmac
+from flask import Blueprint, jsonify, request, current_app, g
+from app.tasks.remote_agents import (
+    register_agent, authenticate_agent, claim_scan_run, get_leased_run, renew_lease, complete_agent_run
+)
+
+# JSON API used by remote scan agents (run_agent.py); exempt from CSRF, authenticated by token
+agents_bp = Blueprint('agents', __name__, url_prefix='/api/agents')
+
+def agent_required(f):
+    """Authenticate the agent from its 'Authorization: Bearer <token>' header"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_app.config.get('AGENT_REGISTRATION_TOKEN'):
+            return jsonify({'error': 'Remote agents are disabled'}), 403
+        auth_header = request.headers.get('Authorization', '')
+        token = auth_header[7:] if auth_header.startswith('Bearer ') else None
+        agent = authenticate_agent(token, request.remote_addr)
+        if not agent:
+            return jsonify({'error': 'Invalid agent token'}), 401
+        g.agent = agent
+        return f(*args, **kwargs)
+    return decorated_function
+
+@agents_bp.route('/register', methods=['POST'])
+def register():
+    """
+    Register an agent and return its API token
+
+    JSON body:
+    - registration_token: the server's AGENT_REGISTRATION_TOKEN
+    - name: unique agent name
+    - labels: list of labels the agent serves
+    - capacity: number of scans the agent runs at the same time
+    """
+    registration_token = current_app.config.get('AGENT_REGISTRATION_TOKEN')
+    if not registration_token:
+        return jsonify({'error': 'Remote agents are disabled'}), 403
+
+    data = request.get_json(silent=True) or {}
+    if not hmac.compare_digest(str(data.get('registration_token', '')), registration_token):
+        return jsonify({'error': 'Invalid registration token'}), 401
+
+    name = str(data.get('name', '')).strip()
+    if not name or len(name) > 64:
+        return jsonify({'error': 'A name of 1 to 64 characters is required'}), 400
+    labels = data.get('labels') or []
+    if isinstance(labels, str):
+        labels = labels.split(',')
+    labels = [str(label).strip() for label in labels if str(label).strip()]
+    try:
+        capacity = int(data.get('capacity', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'capacity must be an integer'}), 400
+
+    agent, token = register_agent(name, labels, capacity, request.remote_addr)
+    return jsonify({'agent_id': agent.id, 'token': token, 'lease_seconds': current_app.config.get('AGENT_LEASE_SECONDS', 120)})
+
+@agents_bp.route('/claim', methods=['POST'])
+@agent_required
+def claim():
+    """Lease the next queued scan run for the agent; 204 if there is none"""
+    job = claim_scan_run(g.agent)
+    if not job:
+        return '', 204
+    return jsonify(job)
+
+@agents_bp.route('/runs/<int:run_id>/heartbeat', methods=['POST'])
+@agent_required
+def heartbeat(run_id):
+    """
+    Renew the lease of a run and report its progress
+
+    JSON body:
+    - progress: percentage done (optional)
+
+    The returned status is 'running' while the agent should continue.
+    """
+    scan_run = get_leased_run(g.agent, run_id)
+    if not scan_run:
+        return jsonify({'error': 'Scan run is not leased by this agent', 'status': 'lost'}), 409
+    data = request.get_json(silent=True) or {}
+    try:
+        progress = int(float(data['progress'])) if data.get('progress') is not None else None
+    except (TypeError, ValueError):
+        progress = None
+    return jsonify({'status': renew_lease(scan_run, progress)})
+
+@agents_bp.route('/runs/<int:run_id>/result', methods=['POST'])
+@agent_required
+def result(run_id):
+    """
+    Upload the output of a finished run and ingest it
+
+    Multipart form:
+    - return_code: exit status of Nmap
+    - output: last lines of Nmap's console output
+    - xml: the -oX output file
+    - normal: the -oN output file (optional)
+    """
+    scan_run = get_leased_run(g.agent, run_id)
+    if not scan_run:
+        return jsonify({'error': 'Scan run is not leased by this agent'}), 409
+    if scan_run.status not in ('starting', 'running'):
+        return jsonify({'error': f'Scan run is {scan_run.status}'}), 409
+    try:
+        return_code = int(request.form.get('return_code', 1))
+    except ValueError:
+        return_code = 1
+    output_lines = [line for line in request.form.get('output', '').splitlines() if line.strip()]
+    xml_file = request.files.get('xml')
+    normal_file = request.files.get('normal')
+    outcome = complete_agent_run(
+        g.agent,
+        scan_run,
+        return_code,
+        output_lines,
+        xml_file.read() if xml_file else None,
+        normal_file.read() if normal_file else None
+    )
+    return jsonify(outcome or {'status': 'failed', 'scan_run_id': run_id})
@@ -1,11 +1,14 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, send_file
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, send_file, Response
 from flask_login import login_required, current_user
 from app.models.task import ScanRun, ScanTask
-from app.models.report import ScanReport, HostFinding, PortFinding
+from app import db
+from app.models.report import ScanReport, HostFinding, PortFinding, ScriptResult
 from app.models.settings import SystemSettings
+from app.utils.artifact_compression import artifact_encoding, iter_artifact
 import os
 import json
 from io import BytesIO
+from sqlalchemy import func
 try:
     import weasyprint
     from weasyprint import HTML, CSS
@@ -17,6 +20,24 @@ except ImportError:
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
+def _artifact_response(path, mimetype, download_name):
+    """
+    Serve a stored report file as a download. A compressed file is sent as-is with its
+    Content-Encoding to clients that accept that encoding, and decompressed on the fly for the rest.
+    """
+    encoding = artifact_encoding(path)
+    if encoding is None:
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name)
+    headers = {
+        'Content-Disposition': f'attachment; filename="{download_name}"',
+        'Vary': 'Accept-Encoding'
+    }
+    if request.accept_encodings[encoding]:
+        headers['Content-Encoding'] = encoding
+        headers['Content-Length'] = str(os.path.getsize(path))
+        return Response(iter_artifact(path, encoded=True), mimetype=mimetype, headers=headers)
+    return Response(iter_artifact(path), mimetype=mimetype, headers=headers)
+
 @reports_bp.route('/')
 @reports_bp.route('/page/<int:page>')
 @login_required
@@ -107,6 +128,10 @@ def view_host(run_id, host_id):
     # Get port findings for this host
     ports = PortFinding.query.filter_by(host_id=host.id).order_by(PortFinding.port_number).all()
     
+    # Only count the NSE script results; their output is fetched when the user opens it
+    script_counts = dict(db.session.query(ScriptResult.port_id, func.count(ScriptResult.id))
+                         .filter(ScriptResult.host_id == host.id).group_by(ScriptResult.port_id).all())
+    
     # Parse OS info if it exists
     os_info = None
     if host.os_info:
@@ -124,10 +149,34 @@ def view_host(run_id, host_id):
         report=report,
         host=host,
         ports=ports,
+        script_counts=script_counts,
         os_info=os_info,
         summary=summary
     )
 
+@reports_bp.route('/<int:run_id>/host/<int:host_id>/scripts')
+@login_required
+def host_scripts(run_id, host_id):
+    # Get the scan run and ensure it belongs to the current user
+    scan_run = ScanRun.query.join(ScanRun.task).filter(
+        ScanRun.id == run_id,
+        ScanRun.task.has(user_id=current_user.id)
+    ).first_or_404()
+    report = ScanReport.query.filter_by(scan_run_id=scan_run.id).first_or_404()
+    host = HostFinding.query.filter_by(id=host_id, report_id=report.id).first_or_404()
+    
+    # The script results of one port (?port_id=N), of the host itself (?port_id=host) or all of them
+    query = host.scripts
+    port_id = request.args.get('port_id')
+    if port_id == 'host':
+        query = query.filter(ScriptResult.port_id.is_(None))
+    elif port_id:
+        port_id = request.args.get('port_id', type=int)
+        if port_id is None:
+            return jsonify({'error': "port_id must be a port ID or 'host'"}), 400
+        query = query.filter(ScriptResult.port_id == port_id)
+    return jsonify({'scripts': [script.to_dict() for script in query.order_by(ScriptResult.id)]})
+
 @reports_bp.route('/<int:run_id>/raw/xml')
 @login_required
 def raw_xml(run_id):
@@ -144,12 +193,7 @@ def raw_xml(run_id):
         flash('XML report file not found.', 'danger')
         return redirect(url_for('reports.view', run_id=run_id))
     
-    return send_file(
-        report.xml_report_path,
-        mimetype='application/xml',
-        as_attachment=True,
-        download_name=f'nmap_report_{run_id}_UTC.xml'
-    )
+    return _artifact_response(report.xml_report_path, 'application/xml', f'nmap_report_{run_id}_UTC.xml')
 
 @reports_bp.route('/<int:run_id>/raw/text')
 @login_required
@@ -167,12 +211,7 @@ def raw_text(run_id):
         flash('Text report file not found.', 'danger')
         return redirect(url_for('reports.view', run_id=run_id))
     
-    return send_file(
-        report.normal_report_path,
-        mimetype='text/plain',
-        as_attachment=True,
-        download_name=f'nmap_report_{run_id}_UTC.txt'
-    )
+    return _artifact_response(report.normal_report_path, 'text/plain', f'nmap_report_{run_id}_UTC.txt')
 
 @reports_bp.route('/api/summary/<int:run_id>')
 @login_required
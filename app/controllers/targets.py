@@ -5,6 +5,7 @@ from app.models.target import TargetGroup, Target
 from app.models.settings import SystemSettings
 from app.utils.forms import TargetGroupForm
 from app.utils.validators import validate_targets
+from app.tasks.target_resolution import build_targets
 from app.utils.sanitize import sanitize_form_data, sanitize_nmap_targets
 import re
 
@@ -71,15 +72,6 @@ def create():
             'targets': form.targets.data
         })
         
-        # Create new target group
-        target_group = TargetGroup(
-            name=form_data['name'],
-            description=form_data['description'],
-            user_id=current_user.id
-        )
-        db.session.add(target_group)
-        db.session.flush()  # Get the target group ID
-        
         # Process targets - form.validate_targets already sanitized the targets
         # but we'll use the sanitized version from the form data
         targets_text = form_data['targets']
@@ -93,17 +85,28 @@ def create():
         if invalid_targets:
             flash(f'The following targets are invalid and were not added: {", ".join(invalid_targets)}', 'warning')
         
+        # Hostnames are resolved concurrently within a time budget, before anything is written, so that
+        # the database is not locked during the lookups
+        targets, deferred = build_targets(None, valid_targets)
+        
+        # Create new target group
+        target_group = TargetGroup(
+            name=form_data['name'],
+            description=form_data['description'],
+            user_id=current_user.id
+        )
+        db.session.add(target_group)
+        db.session.flush()  # Get the target group ID
+        
         # Add valid targets to the group
-        for target_value, target_type in valid_targets:
-            target = Target(
-                value=target_value,
-                target_type=target_type,
-                target_group_id=target_group.id
-            )
-            db.session.add(target)
+        for target in targets:
+            target.target_group_id = target_group.id
+        db.session.add_all(targets)
         
         db.session.commit()
         flash('Target group created successfully!', 'success')
+        if deferred:
+            flash(f'{deferred} hostnames did not resolve in time and will be resolved in the background.', 'info')
         return redirect(url_for('targets.index'))
     
     return render_template('targets/create.html', title='Create Target Group', form=form)
@@ -127,9 +130,6 @@ def edit(id):
             'targets': form.targets.data
         })
         
-        target_group.name = form_data['name']
-        target_group.description = form_data['description']
-        
         # Process targets - form.validate_targets already sanitized the targets
         # but we'll use the sanitized version from the form data
         targets_text = form_data['targets']
@@ -143,20 +143,21 @@ def edit(id):
         if invalid_targets:
             flash(f'The following targets are invalid and were not added: {", ".join(invalid_targets)}', 'warning')
         
-        # Remove all existing targets
-        Target.query.filter_by(target_group_id=target_group.id).delete()
+        # Hostnames are resolved concurrently within a time budget, before anything is written, so that
+        # the database is not locked during the lookups
+        targets, deferred = build_targets(target_group.id, valid_targets)
         
-        # Add valid targets to the group
-        for target_value, target_type in valid_targets:
-            target = Target(
-                value=target_value,
-                target_type=target_type,
-                target_group_id=target_group.id
-            )
-            db.session.add(target)
+        target_group.name = form_data['name']
+        target_group.description = form_data['description']
+        
+        # Replace all existing targets
+        Target.query.filter_by(target_group_id=target_group.id).delete()
+        db.session.add_all(targets)
         
         db.session.commit()
         flash('Target group updated successfully!', 'success')
+        if deferred:
+            flash(f'{deferred} hostnames did not resolve in time and will be resolved in the background.', 'info')
         return redirect(url_for('targets.index'))
     
     return render_template('targets/edit.html', title='Edit Target Group', form=form, target_group=target_group)
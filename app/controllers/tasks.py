@@ -1,19 +1,24 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, session, current_app
 from flask_login import login_required, current_user
 from app import db
-from app.models.task import ScanTask, ScanRun
+from app.models.task import ScanTask, ScanRun, ReportImport
 from app.models.target import TargetGroup
 from app.models.settings import SystemSettings
 from app.models.report import ScanReport, HostFinding, PortFinding
 from app.utils.forms import ScanTaskForm, ScheduleForm
 from app.tasks.nmap_tasks import run_nmap_scan
 from app.tasks.scheduler_tasks import schedule_task, unschedule_task
-from app.worker_manager import submit_nmap_scan
+from app.tasks.adaptive_timing import timing_duration_comparison
+from app.tasks.port_statistics import build_learned_profile_args
+from app.tasks.report_import import queue_report_import
+from app.worker_manager import submit_nmap_scan, cancel_scan
 from app.utils.timezone_utils import convert_utc_to_local, convert_local_to_utc, get_user_timezone, format_datetime, get_timezone_display_name
 from app.utils.sanitize import sanitize_form_data, sanitize_nmap_command
 from app.utils.validators import validate_nmap_args
 from datetime import datetime, timedelta
+import os
 import json
+import shutil
 import pytz
 import sqlalchemy
 from sqlalchemy import func
@@ -97,10 +102,17 @@ def view_task(id):
         run.completed_at_local = convert_utc_to_local(run.completed_at, user_tz_name) if run.completed_at else None
         run.timezone_display = get_timezone_display_name(user_tz_name)
 
+    timing_comparison = timing_duration_comparison(scan_task) if scan_task.adaptive_timing else None
+    learned_profile_args = build_learned_profile_args(scan_task) if scan_task.scan_profile == current_app.config.get('NMAP_LEARNED_PROFILE') else None
+    report_imports = scan_task.report_imports.order_by(ReportImport.created_at.desc()).limit(5).all()
+
     return render_template('tasks/view.html', 
                            title=f"View Task: {scan_task.name}", 
                            scan_task=scan_task, 
                            scan_runs_pagination=paginated_runs, # Pass pagination object
+                           timing_comparison=timing_comparison,
+                           learned_profile_args=learned_profile_args,
+                           report_imports=report_imports,
                            ScanRun=ScanRun, 
                            format_datetime=format_datetime,
                            get_user_timezone=get_user_timezone,
@@ -143,7 +155,12 @@ def create():
             custom_args=form_data['custom_args'],
             user_id=current_user.id,
             use_global_max_reports=form.use_global_max_reports.data,
-            max_reports=form_data['max_reports']
+            max_reports=form_data['max_reports'],
+            shard_count=form.shard_count.data or 1,
+            adaptive_timing=form.adaptive_timing.data,
+            agent_label=(form.agent_label.data or '').strip() or None,
+            deadline_minutes=form.deadline_minutes.data or None,
+            scan_engine=form.scan_engine.data or 'nmap'
         )
 
         # Add target groups
@@ -207,6 +224,11 @@ def edit(id):
         scan_task.custom_args = form_data['custom_args']
         scan_task.use_global_max_reports = form.use_global_max_reports.data
         scan_task.max_reports = form_data['max_reports']
+        scan_task.shard_count = form.shard_count.data or 1
+        scan_task.adaptive_timing = form.adaptive_timing.data
+        scan_task.agent_label = (form.agent_label.data or '').strip() or None
+        scan_task.deadline_minutes = form.deadline_minutes.data or None
+        scan_task.scan_engine = form.scan_engine.data or 'nmap'
 
         # Update target groups
         scan_task.target_groups = []
@@ -236,12 +258,37 @@ def delete(id):
     if scan_task.is_scheduled:
         unschedule_task(scan_task.id)
 
+    upload_paths = [report_import.upload_path for report_import in scan_task.report_imports if report_import.upload_path]
     db.session.delete(scan_task)
     db.session.commit()
+    # Uploads of imports that had not run yet
+    for upload_path in upload_paths:
+        shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
 
     flash('Scan task deleted successfully!', 'success')
     return redirect(url_for('tasks.index'))
 
+@tasks_bp.route('/<int:id>/import', methods=['POST'])
+@login_required
+def import_reports(id):
+    scan_task = ScanTask.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    
+    upload = request.files.get('archive')
+    if not upload or not upload.filename:
+        flash('Choose an Nmap XML file, tarball or zip archive to import.', 'warning')
+        return redirect(url_for('tasks.view', id=scan_task.id))
+    
+    try:
+        report_import = queue_report_import(scan_task, upload)
+        db.session.commit()
+        flash(f'{report_import.filename} was uploaded and queued for import. The result is shown on this page when it finishes.', 'info')
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error queueing Nmap XML import into task {scan_task.id}: {str(e)}", exc_info=True)
+        flash('The upload could not be saved. Please check logs.', 'danger')
+    
+    return redirect(url_for('tasks.view', id=scan_task.id))
+
 @tasks_bp.route('/<int:id>/run')
 @login_required
 def run(id):
@@ -292,6 +339,11 @@ def run(id):
         db.session.add(scan_run)
         db.session.commit()
 
+        # Runs of tasks routed to remote agents stay queued until an agent claims them
+        if scan_task.agent_label:
+            flash(f'Scan queued for a remote agent with label "{scan_task.agent_label}".', 'info')
+            return redirect(url_for('tasks.view', id=scan_task.id))
+
         # Start the Nmap scan immediately only if under the limit
         if should_start_immediately:
             # Pass the scan_task.id as the second argument (scan_task_id_for_lock)
@@ -481,6 +533,9 @@ def api_status(run_id):
         'id': scan_run.id,
         'status': scan_run.status,
         'progress': scan_run.progress,
+        'scan_phase': scan_run.scan_phase,
+        'phase_progress': scan_run.phase_progress,
+        'phase_eta': scan_run.phase_eta.isoformat() if scan_run.phase_eta else None,
         'started_at': scan_run.started_at.isoformat() if scan_run.started_at else None,
         'completed_at': scan_run.completed_at.isoformat() if scan_run.completed_at else None
     })
@@ -495,23 +550,28 @@ def kill_task(run_id):
     ).first_or_404()
 
     # Check if the task is actually running
-    if scan_run.status not in ['queued', 'running']:
+    if scan_run.status not in ['queued', 'waiting', 'running']:
         flash('This task is not running.', 'warning')
         return redirect(url_for('tasks.view', id=scan_run.task_id))
 
-    # If the task has an Nmap PID, kill the process
-    if scan_run.nmap_pid:
+    # If the task has Nmap PIDs (one per shard for sharded runs), kill the processes
+    for nmap_pid in scan_run.get_nmap_pids():
         try:
             # Try to kill the process
             import os
             import signal
-            os.kill(scan_run.nmap_pid, signal.SIGKILL)
-            print(f"Killed Nmap process with PID {scan_run.nmap_pid}")
+            os.kill(nmap_pid, signal.SIGKILL)
+            print(f"Killed Nmap process with PID {nmap_pid}")
         except ProcessLookupError:
-            print(f"Process with PID {scan_run.nmap_pid} not found")
+            print(f"Process with PID {nmap_pid} not found")
         except Exception as e:
             print(f"Error killing process: {str(e)}")
 
+    # Runs of the asyncio backend are also cancelled in the supervisor, so that it stops
+    # monitoring them instead of finalizing the killed scan
+    if cancel_scan(scan_run.id):
+        print(f"Cancelled ScanRun {scan_run.id} in the async scan supervisor")
+
     # Update the scan run status
     scan_run.status = 'failed'
     scan_run.completed_at = datetime.utcnow()
@@ -0,0 +1,47 @@
+from app import db
+from datetime import datetime, timedelta
+import hashlib
+
+class ScanAgent(db.Model):
+    """A remote scan agent that pulls scan runs from the central queue and uploads their results"""
+    __tablename__ = 'scan_agents'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+    labels = db.Column(db.String(255), nullable=True)  # Comma separated labels; tasks are routed to agents by label
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)  # SHA-256 of the agent's API token
+    capacity = db.Column(db.Integer, default=1)  # Scan runs the agent executes at the same time
+    address = db.Column(db.String(64), nullable=True)  # Address the agent last connected from
+    registered_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen_at = db.Column(db.DateTime, nullable=True)
+
+    # Relationships
+    scan_runs = db.relationship('ScanRun', backref='agent', lazy='dynamic')
+
+    def __repr__(self):
+        return f'<ScanAgent {self.name}>'
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get_labels(self):
+        """Return the agent's labels as a list"""
+        if not self.labels:
+            return []
+        return [label.strip() for label in self.labels.split(',') if label.strip()]
+
+    def is_online(self, timeout_seconds):
+        """Return True if the agent contacted the server within timeout_seconds"""
+        return bool(self.last_seen_at and self.last_seen_at > datetime.utcnow() - timedelta(seconds=timeout_seconds))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'labels': self.get_labels(),
+            'capacity': self.capacity or 1,
+            'address': self.address,
+            'registered_at': self.registered_at,
+            'last_seen_at': self.last_seen_at
+        }
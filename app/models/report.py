@@ -1,4 +1,5 @@
 from app import db
+import json
 from datetime import datetime
 
 class ScanReport(db.Model):
@@ -9,6 +10,9 @@ class ScanReport(db.Model):
     summary = db.Column(db.Text, nullable=True)  # JSON summary data
     xml_report_path = db.Column(db.String(255), nullable=True)  # Path to XML report file
     normal_report_path = db.Column(db.String(255), nullable=True)  # Path to normal output report file
+    status = db.Column(db.String(20), default='complete')  # 'ingesting' while hosts are streamed in during the scan, 'complete' afterwards
+    partial = db.Column(db.Boolean, default=False)  # Salvaged from a scan stopped at its deadline; hosts not reached are missing
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the XML of imported reports, to skip duplicates
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Host findings
@@ -24,6 +28,9 @@ class ScanReport(db.Model):
             'summary': self.summary,
             'xml_report_path': self.xml_report_path,
             'normal_report_path': self.normal_report_path,
+            'status': self.status,
+            'partial': bool(self.partial),
+            'content_hash': self.content_hash,
             'created_at': self.created_at,
             'hosts': [host.to_dict() for host in self.hosts]
         }
@@ -40,6 +47,8 @@ class HostFinding(db.Model):
     
     # Port findings
     ports = db.relationship('PortFinding', backref='host', lazy='dynamic', cascade='all, delete-orphan')
+    # NSE script results of the host and its ports, only loaded when asked for
+    scripts = db.relationship('ScriptResult', backref='host', lazy='dynamic', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<HostFinding {self.ip_address}>'
@@ -63,8 +72,42 @@ class PortFinding(db.Model):
     port_number = db.Column(db.Integer, nullable=False)
     protocol = db.Column(db.String(10), nullable=False)  # 'tcp', 'udp'
     state = db.Column(db.String(20), nullable=False)  # 'open', 'closed', 'filtered'
-    service = db.Column(db.String(64), nullable=True)
-    version = db.Column(db.String(255), nullable=True)
+    # Service detection results, dictionary-encoded in the lookup tables below; searches go by
+    # service name or product (and narrow down by version), so only those two are indexed
+    service_name_id = db.Column(db.Integer, db.ForeignKey('service_names.id'), nullable=True, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('service_products.id'), nullable=True, index=True)
+    version_id = db.Column(db.Integer, db.ForeignKey('service_versions.id'), nullable=True)
+    cpe_id = db.Column(db.Integer, db.ForeignKey('service_cpes.id'), nullable=True)
+    extrainfo = db.Column(db.String(255), nullable=True)
+    
+    # Lookup values are joined in when ports are loaded; they are tiny tables
+    service_name_value = db.relationship('ServiceName', lazy='joined')
+    product_value = db.relationship('ServiceProduct', lazy='joined')
+    version_value = db.relationship('ServiceVersion', lazy='joined')
+    cpe_value = db.relationship('ServiceCpe', lazy='joined')
+    
+    scripts = db.relationship('ScriptResult', backref='port', lazy='dynamic', cascade='all, delete-orphan')
+    
+    @property
+    def service_name(self):
+        return self.service_name_value.value if self.service_name_value else None
+    
+    @property
+    def product(self):
+        return self.product_value.value if self.product_value else None
+    
+    @property
+    def version(self):
+        return self.version_value.value if self.version_value else None
+    
+    @property
+    def cpe(self):
+        return self.cpe_value.value if self.cpe_value else None
+    
+    @property
+    def service(self):
+        """Service name, product and extra info as one display string"""
+        return ' '.join(filter(None, [self.service_name, self.product, self.extrainfo]))
     
     def __repr__(self):
         return f'<PortFinding {self.port_number}/{self.protocol}>'
@@ -77,5 +120,116 @@ class PortFinding(db.Model):
             'protocol': self.protocol,
             'state': self.state,
             'service': self.service,
-            'version': self.version
+            'service_name': self.service_name,
+            'product': self.product,
+            'version': self.version,
+            'extrainfo': self.extrainfo,
+            'cpe': self.cpe
+        }
+
+class ScriptResult(db.Model):
+    """Output of one NSE script run against a port (port_id set) or the host as a whole (<hostscript>)"""
+    __tablename__ = 'script_results'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    host_id = db.Column(db.Integer, db.ForeignKey('host_findings.id'), nullable=False, index=True)
+    port_id = db.Column(db.Integer, db.ForeignKey('port_findings.id'), nullable=True, index=True)
+    script_id = db.Column(db.String(64), nullable=False, index=True)  # e.g. 'ssh-hostkey'
+    output = db.Column(db.Text, nullable=True)
+    data = db.Column(db.Text, nullable=True)  # JSON of the structured <elem>/<table> output
+    
+    def __repr__(self):
+        return f'<ScriptResult {self.script_id} host={self.host_id} port={self.port_id}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'host_id': self.host_id,
+            'port_id': self.port_id,
+            'script_id': self.script_id,
+            'output': self.output,
+            'data': json.loads(self.data) if self.data else None
         }
+
+class ServiceName(db.Model):
+    """Distinct service names (e.g. 'http') referenced by port findings"""
+    __tablename__ = 'service_names'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(255), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f'<ServiceName {self.value}>'
+
+class ServiceProduct(db.Model):
+    """Distinct products (e.g. 'nginx') referenced by port findings"""
+    __tablename__ = 'service_products'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(255), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f'<ServiceProduct {self.value}>'
+
+class ServiceVersion(db.Model):
+    """Distinct product versions referenced by port findings"""
+    __tablename__ = 'service_versions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(255), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f'<ServiceVersion {self.value}>'
+
+class ServiceCpe(db.Model):
+    """Distinct CPE names (e.g. 'cpe:/a:igor_sysoev:nginx:1.18.0') referenced by port findings"""
+    __tablename__ = 'service_cpes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(255), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f'<ServiceCpe {self.value}>'
+
+class HostLiveness(db.Model):
+    """Per-address liveness history, updated from the host findings of every completed report"""
+    __tablename__ = 'host_liveness'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ip_address = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    consecutive_down = db.Column(db.Integer, default=0)  # Number of reports in a row the host was down in
+    last_status = db.Column(db.String(20), nullable=True)
+    last_seen_up = db.Column(db.DateTime, nullable=True)
+    last_checked = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<HostLiveness {self.ip_address} down={self.consecutive_down}>'
+
+class PortFrequency(db.Model):
+    """How often a port was found open, globally (target_group_id NULL) or within a target group"""
+    __tablename__ = 'port_frequencies'
+    __table_args__ = (db.UniqueConstraint('target_group_id', 'port_number', 'protocol', name='uq_port_frequency'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    target_group_id = db.Column(db.Integer, nullable=True, index=True)
+    port_number = db.Column(db.Integer, nullable=False)
+    protocol = db.Column(db.String(10), nullable=False)
+    open_count = db.Column(db.Integer, default=0)  # Open port findings across all stored reports
+    
+    def __repr__(self):
+        return f'<PortFrequency {self.port_number}/{self.protocol} group={self.target_group_id} count={self.open_count}>'
+
+class ScanResultCache(db.Model):
+    """Latest result of one address scanned with one set of arguments, reused by identical scans within a TTL"""
+    __tablename__ = 'scan_result_cache'
+    __table_args__ = (db.UniqueConstraint('ip_address', 'cache_key', name='uq_scan_result_cache'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ip_address = db.Column(db.String(64), nullable=False, index=True)
+    cache_key = db.Column(db.String(64), nullable=False)  # SHA-256 of the normalized Nmap arguments
+    host_data = db.Column(db.Text, nullable=False)  # JSON host dict as produced by parse_host_element
+    scan_run_id = db.Column(db.Integer, nullable=True)  # Run the result was taken from
+    cached_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<ScanResultCache {self.ip_address} {self.cache_key[:8]}>'
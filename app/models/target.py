@@ -13,6 +13,7 @@ class TargetGroup(db.Model):
     
     # Relationships
     targets = db.relationship('Target', backref='group', lazy='dynamic', cascade='all, delete-orphan')
+    timings = db.relationship('TargetGroupTiming', backref='group', lazy='dynamic', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<TargetGroup {self.name}>'
@@ -36,6 +37,11 @@ class Target(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     target_group_id = db.Column(db.Integer, db.ForeignKey('target_groups.id'), nullable=False)
     
+    # DNS resolution of hostname targets; lookups that do not finish while the group is saved are pending
+    resolved_address = db.Column(db.String(45), nullable=True)
+    resolved_at = db.Column(db.DateTime, nullable=True)  # Last lookup, also set when the name did not resolve
+    resolution_pending = db.Column(db.Boolean, default=False, index=True)  # Left to the background resolution job
+    
     def __repr__(self):
         return f'<Target {self.value}>'
     
@@ -44,9 +50,29 @@ class Target(db.Model):
             'id': self.id,
             'value': self.value,
             'target_type': self.target_type,
-            'created_at': self.created_at
+            'created_at': self.created_at,
+            'resolved_address': self.resolved_address,
+            'resolution_pending': bool(self.resolution_pending)
         }
 
+class TargetGroupTiming(db.Model):
+    """Timing of the live hosts of a target group observed in one completed scan run"""
+    __tablename__ = 'target_group_timings'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    target_group_id = db.Column(db.Integer, db.ForeignKey('target_groups.id'), nullable=False, index=True)
+    scan_run_id = db.Column(db.Integer, nullable=True)  # Run the sample was taken from (kept after the run is deleted)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    hosts_up = db.Column(db.Integer, default=0)  # Number of live hosts the values below are based on
+    srtt_avg = db.Column(db.Float, nullable=True)  # Smoothed round trip time in microseconds (<times srtt>)
+    srtt_p90 = db.Column(db.Float, nullable=True)
+    rttvar_avg = db.Column(db.Float, nullable=True)  # Round trip time variance in microseconds (<times rttvar>)
+    host_seconds_avg = db.Column(db.Float, nullable=True)  # Host scan duration from starttime/endtime
+    host_seconds_max = db.Column(db.Float, nullable=True)
+    
+    def __repr__(self):
+        return f'<TargetGroupTiming group={self.target_group_id} run={self.scan_run_id}>'
+
 # Association table for many-to-many relationship between ScanTask and TargetGroup
 task_target_groups = db.Table('task_target_groups',
     db.Column('task_id', db.Integer, db.ForeignKey('scan_tasks.id'), primary_key=True),
@@ -24,9 +24,18 @@ class ScanTask(db.Model):
     use_global_max_reports = db.Column(db.Boolean, default=True)  # Whether to use global setting or task-specific
     max_reports = db.Column(db.Integer, nullable=True)  # Max reports to keep, null means use global setting
     
+    # Execution settings
+    shard_count = db.Column(db.Integer, default=1)  # Number of parallel nmap processes the targets are split across
+    adaptive_timing = db.Column(db.Boolean, default=False)  # Tune timing options per target group from previous runs
+    last_full_sweep_at = db.Column(db.DateTime, nullable=True)  # Last completed scheduled run that scanned dead hosts too
+    deadline_minutes = db.Column(db.Integer, nullable=True)  # Wall-clock limit of a run; null or 0 uses NMAP_SCAN_DEADLINE_MINUTES
+    scan_engine = db.Column(db.String(16), default='nmap')  # 'nmap', or 'sweep' for a fast port sweep followed by Nmap service scans of the open ports
+    agent_label = db.Column(db.String(64), nullable=True)  # Run by a remote agent with this label ('any' for any agent) instead of the local workers
+    
     # Relationships
     target_groups = db.relationship('TargetGroup', secondary='task_target_groups', backref=db.backref('scan_tasks', lazy='dynamic'))
     scan_runs = db.relationship('ScanRun', backref='task', lazy='dynamic', cascade='all, delete-orphan')
+    report_imports = db.relationship('ReportImport', backref='task', lazy='dynamic', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<ScanTask {self.name}>'
@@ -109,6 +118,11 @@ class ScanTask(db.Model):
             'schedule_data': self.get_schedule_data(),
             'use_global_max_reports': self.use_global_max_reports,
             'max_reports': self.get_max_reports(),
+            'shard_count': self.shard_count or 1,
+            'adaptive_timing': bool(self.adaptive_timing),
+            'deadline_minutes': self.deadline_minutes,
+            'scan_engine': self.scan_engine or 'nmap',
+            'agent_label': self.agent_label,
             'target_groups': [tg.id for tg in self.target_groups]
         }
 
@@ -117,14 +131,37 @@ class ScanRun(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     task_id = db.Column(db.Integer, db.ForeignKey('scan_tasks.id'), nullable=False)
-    status = db.Column(db.String(20), default='queued')  # 'queued', 'running', 'completed', 'failed'
+    status = db.Column(db.String(20), default='queued')  # 'queued', 'waiting', 'starting', 'running', 'completed', 'failed'
     progress = db.Column(db.Integer, default=0)  # 0-100 percentage
+    scan_phase = db.Column(db.String(64), nullable=True)  # Nmap phase in progress, e.g. 'SYN Stealth Scan'
+    phase_progress = db.Column(db.Integer, nullable=True)  # 0-100 percentage of the current phase
+    phase_eta = db.Column(db.DateTime, nullable=True)  # When Nmap expects to finish the current phase
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # When the scan run was created
     started_at = db.Column(db.DateTime, default=datetime.utcnow)  # When the scan run started or is scheduled to start
     completed_at = db.Column(db.DateTime, nullable=True)  # When the scan run completed
     nmap_pid = db.Column(db.Integer, nullable=True)  # PID of the nmap process
+    shard_pids = db.Column(db.Text, nullable=True)  # JSON list of nmap PIDs for sharded runs
     error_message = db.Column(db.Text, nullable=True) # To store detailed error messages
+    timing_args = db.Column(db.Text, nullable=True)  # JSON {target_group_id: options} of adaptive timing, if enabled
+    full_sweep = db.Column(db.Boolean, default=False)  # Scheduled run that scanned every address, including known dead ones
+    skipped_hosts = db.Column(db.Integer, default=0)  # Addresses excluded because they were down in the last runs
+    result_cache_key = db.Column(db.String(64), nullable=True)  # Key of the arguments in the result cache, if reuse is enabled
+    cached_host_ids = db.Column(db.Text, nullable=True)  # JSON list of ScanResultCache IDs merged into the report
+    cached_hosts = db.Column(db.Integer, default=0)  # Addresses served from the result cache instead of Nmap
+    max_rate = db.Column(db.Integer, nullable=True)  # Packets per second reserved from the global rate budget
+    rate_wait_since = db.Column(db.DateTime, nullable=True)  # When the run first found too little rate budget free; cleared once it gets its share
     
+    # Remote execution: the agent holding the run and the time its lease runs out unless renewed
+    agent_id = db.Column(db.Integer, db.ForeignKey('scan_agents.id'), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    lease_count = db.Column(db.Integer, default=0)  # Number of times the run was claimed by an agent
+
+    # Resume state: the -oN output doubles as the nmap --resume log if the run is interrupted
+    xml_output_path = db.Column(db.String(255), nullable=True)
+    resume_log_path = db.Column(db.String(255), nullable=True)  # Only set for single-process (unsharded) runs
+    resume_pending = db.Column(db.Boolean, default=False)  # Relaunch with --resume on the next attempt
+    resume_count = db.Column(db.Integer, default=0)  # Number of times the run has been resumed
+
     # Relationships
     report = db.relationship('ScanReport', backref='scan_run', uselist=False, cascade='all, delete-orphan')
     
@@ -150,6 +187,36 @@ class ScanRun(db.Model):
         else:
             return f"{seconds}s"
     
+    def get_nmap_pids(self):
+        """Return the PIDs of every nmap process belonging to this run"""
+        pids = []
+        if self.shard_pids:
+            try:
+                pids = [int(pid) for pid in json.loads(self.shard_pids)]
+            except (ValueError, TypeError):
+                pids = []
+        if self.nmap_pid and self.nmap_pid not in pids:
+            pids.insert(0, self.nmap_pid)
+        return pids
+    
+    def get_timing_args(self):
+        """Return the adaptive timing options used for each target group, keyed by group ID"""
+        if self.timing_args:
+            try:
+                return {int(k): v for k, v in json.loads(self.timing_args).items()}
+            except (ValueError, TypeError, AttributeError):
+                return {}
+        return {}
+    
+    def get_cached_host_ids(self):
+        """Return the IDs of the result cache entries reused by this run"""
+        if self.cached_host_ids:
+            try:
+                return [int(entry_id) for entry_id in json.loads(self.cached_host_ids)]
+            except (ValueError, TypeError):
+                return []
+        return []
+    
     def get_report_id(self):
         """Return the ID of the associated report, if any"""
         if self.report:
@@ -163,15 +230,55 @@ class ScanRun(db.Model):
             'task_id': self.task_id,
             'status': self.status,
             'progress': self.progress,
+            'scan_phase': self.scan_phase,
+            'phase_progress': self.phase_progress,
+            'phase_eta': self.phase_eta,
             'created_at': self.created_at,
             'started_at': self.started_at,
             'completed_at': self.completed_at,
             'nmap_pid': self.nmap_pid,
+            'shard_pids': self.get_nmap_pids() if self.shard_pids else None,
             'error_message': self.error_message,
+            'resume_count': self.resume_count or 0,
+            'timing_args': self.get_timing_args(),
+            'full_sweep': bool(self.full_sweep),
+            'skipped_hosts': self.skipped_hosts or 0,
+            'cached_hosts': self.cached_hosts or 0,
+            'max_rate': self.max_rate,
+            'agent_id': self.agent_id,
             'report_id': report_id
         }
 
 
+class ReportImport(db.Model):
+    __tablename__ = 'report_imports'
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('scan_tasks.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)  # Name of the uploaded file, for display
+    upload_path = db.Column(db.String(255), nullable=True)  # Saved upload, removed once the import finishes
+    status = db.Column(db.String(20), default='queued')  # 'queued', 'running', 'completed', 'failed'
+    message = db.Column(db.Text, nullable=True)  # Import statistics, or the error of a failed import
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<ReportImport {self.id} for Task {self.task_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'filename': self.filename,
+            'status': self.status,
+            'message': self.message,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'completed_at': self.completed_at
+        }
+
+
 class TaskLock(db.Model):
     __tablename__ = 'task_locks'
 
@@ -0,0 +1,227 @@
+"""
+History-driven timing tuning: the per-host round trip times and scan durations of previous
+runs are recorded for each target group and turned into --min-rate, --max-retries,
+--min-hostgroup and --host-timeout options for the next run of a task with adaptive timing.
+"""
+import os
+import math
+import xml.etree.ElementTree as ET
+from flask import current_app
+from app import db
+from app.models.task import ScanRun
+from app.models.target import TargetGroupTiming
+from app.models.report import ScanReport
+from app.utils.target_groups import build_group_matchers, match_target_group
+from app.utils.artifact_compression import open_artifact
+
+# Number of recent samples of a group the tuning is based on
+TIMING_HISTORY_SAMPLES = 5
+# Minimum number of live hosts observed before a group gets tuned options
+MIN_TIMING_HOSTS = 3
+# Never time out a host sooner than this, whatever the history says
+MIN_HOST_TIMEOUT_SECONDS = 60
+# Observed worst-case host duration is multiplied by this to get --host-timeout
+HOST_TIMEOUT_FACTOR = 3
+
+# Latency classes by 90th percentile SRTT (microseconds): (upper bound, max retries, min rate, min hostgroup).
+# Low-latency segments tolerate aggressive rates and few retries; slow WAN links get a lower
+# rate floor and smaller host groups so that probes are not dropped on the way.
+LATENCY_CLASSES = [
+    (5000, 1, 1000, 256),
+    (50000, 2, 300, 64),
+    (None, 3, 100, 32),
+]
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+def collect_host_timings(xml_path):
+    """
+    Read the timing of every live host from an Nmap XML file (compressed or not).
+    Returns a list of dicts with ip_address, hostnames, srtt, rttvar and seconds (None if unknown).
+    """
+    timings = []
+    with open_artifact(xml_path) as xml_file:
+        for _, elem in ET.iterparse(xml_file, events=('end',)):
+            if elem.tag != 'host':
+                continue
+            status_elem = elem.find('status')
+            times_elem = elem.find('times')
+            if status_elem is not None and status_elem.get('state') == 'up' and times_elem is not None:
+                address_elem = elem.find('address')
+                seconds = None
+                if elem.get('starttime') and elem.get('endtime'):
+                    seconds = max(0, int(elem.get('endtime')) - int(elem.get('starttime')))
+                timings.append({
+                    'ip_address': address_elem.get('addr') if address_elem is not None else '',
+                    'hostnames': [h.get('name', '').lower() for h in elem.iter('hostname')],
+                    'srtt': float(times_elem.get('srtt', 0) or 0),
+                    'rttvar': float(times_elem.get('rttvar', 0) or 0),
+                    'seconds': seconds
+                })
+            elem.clear()
+    return timings
+
+def build_timing_sample(group_id, scan_run_id, hosts):
+    """Aggregate the host timings of one group into a TargetGroupTiming row"""
+    srtts = [h['srtt'] for h in hosts if h['srtt'] > 0]
+    rttvars = [h['rttvar'] for h in hosts if h['rttvar'] > 0]
+    durations = [h['seconds'] for h in hosts if h['seconds'] is not None]
+    return TargetGroupTiming(
+        target_group_id=group_id,
+        scan_run_id=scan_run_id,
+        hosts_up=len(hosts),
+        srtt_avg=sum(srtts) / len(srtts) if srtts else None,
+        srtt_p90=_percentile(srtts, 0.9) if srtts else None,
+        rttvar_avg=sum(rttvars) / len(rttvars) if rttvars else None,
+        host_seconds_avg=sum(durations) / len(durations) if durations else None,
+        host_seconds_max=max(durations) if durations else None
+    )
+
+def record_timing_samples(scan_run_id, xml_path, target_groups):
+    """
+    Record the host timing of a finished run for each of the given target groups.
+    Must be called within an app context; the caller commits.
+    Returns the number of samples added.
+    """
+    if not xml_path or not os.path.exists(xml_path):
+        return 0
+    hosts = collect_host_timings(xml_path)
+    if not hosts:
+        return 0
+
+    by_group = {}
+    if len(target_groups) == 1:
+        by_group[target_groups[0].id] = hosts
+    else:
+        matchers = build_group_matchers(target_groups)
+        for host in hosts:
+            group_id = match_target_group(matchers, host['ip_address'], host['hostnames'])
+            if group_id is not None:
+                by_group.setdefault(group_id, []).append(host)
+
+    for group_id, group_hosts in by_group.items():
+        db.session.add(build_timing_sample(group_id, scan_run_id, group_hosts))
+    return len(by_group)
+
+def derive_timing_options(samples):
+    """
+    Derive Nmap timing options from recent TargetGroupTiming samples of one group.
+    Returns an ordered dict of option -> value, empty if there is too little history.
+    """
+    samples = [s for s in samples if s.hosts_up and s.srtt_p90 is not None]
+    total_hosts = sum(s.hosts_up for s in samples)
+    if total_hosts < MIN_TIMING_HOSTS:
+        return {}
+
+    def weighted(attr):
+        pairs = [(getattr(s, attr), s.hosts_up) for s in samples if getattr(s, attr) is not None]
+        weight = sum(w for _, w in pairs)
+        return sum(v * w for v, w in pairs) / weight if weight else None
+
+    srtt_p90 = weighted('srtt_p90')
+    srtt_avg = weighted('srtt_avg') or srtt_p90
+    rttvar_avg = weighted('rttvar_avg') or 0
+    for upper_bound, max_retries, min_rate, min_hostgroup in LATENCY_CLASSES:
+        if upper_bound is None or srtt_p90 < upper_bound:
+            break
+    # A variance above the round trip time itself points at a lossy link; allow one more retry
+    if rttvar_avg > srtt_avg:
+        max_retries += 1
+
+    options = {
+        '--min-rate': str(min_rate),
+        '--max-retries': str(max_retries),
+        '--min-hostgroup': str(min_hostgroup)
+    }
+    durations = [s.host_seconds_max for s in samples if s.host_seconds_max is not None]
+    if durations:
+        host_timeout = max(MIN_HOST_TIMEOUT_SECONDS, int(math.ceil(max(durations) * HOST_TIMEOUT_FACTOR)))
+        options['--host-timeout'] = f"{host_timeout}s"
+    return options
+
+def _bootstrap_timing_history(scan_task, target_groups):
+    """Seed an empty timing history from the latest completed report of the task"""
+    report = ScanReport.query.join(ScanRun).filter(
+        ScanRun.task_id == scan_task.id,
+        ScanRun.status == 'completed'
+    ).order_by(ScanReport.id.desc()).first()
+    if report is None:
+        return
+    try:
+        if record_timing_samples(report.scan_run_id, report.xml_report_path, target_groups):
+            db.session.commit()
+    except (ET.ParseError, OSError) as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Could not read timing history from report {report.id}: {str(e)}")
+
+def get_group_timing_args(scan_task, nmap_args):
+    """
+    Return {target_group_id: options string} with the tuned timing options of each target
+    group of the task. Options already present in nmap_args are left to the profile.
+    Must be called within an app context.
+    """
+    groups = list(scan_task.target_groups)
+    if groups and all(g.timings.count() == 0 for g in groups):
+        _bootstrap_timing_history(scan_task, groups)
+
+    present = {arg.split('=', 1)[0] for arg in nmap_args.split()}
+    group_args = {}
+    for group in groups:
+        samples = group.timings.order_by(TargetGroupTiming.id.desc()).limit(TIMING_HISTORY_SAMPLES).all()
+        options = derive_timing_options(samples)
+        group_args[group.id] = ' '.join(f"{option} {value}" for option, value in options.items() if option not in present)
+    return group_args
+
+def record_run_timing(scan_run_id, xml_path):
+    """Record the timing samples of a completed run of a task with adaptive timing enabled"""
+    scan_run = ScanRun.query.get(scan_run_id)
+    if not scan_run or not scan_run.task or not scan_run.task.adaptive_timing:
+        return
+    try:
+        added = record_timing_samples(scan_run_id, xml_path, list(scan_run.task.target_groups))
+        db.session.commit()
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Recorded {added} target group timing sample(s)")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error recording timing samples: {str(e)}", exc_info=True)
+        return
+
+    comparison = timing_duration_comparison(scan_run.task)
+    if comparison['adaptive_runs'] and comparison['baseline_runs']:
+        current_app.logger.info(
+            f"[ScanRun {scan_run_id}] Adaptive timing: average duration {comparison['adaptive_avg']:.0f}s over "
+            f"{comparison['adaptive_runs']} run(s) vs {comparison['baseline_avg']:.0f}s over {comparison['baseline_runs']} run(s) before"
+        )
+
+def timing_duration_comparison(scan_task, limit=10):
+    """
+    Compare the durations of the task's recent completed runs with and without tuned timing options.
+    Returns a dict with the run counts, average durations in seconds and the change in percent.
+    """
+    runs = ScanRun.query.filter(
+        ScanRun.task_id == scan_task.id,
+        ScanRun.status == 'completed',
+        ScanRun.completed_at.isnot(None)
+    ).order_by(ScanRun.completed_at.desc()).limit(limit * 2).all()
+
+    baseline, adaptive = [], []
+    for run in runs:
+        duration = (run.completed_at - run.started_at).total_seconds() if run.started_at else None
+        if duration is None:
+            continue
+        tuned = any(run.get_timing_args().values())
+        (adaptive if tuned else baseline).append(duration)
+
+    baseline, adaptive = baseline[:limit], adaptive[:limit]
+    comparison = {
+        'baseline_runs': len(baseline),
+        'baseline_avg': sum(baseline) / len(baseline) if baseline else None,
+        'adaptive_runs': len(adaptive),
+        'adaptive_avg': sum(adaptive) / len(adaptive) if adaptive else None,
+        'change_pct': None
+    }
+    if comparison['baseline_avg'] and comparison['adaptive_avg'] is not None:
+        comparison['change_pct'] = (comparison['adaptive_avg'] - comparison['baseline_avg']) * 100.0 / comparison['baseline_avg']
+    return comparison
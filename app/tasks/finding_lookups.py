@@ -0,0 +1,193 @@
+"""
+Dictionary encoding of the service detection results of port findings. Service names, products,
+versions and CPEs are stored once in their lookup tables and port findings reference them by ID.
+IDs are interned in a per-process cache, so ingest only touches the lookup tables for values it
+has not seen before. IDs of values found or inserted in a transaction are only cached once it commits.
+Databases created before the encoding are converted by migrate_legacy_port_findings().
+"""
+import logging
+import threading
+from sqlalchemy import event, insert, select, update, bindparam, inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from app import db
+from app.utils.schema_upgrade import add_missing_columns
+from app.models.report import ServiceName, ServiceProduct, ServiceVersion, ServiceCpe, PortFinding, HostFinding
+
+LOOKUP_MODELS = {
+    'service_name': ServiceName,
+    'product': ServiceProduct,
+    'version': ServiceVersion,
+    'cpe': ServiceCpe
+}
+LOOKUP_VALUE_LENGTH = 255
+LOOKUP_QUERY_CHUNK_SIZE = 500
+# Caches are dropped when they outgrow this many values per table, e.g. after years of distinct versions
+LOOKUP_CACHE_MAX_VALUES = 100000
+
+# Text columns of port_findings replaced by the lookup table IDs
+LEGACY_PORT_COLUMNS = ('service', 'version')
+LEGACY_MIGRATION_CHUNK_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+_cache = {model: {} for model in LOOKUP_MODELS.values()}
+_cache_lock = threading.Lock()
+
+def normalize_lookup_value(value):
+    if value is None:
+        return None
+    value = str(value).strip()[:LOOKUP_VALUE_LENGTH]
+    return value or None
+
+def _pending(session):
+    return session.info.setdefault('pending_lookup_ids', {})
+
+@event.listens_for(db.session, 'after_commit')
+def _promote_pending_ids(session):
+    pending = session.info.pop('pending_lookup_ids', None)
+    if not pending:
+        return
+    with _cache_lock:
+        for model, ids in pending.items():
+            cache = _cache[model]
+            if len(cache) + len(ids) > LOOKUP_CACHE_MAX_VALUES:
+                cache.clear()
+            cache.update(ids)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending_ids(session):
+    # Values inserted by the rolled back transaction no longer exist
+    session.info.pop('pending_lookup_ids', None)
+
+def _insert_missing(model, values):
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+    rows = [{'value': value} for value in values]
+    if dialect in ('sqlite', 'postgresql'):
+        # Another process may insert the same value first; its row is picked up by the select below
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        db.session.execute(dialect_insert(table).on_conflict_do_nothing(index_elements=['value']), rows)
+        return
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(table), row)
+        except IntegrityError:
+            pass
+
+def _select_ids(model, values):
+    ids = {}
+    values = list(values)
+    for start in range(0, len(values), LOOKUP_QUERY_CHUNK_SIZE):
+        rows = db.session.execute(
+            select(model.value, model.id).where(model.value.in_(values[start:start + LOOKUP_QUERY_CHUNK_SIZE]))
+        ).all()
+        ids.update((value, lookup_id) for value, lookup_id in rows)
+    return ids
+
+def resolve_lookup_ids(model, values):
+    """
+    Return a dict mapping each normalized value to its ID in a lookup table, inserting the values
+    that are not there yet. The caller is responsible for committing the session.
+    """
+    values = {value for value in (normalize_lookup_value(value) for value in values) if value}
+    if not values:
+        return {}
+    pending = _pending(db.session).setdefault(model, {})
+    with _cache_lock:
+        cache = _cache[model]
+        ids = {value: cache[value] for value in values if value in cache}
+    ids.update((value, pending[value]) for value in values - set(ids) if value in pending)
+    missing = values - set(ids)
+    if missing:
+        found = _select_ids(model, missing)
+        if len(found) < len(missing):
+            _insert_missing(model, missing - set(found))
+            found.update(_select_ids(model, missing - set(found)))
+        pending.update(found)
+        ids.update(found)
+    return ids
+
+def encode_port_rows(port_rows):
+    """
+    Replace the service_name, product, version and cpe values of port row dicts (as built from
+    parsed host dicts) with the *_id foreign keys of their lookup tables, in place.
+    """
+    for key, model in LOOKUP_MODELS.items():
+        ids = resolve_lookup_ids(model, (row.get(key) for row in port_rows))
+        for row in port_rows:
+            row[f'{key}_id'] = ids.get(normalize_lookup_value(row.pop(key, None)))
+    return port_rows
+
+def find_hosts_with_product(product, report_ids=None):
+    """Return the host findings with an open port running a product, optionally limited to some reports"""
+    query = HostFinding.query.join(PortFinding, PortFinding.host_id == HostFinding.id) \
+        .join(ServiceProduct, ServiceProduct.id == PortFinding.product_id) \
+        .filter(ServiceProduct.value == product, PortFinding.state == 'open')
+    if report_ids is not None:
+        query = query.filter(HostFinding.report_id.in_(report_ids))
+    return query.distinct().all()
+
+def _backfill_legacy_port_rows(chunk_size):
+    """Encode the service and version text of old port rows in chunks, one transaction each"""
+    legacy = text(
+        "SELECT id, service, version FROM port_findings WHERE id > :last_id "
+        "AND (service IS NOT NULL OR version IS NOT NULL) "
+        "AND service_name_id IS NULL AND product_id IS NULL AND version_id IS NULL ORDER BY id LIMIT :limit"
+    )
+    encoded_columns = ('service_name_id', 'product_id', 'version_id')
+    # Bound parameter names may not repeat the column names of an UPDATE
+    statement = update(PortFinding.__table__).where(PortFinding.__table__.c.id == bindparam('row_id')) \
+        .values({name: bindparam(f'new_{name}') for name in encoded_columns})
+    last_id = 0
+    converted = 0
+    while True:
+        rows = db.session.execute(legacy, {'last_id': last_id, 'limit': chunk_size}).all()
+        if not rows:
+            return converted
+        port_rows = []
+        for row_id, service, version in rows:
+            # The old column joined name, product and extra info with spaces; service names never
+            # contain spaces, so the first word is the name and the rest is kept as the product
+            name, _, product = (service or '').strip().partition(' ')
+            port_rows.append({'row_id': row_id, 'service_name': name, 'product': product, 'version': version})
+        encode_port_rows(port_rows)
+        db.session.execute(statement, [
+            dict(row_id=port_row['row_id'], **{f'new_{name}': port_row[name] for name in encoded_columns}) for port_row in port_rows
+        ])
+        db.session.commit()
+        converted += len(rows)
+        last_id = rows[-1][0]
+
+def migrate_legacy_port_findings(chunk_size=LEGACY_MIGRATION_CHUNK_SIZE):
+    """
+    Convert a port_findings table of a database created before dictionary encoding: add the lookup
+    ID columns, fill the lookup tables and IDs from the old service/version text, then drop the text
+    columns. Safe to run again; does nothing on an up-to-date table. The lookup tables must exist
+    (db.create_all()). Must be called within an app context. Returns the number of rows converted.
+    """
+    inspector = inspect(db.engine)
+    if not inspector.has_table(PortFinding.__tablename__):
+        return 0
+    existing_columns = {column['name'] for column in inspector.get_columns(PortFinding.__tablename__)}
+    legacy_columns = [name for name in LEGACY_PORT_COLUMNS if name in existing_columns]
+    added = add_missing_columns(PortFinding.__table__)
+    if added:
+        logger.info(f"Added columns {', '.join(added)} to {PortFinding.__tablename__}")
+    if not legacy_columns:
+        return 0
+
+    converted = _backfill_legacy_port_rows(chunk_size) if set(LEGACY_PORT_COLUMNS) <= existing_columns else 0
+    logger.info(f"Encoded the service and version of {converted} port findings")
+    for name in legacy_columns:
+        try:
+            db.session.execute(text(f"ALTER TABLE {PortFinding.__tablename__} DROP COLUMN {name}"))
+            db.session.commit()
+        except (OperationalError, ProgrammingError) as e:
+            # SQLite before 3.35 cannot drop columns; the nullable leftovers are ignored by the model
+            db.session.rollback()
+            logger.warning(f"Could not drop the old {name} column of {PortFinding.__tablename__}: {str(e)}")
+    return converted
@@ -0,0 +1,137 @@
+"""
+Host liveness cache: every completed report updates a per-address count of consecutive runs
+the host was down in. Scheduled runs exclude addresses that were down for the last N runs,
+and a periodic full sweep scans everything again so newly alive hosts are not missed.
+"""
+import os
+import ipaddress
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update
+from flask import current_app
+from app import db
+from app.models.task import ScanRun
+from app.models.report import HostFinding, HostLiveness
+from app.models.settings import SystemSettings
+
+# Number of addresses per IN (...) lookup and per executemany batch
+LIVENESS_CHUNK_SIZE = 500
+
+def liveness_exclude_path(xml_output):
+    """Path of the --excludefile written next to the run's XML output"""
+    return f"{os.path.splitext(xml_output)[0]}_exclude.txt"
+
+def remove_liveness_exclude_file(xml_output):
+    try:
+        os.remove(liveness_exclude_path(xml_output))
+    except OSError:
+        pass
+
+def _target_networks(targets):
+    networks = []
+    for target in targets:
+        try:
+            networks.append(ipaddress.ip_network(target.strip(), strict=False))
+        except ValueError:
+            continue  # Hostnames are never excluded
+    return networks
+
+def get_dead_hosts(targets, down_runs):
+    """Return the addresses within targets that were down in at least the last down_runs reports"""
+    networks = _target_networks(targets)
+    if not networks:
+        return []
+    dead_hosts = []
+    rows = db.session.query(HostLiveness.ip_address).filter(HostLiveness.consecutive_down >= down_runs)
+    for (ip_address,) in rows.yield_per(LIVENESS_CHUNK_SIZE):
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            continue
+        if any(address in network for network in networks):
+            dead_hosts.append(ip_address)
+    return sorted(dead_hosts, key=ipaddress.ip_address)
+
+def write_exclude_file(exclude_path, addresses):
+    """Write the addresses a run skips to its --excludefile"""
+    with open(exclude_path, 'w') as exclude_file:
+        exclude_file.write('\n'.join(sorted(set(addresses), key=ipaddress.ip_address)) + '\n')
+
+def plan_liveness_exclusion(scan_task, targets):
+    """
+    Decide whether a scheduled run of scan_task skips known dead hosts.
+    Must be called within an app context.
+    Returns (addresses to skip, full_sweep).
+    """
+    down_runs = SystemSettings.get_int('liveness_skip_down_runs', 3)
+    if down_runs <= 0:
+        return [], False
+
+    sweep_days = SystemSettings.get_int('liveness_full_sweep_days', 7)
+    last_sweep = scan_task.last_full_sweep_at
+    if last_sweep is None or datetime.utcnow() - last_sweep >= timedelta(days=sweep_days):
+        return [], True
+
+    return get_dead_hosts(targets, down_runs), False
+
+def update_host_liveness(report_id, checked_at):
+    """
+    Update the liveness history from the host findings of a report.
+    Must be called within an app context; the caller commits.
+    Returns the number of addresses updated.
+    """
+    statuses = {}
+    rows = db.session.query(HostFinding.ip_address, HostFinding.status).filter(HostFinding.report_id == report_id)
+    for ip_address, status in rows:
+        if status not in ('up', 'down'):
+            continue
+        try:
+            ipaddress.ip_address(ip_address)
+        except ValueError:
+            continue
+        statuses[ip_address] = status
+
+    addresses = list(statuses)
+    existing = {}
+    for start in range(0, len(addresses), LIVENESS_CHUNK_SIZE):
+        chunk = addresses[start:start + LIVENESS_CHUNK_SIZE]
+        for row in db.session.query(HostLiveness.id, HostLiveness.ip_address, HostLiveness.consecutive_down, HostLiveness.last_seen_up).filter(HostLiveness.ip_address.in_(chunk)):
+            existing[row.ip_address] = row
+
+    updates, inserts = [], []
+    for ip_address, status in statuses.items():
+        is_up = status == 'up'
+        row = existing.get(ip_address)
+        values = {
+            'consecutive_down': 0 if is_up else ((row.consecutive_down or 0) + 1 if row else 1),
+            'last_status': status,
+            'last_seen_up': checked_at if is_up else (row.last_seen_up if row else None),
+            'last_checked': checked_at
+        }
+        if row:
+            values['id'] = row.id
+            updates.append(values)
+        else:
+            values['ip_address'] = ip_address
+            inserts.append(values)
+
+    for start in range(0, len(updates), LIVENESS_CHUNK_SIZE):
+        db.session.execute(update(HostLiveness), updates[start:start + LIVENESS_CHUNK_SIZE])
+    for start in range(0, len(inserts), LIVENESS_CHUNK_SIZE):
+        db.session.execute(insert(HostLiveness), inserts[start:start + LIVENESS_CHUNK_SIZE])
+    return len(statuses)
+
+def record_run_liveness(scan_run_id, report_id):
+    """Update the liveness history after a completed run and note the task's last full sweep"""
+    try:
+        scan_run = ScanRun.query.get(scan_run_id)
+        if not scan_run:
+            return
+        checked_at = scan_run.completed_at or datetime.utcnow()
+        updated = update_host_liveness(report_id, checked_at)
+        if scan_run.full_sweep and scan_run.task:
+            scan_run.task.last_full_sweep_at = checked_at
+        db.session.commit()
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Updated liveness history of {updated} address(es)")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error updating host liveness: {str(e)}", exc_info=True)
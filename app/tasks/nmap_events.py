@@ -0,0 +1,221 @@
+"""
+Parser of Nmap's verbose console output (-v with --stats-every).
+Every line is turned into a typed event with precompiled patterns, picked by the line's first
+word so that most lines are tried against a single pattern. A ScanPhaseTracker folds the events
+of one Nmap process into its current phase, the phase's progress and its estimated completion.
+"""
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# Event kinds
+PHASE_STARTED = 'phase_started'
+PHASE_FINISHED = 'phase_finished'
+PROGRESS = 'progress'
+STATS = 'stats'
+HOST_UP = 'host_up'
+HOST_DOWN = 'host_down'
+PORT_DISCOVERED = 'port_discovered'
+WARNING = 'warning'
+PRIVILEGE_ERROR = 'privilege_error'
+FATAL = 'fatal'
+SCAN_DONE = 'scan_done'
+# Kinds of events after which a run's progress, phase or ETA should be reported
+PROGRESS_EVENTS = frozenset((PROGRESS, PHASE_STARTED, PHASE_FINISHED, STATS, SCAN_DONE))
+
+NmapEvent = namedtuple(
+    'NmapEvent',
+    ['kind', 'phase', 'percent', 'remaining_seconds', 'host', 'port', 'protocol', 'hosts_completed', 'hosts_up', 'message'],
+    defaults=(None,) * 9
+)
+
+# "Initiating SYN Stealth Scan at 12:00", "Initiating OS detection (try #1) against 10.0.0.1"
+PHASE_STARTED_PREFIX = 'Initiating '
+# "Completed SYN Stealth Scan at 12:01, 4.20s elapsed (1000 total ports)", "Completed NSE against 10.0.0.1 at 12:02";
+# "Completed SYN Stealth Scan against 10.0.0.1 in 4.20s" (one host of a phase) has no event
+PHASE_FINISHED_PREFIX = 'Completed '
+# Clock time after " at " in those lines; the phase name is split off with string methods, which
+# is several times faster than matching the whole line with a lazy pattern
+CLOCK_RE = re.compile(r'\d{1,2}:\d\d')
+# "SYN Stealth Scan Timing: About 12.50% done; ETC: 12:05 (0:03:10 remaining)", matched after the phase name
+PROGRESS_MARKER = ' Timing: About '
+PROGRESS_LINE_RE = re.compile(r'([\d.]+)% done(?:; ETC: \d{1,2}:\d\d \((\d+):(\d\d):(\d\d) remaining\))?')
+# "Stats: 0:00:12 elapsed; 3 hosts completed (2 up), 1 undergoing SYN Stealth Scan"
+STATS_RE = re.compile(r'Stats: \S+ elapsed; (\d+) hosts? completed \((\d+) up\), \d+ undergoing (.+)$')
+# "Discovered open port 443/tcp on 10.0.0.1"
+PORT_DISCOVERED_RE = re.compile(r'Discovered open port (\d+)/(\w+) on (\S+)')
+# "Nmap scan report for host.example.com (10.0.0.1)", "Nmap scan report for 10.0.0.2 [host down]"
+HOST_REPORT_PREFIX = 'Nmap scan report for '
+HOST_DOWN_SUFFIX = ' [host down]'
+# "Nmap done: 256 IP addresses (3 hosts up) scanned in 12.34 seconds"
+SCAN_DONE_RE = re.compile(r'Nmap done: \d+ IP address(?:es)? \((\d+) hosts? up\)')
+WARNING_RE = re.compile(r'(?:Warning|WARNING): (.*)')
+# Messages of options Nmap cannot run without root, searched anywhere in the line
+PRIVILEGE_ERROR_RE = re.compile(r'requires root privileges|requires privileged access')
+
+def _phase_started(line):
+    phase = line[len(PHASE_STARTED_PREFIX):]
+    head, against, target = phase.partition(' against ')
+    if against and target:
+        phase = head
+    else:
+        head, at, clock = phase.rpartition(' at ')
+        if at and CLOCK_RE.fullmatch(clock):
+            phase = head
+    if not phase:
+        return None
+    return NmapEvent(PHASE_STARTED, phase=phase.rstrip('.'))
+
+def _phase_finished(line):
+    at = line.find(' at ', len(PHASE_FINISHED_PREFIX))
+    while at != -1 and not CLOCK_RE.match(line, at + 4):
+        at = line.find(' at ', at + 1)
+    if at == -1:
+        return None
+    phase = line[len(PHASE_FINISHED_PREFIX):at]
+    head, against, target = phase.rpartition(' against ')
+    if against and target and ' ' not in target:
+        phase = head
+    if not phase:
+        return None
+    return NmapEvent(PHASE_FINISHED, phase=phase.rstrip('.'))
+
+def _stats(line):
+    match = STATS_RE.match(line)
+    if not match:
+        return None
+    return NmapEvent(STATS, phase=match.group(3), hosts_completed=int(match.group(1)), hosts_up=int(match.group(2)))
+
+def _port_discovered(line):
+    match = PORT_DISCOVERED_RE.match(line)
+    if not match:
+        return None
+    port, protocol, host = match.groups()
+    return NmapEvent(PORT_DISCOVERED, host=host, port=int(port), protocol=protocol)
+
+def _nmap_line(line):
+    if line.startswith(HOST_REPORT_PREFIX):
+        if line.endswith(HOST_DOWN_SUFFIX):
+            host = line[len(HOST_REPORT_PREFIX):-len(HOST_DOWN_SUFFIX)]
+            return NmapEvent(HOST_DOWN, host=host)
+        return NmapEvent(HOST_UP, host=line[len(HOST_REPORT_PREFIX):])
+    match = SCAN_DONE_RE.match(line)
+    if match:
+        return NmapEvent(SCAN_DONE, percent=100.0, hosts_up=int(match.group(1)), message=line)
+    return None
+
+def _warning(line):
+    match = WARNING_RE.match(line)
+    return NmapEvent(WARNING, message=match.group(1)) if match else None
+
+# Parser of the lines starting with each word
+_PARSERS_BY_FIRST_WORD = {
+    'Initiating': _phase_started,
+    'Completed': _phase_finished,
+    'Stats:': _stats,
+    'Discovered': _port_discovered,
+    'Nmap': _nmap_line,
+    'Warning:': _warning,
+    'WARNING:': _warning,
+}
+# First characters of those words; other lines skip the word lookup
+_FIRST_CHARS = frozenset(word[0] for word in _PARSERS_BY_FIRST_WORD)
+
+def parse_nmap_line(line):
+    """Return the event of a stripped line of Nmap output, or None for lines without one"""
+    if line[:1] in _FIRST_CHARS:
+        parser = _PARSERS_BY_FIRST_WORD.get(line.partition(' ')[0])
+        if parser:
+            event = parser(line)
+            if event:
+                return event
+    if PROGRESS_MARKER in line:
+        marker = line.find(PROGRESS_MARKER)
+        match = PROGRESS_LINE_RE.match(line, marker + len(PROGRESS_MARKER))
+        if match:
+            percent, hours, minutes, seconds = match.groups()
+            remaining = int(hours) * 3600 + int(minutes) * 60 + int(seconds) if hours else None
+            return NmapEvent(PROGRESS, phase=line[:marker], percent=float(percent), remaining_seconds=remaining)
+    if 'privilege' in line and PRIVILEGE_ERROR_RE.search(line):
+        return NmapEvent(PRIVILEGE_ERROR, message=line)
+    if line.startswith('QUITTING!'):
+        return NmapEvent(FATAL, message=line)
+    return None
+
+class ScanPhaseTracker:
+    """
+    State of one Nmap process built from its output events: the phase it is in, how far that
+    phase is, when Nmap expects to finish it, and whether the scan is done or failed.
+    progress is the last percentage Nmap printed, which the run's progress bar shows.
+    feed() parses a line, updates the state and returns the line's event (or None).
+    """
+
+    def __init__(self):
+        self.progress = 0.0
+        self.phase = None
+        self.phase_progress = 0.0
+        self.eta = None
+        self.done = False
+        self.hosts_up = 0
+        self.ports_found = 0
+        self.warnings = 0
+        self.privilege_error = None
+        self.fatal_error = None
+
+    def feed(self, line):
+        event = parse_nmap_line(line)
+        if event is not None:
+            self.apply(event)
+        return event
+
+    def apply(self, event):
+        kind = event.kind
+        if kind == PROGRESS:
+            self.progress = event.percent
+            self.phase = event.phase
+            self.phase_progress = event.percent
+            if event.remaining_seconds is not None:
+                self.eta = datetime.utcnow() + timedelta(seconds=event.remaining_seconds)
+        elif kind == PHASE_STARTED:
+            self.phase = event.phase
+            self.phase_progress = 0.0
+            self.eta = None
+        elif kind == PHASE_FINISHED:
+            if event.phase == self.phase:
+                self.phase_progress = 100.0
+                self.eta = None
+        elif kind == STATS:
+            if event.phase != self.phase:
+                self.phase = event.phase
+                self.phase_progress = 0.0
+                self.eta = None
+        elif kind == PORT_DISCOVERED:
+            self.ports_found += 1
+        elif kind == HOST_UP:
+            self.hosts_up += 1
+        elif kind == WARNING:
+            self.warnings += 1
+        elif kind == PRIVILEGE_ERROR:
+            self.privilege_error = event.message
+        elif kind == FATAL:
+            self.fatal_error = self.privilege_error or event.message
+        elif kind == SCAN_DONE:
+            self.done = True
+            self.progress = 100.0
+            self.phase_progress = 100.0
+            self.eta = None
+            self.hosts_up = event.hosts_up
+
+def combine_phase_trackers(trackers, weights):
+    """
+    Combine the trackers of the Nmap processes of one run (e.g. its shards) into the run's
+    (progress, phase, phase_progress, eta). Progress is weighted by the given weights; the phase
+    reported is that of the unfinished process expected to finish last.
+    """
+    total_weight = sum(weights) or 1
+    progress = sum(tracker.progress * weight for tracker, weight in zip(trackers, weights)) / total_weight
+    running = [tracker for tracker in trackers if not tracker.done and tracker.phase]
+    if not running:
+        return progress, None, None, None
+    slowest = max(running, key=lambda tracker: (tracker.eta or datetime.max, -tracker.phase_progress))
+    return progress, slowest.phase, slowest.phase_progress, slowest.eta
@@ -0,0 +1,151 @@
+"""
+Preflight of the Nmap installation: the version and compiled-in features of the binary, and how
+this host can give it the raw socket privileges some scans need (running as root, cap_net_raw and
+cap_net_admin file capabilities on the binary, or passwordless sudo). The probe runs once when the
+worker pool starts and its result is handed to every pool process; each scan's arguments are
+checked against it before Nmap is launched, so Nmap is never restarted under sudo mid-scan.
+"""
+import os
+import re
+import shlex
+import struct
+import shutil
+import threading
+import subprocess
+from collections import namedtuple
+from flask import current_app
+
+NmapCapabilities = namedtuple('NmapCapabilities', [
+    'nmap_path',
+    'version',
+    'compiled_with',
+    'compiled_without',
+    'is_root',
+    'file_capabilities',
+    'passwordless_sudo',
+    'error'
+])
+
+VERSION_RE = re.compile(r'Nmap version (\S+)')
+COMPILED_WITH_RE = re.compile(r'^Compiled with: (.*)$', re.MULTILINE)
+COMPILED_WITHOUT_RE = re.compile(r'^Compiled without: (.*)$', re.MULTILINE)
+
+# Capability bits (linux/capability.h) Nmap needs to send raw packets
+CAP_NET_ADMIN = 12
+CAP_NET_RAW = 13
+# Letters of -s scan types Nmap refuses to run without raw socket privileges (e.g. -sS, -sU, -sSU)
+PRIVILEGED_SCAN_TYPES = frozenset('SUAWMNFXOYZI')
+# Options Nmap refuses to run without them; -A implies OS detection
+PRIVILEGED_OPTIONS = frozenset(('-O', '-A', '--osscan-guess', '--osscan-limit', '--traceroute'))
+PROBE_TIMEOUT = 15
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+def _run_probe(argv):
+    try:
+        return subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+def _has_raw_socket_file_capabilities(nmap_path):
+    """Return True if the Nmap binary carries cap_net_raw and cap_net_admin in its permitted file capabilities"""
+    try:
+        data = os.getxattr(os.path.realpath(nmap_path), 'security.capability')
+    except (OSError, AttributeError):
+        return False
+    if len(data) < 8:
+        return False
+    # struct vfs_cap_data: magic_etc, then the low 32 bits of the permitted set
+    permitted = struct.unpack_from('<II', data)[1]
+    required = (1 << CAP_NET_RAW) | (1 << CAP_NET_ADMIN)
+    return permitted & required == required
+
+def probe_nmap_capabilities(nmap_path):
+    """Probe the Nmap binary and the ways it can be given privileges; never raises"""
+    is_root = os.geteuid() == 0
+    result = _run_probe([nmap_path, '-V'])
+    if result is None or result.returncode != 0:
+        output = (result.stdout.strip() if result else '') or 'not executable'
+        return NmapCapabilities(nmap_path, None, (), (), is_root, False, False, f"Cannot run {nmap_path} -V: {output}")
+
+    version = VERSION_RE.search(result.stdout)
+    compiled_with = COMPILED_WITH_RE.search(result.stdout)
+    compiled_without = COMPILED_WITHOUT_RE.search(result.stdout)
+    file_capabilities = not is_root and _has_raw_socket_file_capabilities(nmap_path)
+
+    passwordless_sudo = False
+    if not is_root and not file_capabilities and shutil.which('sudo'):
+        # -n fails instead of prompting; the probe also checks the sudoers rule covers this binary
+        sudo_result = _run_probe(['sudo', '-n', nmap_path, '-V'])
+        passwordless_sudo = bool(sudo_result and sudo_result.returncode == 0)
+
+    return NmapCapabilities(
+        nmap_path,
+        version.group(1) if version else None,
+        tuple(compiled_with.group(1).split()) if compiled_with else (),
+        tuple(compiled_without.group(1).split()) if compiled_without else (),
+        is_root,
+        file_capabilities,
+        passwordless_sudo,
+        None
+    )
+
+def set_nmap_capabilities(capabilities):
+    """Install a probe result in this process; used as the worker pool initializer"""
+    global _capabilities
+    with _capabilities_lock:
+        _capabilities = capabilities
+
+def get_nmap_capabilities(nmap_path=None):
+    """Return the cached probe result of this process, probing the binary on first use"""
+    global _capabilities
+    nmap_path = nmap_path or current_app.config.get('NMAP_PATH', '/usr/bin/nmap')
+    with _capabilities_lock:
+        if _capabilities is None or _capabilities.nmap_path != nmap_path:
+            _capabilities = probe_nmap_capabilities(nmap_path)
+            current_app.logger.info(f"Nmap preflight: {describe_nmap_capabilities(_capabilities)}")
+        return _capabilities
+
+def privileged_options(nmap_args):
+    """Return the options in an argument string that need raw socket privileges"""
+    found = []
+    for token in shlex.split(nmap_args):
+        if token in PRIVILEGED_OPTIONS:
+            found.append(token)
+        elif token.startswith('-s') and len(token) > 2 and not token.startswith('--') and PRIVILEGED_SCAN_TYPES.intersection(token[2:]):
+            found.append(token)
+    return found
+
+def plan_privileges(nmap_args, capabilities):
+    """
+    Decide how Nmap has to be launched for the given arguments.
+    Returns (command_prefix, extra_args, error); error is set if the scan cannot run on this host.
+    """
+    options = privileged_options(nmap_args)
+    if not options or capabilities.is_root:
+        return '', '', None
+    if capabilities.file_capabilities:
+        # Nmap only uses the capabilities of its binary when told it is privileged
+        return '', '--privileged', None
+    if capabilities.passwordless_sudo:
+        return 'sudo -n ', '', None
+    return '', '', (
+        f"Nmap options {' '.join(options)} require root privileges, but the scan worker is not root, "
+        f"passwordless sudo for {capabilities.nmap_path} is not configured and the binary has no "
+        f"cap_net_raw,cap_net_admin file capabilities"
+    )
+
+def describe_nmap_capabilities(capabilities):
+    """One-line summary of a probe result for logs and the admin page"""
+    if capabilities.error:
+        return capabilities.error
+    if capabilities.is_root:
+        privileges = 'running as root'
+    elif capabilities.file_capabilities:
+        privileges = 'raw sockets via file capabilities (--privileged)'
+    elif capabilities.passwordless_sudo:
+        privileges = 'privileged scans via passwordless sudo'
+    else:
+        privileges = 'unprivileged scans only'
+    return f"Nmap {capabilities.version or 'unknown version'} at {capabilities.nmap_path}; {privileges}"
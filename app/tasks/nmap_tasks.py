@@ -2,28 +2,62 @@ import os
 import json
 import time
 import subprocess
-import xml.etree.ElementTree as ET
 from datetime import datetime
 import signal
 import atexit
 import sys
+from collections import deque
 from app import db
 from app.models.task import ScanRun
-from app.models.report import ScanReport, HostFinding, PortFinding
+from app.models.report import ScanReport
 from flask import current_app
-import nmap
 from app.utils.sanitize import sanitize_nmap_command, sanitize_nmap_targets
 from app.utils.validators import validate_nmap_args
 from app.utils.decorators import sqlite_task_lock
+from app.utils.target_sharding import shard_targets
+from app.tasks.sharded_scan import run_sharded_nmap_scan
+from app.tasks.report_parsing import iter_report_hosts, insert_host_findings
+from app.tasks.streaming_ingest import StreamingReportIngester
+from app.tasks.process_monitor import ProcessOutputMonitor, SIGNIFICANT_OUTPUT_RE, OUTPUT_BUFFER_LINES
+from app.tasks.nmap_events import ScanPhaseTracker, PROGRESS_EVENTS, SCAN_DONE
+from app.tasks.progress import get_progress_reporter
+from app.tasks.scan_resume import is_resumable_log, build_resume_command, repair_resumed_xml
+from app.tasks.adaptive_timing import get_group_timing_args, record_run_timing
+from app.tasks.port_statistics import build_learned_profile_args
+from app.tasks.host_liveness import liveness_exclude_path, write_exclude_file, plan_liveness_exclusion, remove_liveness_exclude_file, record_run_liveness
+from app.tasks.resource_limits import get_resource_limits, build_resource_prefix
+from app.tasks.rate_budget import reserve_rate_budget, strip_max_rate, cap_min_rate
+from app.tasks.result_cache import result_cache_key, get_result_cache_ttl, plan_cached_targets, cache_run_results, merge_cached_hosts, complete_from_cache
+from app.tasks.nmap_preflight import get_nmap_capabilities, plan_privileges
+from app.tasks.scan_deadline import get_scan_deadline_seconds, start_scan_deadline, salvage_partial_xml
+from app.tasks.report_artifacts import compress_report_artifacts
+from app.tasks.scan_engines import ENGINE_NMAP, ENGINE_SWEEP, get_scan_engine, plan_port_sweep, build_service_args, run_sweep_scan
 
-@sqlite_task_lock(key_template="lock:run_nmap_scan:task_id_{scan_task_id_for_lock}", expire=43200) # 12 hours expire
-def run_nmap_scan(scan_run_id, scan_task_id_for_lock):
+def select_nmap_args(scan_task):
     """
-    Run an Nmap scan as a background Celery task.
-    scan_task_id_for_lock is the ID of the parent ScanTask, used for locking to prevent concurrent runs of the same conceptual task.
+    Return the Nmap arguments of a scan task: its predefined or learned profile, its custom
+    arguments, or a quick scan. Must be called within an app context.
+    """
+    scan_profile = scan_task.scan_profile
+    nmap_profiles = current_app.config['NMAP_SCAN_PROFILES']
+    if scan_profile and scan_profile == current_app.config.get('NMAP_LEARNED_PROFILE'):
+        nmap_args = build_learned_profile_args(scan_task)
+        current_app.logger.info(f"[ScanTask {scan_task.id}] Learned top ports profile: {nmap_args}")
+        return nmap_args
+    if scan_profile and scan_profile in nmap_profiles:
+        return nmap_profiles[scan_profile]
+    if scan_task.custom_args:
+        return scan_task.custom_args
+    return '-T4 -F'  # Default to quick scan
+
+def prepare_nmap_scan(scan_run_id):
+    """
+    Mark a scan run as starting and build everything needed to launch Nmap for it:
+    targets, sanitized arguments, output paths, privilege prefix and the optional shard split.
+
+    Returns (plan, None) on success, or (None, result) when the run failed during preparation,
+    where result is the value the task should return.
     """
-    # The on_task_exit function (formerly for Celery) is no longer needed.
-    # This function should run within an existing app context provided by the scheduler.
     with current_app.app_context():
         # Get the scan run from the database
         scan_run = ScanRun.query.get(scan_run_id)
@@ -32,8 +66,12 @@ def run_nmap_scan(scan_run_id, scan_task_id_for_lock):
             current_app.logger.error(error_msg)
             print(f"ERROR: {error_msg}", file=sys.stdout)
             sys.stdout.flush()
-            return
+            return None, None
     
+        # A run requeued after a crash continues from its resume log
+        resume_log = scan_run.resume_log_path if scan_run.resume_pending else None
+        resume_xml_output = scan_run.xml_output_path
+        
         # Update scan run status to 'starting'
         scan_run.status = 'starting'
         scan_run.started_at = datetime.utcnow()
@@ -41,162 +79,411 @@ def run_nmap_scan(scan_run_id, scan_task_id_for_lock):
         sys.stdout.flush()
         db.session.commit() # Moved inside the context
     
-    try:
-        # Variables to store data outside the app context
-        targets = []
-        scan_profile = None
-        custom_args = None
+    # Variables to store data outside the app context
+    targets = []
+    scan_profile = None
+    shard_count = 1
+    group_targets = []
+    group_timing_args = {}
+    
+    with current_app.app_context():
+        # Get the scan task and target groups - need to refresh the scan_run object
+        scan_run = ScanRun.query.get(scan_run_id)
+        scan_task = scan_run.task
         
-        with current_app.app_context():
-            # Get the scan task and target groups - need to refresh the scan_run object
-            scan_run = ScanRun.query.get(scan_run_id)
-            scan_task = scan_run.task
-            
-            # Store the scan profile and custom args for later use
-            scan_profile = scan_task.scan_profile
-            custom_args = scan_task.custom_args
-            
-            # Get all target groups and their targets
-            for group in scan_task.target_groups:
-                for target in group.targets:
-                    targets.append(target.value)
-            
-            if not targets:
-                scan_run.status = 'failed'
-                scan_run.completed_at = datetime.utcnow()
-                db.session.commit()
-                message = "No targets specified"
-                current_app.logger.error(f"[ScanRun {scan_run_id}] {message} for scan_run_id: {scan_run_id}")
-                scan_run.error_message = message
-                db.session.commit()
-                return {'status': 'failed', 'message': message, 'scan_run_id': scan_run_id}
+        # Store the scan profile for later use
+        scan_profile = scan_task.scan_profile
+        shard_count = scan_task.shard_count or 1
+        adaptive_timing = bool(scan_task.adaptive_timing)
+        is_scheduled = bool(scan_task.is_scheduled)
+        deadline_seconds = get_scan_deadline_seconds(scan_task)
+        scan_engine = get_scan_engine(scan_task)
         
-        # Create a unique identifier for this scan
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        scan_id = f"scan_{scan_run_id}_{timestamp}"
+        # Get all target groups and their targets
+        for group in scan_task.target_groups:
+            group_values = [target.value for target in group.targets]
+            group_targets.append((group.id, group_values))
+            targets.extend(group_values)
         
-        # Get the reports directory and prepare output paths
+        if not targets:
+            scan_run.status = 'failed'
+            scan_run.completed_at = datetime.utcnow()
+            db.session.commit()
+            message = "No targets specified"
+            current_app.logger.error(f"[ScanRun {scan_run_id}] {message} for scan_run_id: {scan_run_id}")
+            scan_run.error_message = message
+            db.session.commit()
+            return None, {'status': 'failed', 'message': message, 'scan_run_id': scan_run_id}
+    
+    # Create a unique identifier for this scan
+    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    scan_id = f"scan_{scan_run_id}_{timestamp}"
+    
+    # Get the reports directory and prepare output paths
+    with current_app.app_context():
+        reports_dir = current_app.config['NMAP_REPORTS_DIR']
+        max_shards = current_app.config.get('NMAP_MAX_SHARDS', 8)
+        result_cache_ttl = get_result_cache_ttl(scan_profile)
+    
+    # Ensure reports directory exists
+    os.makedirs(reports_dir, exist_ok=True)
+    
+    # Prepare output file paths
+    xml_output = os.path.join(reports_dir, f"{scan_id}.xml")
+    normal_output = os.path.join(reports_dir, f"{scan_id}.txt")
+    
+    # Prepare Nmap arguments
+    with current_app.app_context():
+        nmap_args = select_nmap_args(ScanRun.query.get(scan_run_id).task)
+
+    # Timing options tuned from the history of each target group; when all groups agree they
+    # are added to the common arguments, otherwise every group is scanned by its own process
+    if adaptive_timing:
         with current_app.app_context():
-            reports_dir = current_app.config['NMAP_REPORTS_DIR']
-            nmap_profiles = current_app.config['NMAP_SCAN_PROFILES']
-        
-        # Ensure reports directory exists
-        os.makedirs(reports_dir, exist_ok=True)
-        
-        # Prepare output file paths
-        xml_output = os.path.join(reports_dir, f"{scan_id}.xml")
-        normal_output = os.path.join(reports_dir, f"{scan_id}.txt")
-        
-        # Prepare Nmap arguments
-        if scan_profile and scan_profile in nmap_profiles:
-            nmap_args = nmap_profiles[scan_profile]
-        elif custom_args:
-            nmap_args = custom_args
-        else:
-            nmap_args = '-T4 -F'  # Default to quick scan
-        
-        # Add output formats to arguments
-        nmap_args += f" -oX {xml_output} -oN {normal_output}"
-        
-        # Add stats for progress tracking
-        nmap_args += " --stats-every 5s"
-        
-        # Create target string
-        target_string = ' '.join(targets)
-        
-        # Initialize nmap scanner
-        try:
-            nm = nmap.PortScanner()
-        except Exception as e:
-            current_app.logger.error(f"[ScanRun {scan_run_id}] Error initializing Nmap scanner: {str(e)}")
-            with app.app_context():
+            scan_task = ScanRun.query.get(scan_run_id).task
+            group_timing_args = get_group_timing_args(scan_task, nmap_args)
+        if len(set(group_timing_args.values())) == 1:
+            common_timing_args = next(iter(group_timing_args.values()))
+            if common_timing_args:
+                nmap_args += f" {common_timing_args}"
+        elif len(group_targets) > 1:
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Target groups need different timing; splitting the scan by group")
+    
+    # Scheduled runs skip addresses that were down in their last runs, except on a periodic full sweep
+    skipped_hosts = 0
+    full_sweep = False
+    exclude_addresses = []
+    if is_scheduled and not resume_log:
+        with current_app.app_context():
+            scan_task = ScanRun.query.get(scan_run_id).task
+            dead_hosts, full_sweep = plan_liveness_exclusion(scan_task, targets)
+        skipped_hosts = len(dead_hosts)
+        exclude_addresses.extend(dead_hosts)
+        if skipped_hosts:
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Skipping {skipped_hosts} addresses that were down in recent runs")
+        elif full_sweep:
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Full sweep: scanning every address, including known dead ones")
+    
+    # Addresses scanned with the same arguments within the profile's TTL are taken from the result cache
+    cache_key = None
+    cached_entry_ids = []
+    if result_cache_ttl > 0 and not resume_log:
+        cache_key = result_cache_key(nmap_args)
+        with current_app.app_context():
+            group_targets, cached_addresses, cached_entry_ids = plan_cached_targets(group_targets, cache_key, result_cache_ttl)
+        if cached_entry_ids:
+            targets = [value for _, values in group_targets for value in values]
+            exclude_addresses.extend(cached_addresses)
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Reusing cached results of {len(cached_entry_ids)} addresses; {len(targets)} targets left for Nmap")
+    
+    if cached_entry_ids and not targets:
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            scan_run.result_cache_key = cache_key
+            scan_run.cached_host_ids = json.dumps(cached_entry_ids)
+            scan_run.cached_hosts = len(cached_entry_ids)
+            scan_run.full_sweep = full_sweep
+            scan_run.skipped_hosts = 0
+            db.session.commit()
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Every target was served from the result cache; Nmap is not run")
+        return {'scan_id': scan_id, 'nmap_args': nmap_args, 'cached_only': True}, None
+    
+    exclude_path = None
+    if exclude_addresses:
+        exclude_path = liveness_exclude_path(xml_output)
+        write_exclude_file(exclude_path, exclude_addresses)
+        nmap_args += f" --excludefile {exclude_path}"
+    
+    # Arguments without per-run output files, used when the targets are split into shards
+    shard_nmap_args = nmap_args + " --stats-every 5s"
+    
+    # Add output formats to arguments
+    nmap_args += f" -oX {xml_output} -oN {normal_output}"
+    
+    # Add stats for progress tracking
+    nmap_args += " --stats-every 5s"
+    
+    # Create target string
+    target_string = ' '.join(targets)
+    
+    # The Nmap binary and how it can be given privileges, probed once per worker process
+    with current_app.app_context():
+        nmap_path = current_app.config.get('NMAP_PATH', '/usr/bin/nmap')
+        capabilities = get_nmap_capabilities(nmap_path)
+    if capabilities.error:
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Nmap preflight failed: {capabilities.error}")
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            scan_run.status = 'failed'
+            scan_run.completed_at = datetime.utcnow()
+            scan_run.error_message = capabilities.error
+            db.session.commit()
+        remove_liveness_exclude_file(xml_output)
+        return None, {'status': 'failed', 'message': capabilities.error, 'scan_run_id': scan_run_id}
+    
+    # Sanitize the Nmap arguments to prevent command injection
+    sanitized_nmap_args = sanitize_nmap_command(nmap_args)
+    if sanitized_nmap_args is None:
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error: Invalid or potentially dangerous Nmap arguments detected: {nmap_args}")
+        with app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            scan_run.status = 'failed'
+            scan_run.completed_at = datetime.utcnow()
+            db.session.commit()
+        message = f"Invalid or potentially dangerous Nmap arguments detected for scan_run_id {scan_run_id}: {nmap_args}"
+        current_app.logger.error(message)
+        scan_run.error_message = message
+        db.session.commit()
+        return None, None
+    
+    # Update the scan task with sanitized arguments if they've changed
+    if sanitized_nmap_args != nmap_args:
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Sanitized Nmap arguments from '{nmap_args}' to '{sanitized_nmap_args}'")
+        nmap_args = sanitized_nmap_args
+        with current_app.app_context():
+            scan_task.custom_args = sanitized_nmap_args
+            db.session.commit()
+    
+    # Sanitize target string to prevent command injection
+    sanitized_targets = []
+    for target in target_string.split():
+        sanitized_target = sanitize_nmap_targets(target)
+        if sanitized_target:
+            sanitized_targets.extend(sanitized_target)
+    
+    if not sanitized_targets:
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error: No valid targets found in '{target_string}'")
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            scan_run.status = 'failed'
+            scan_run.completed_at = datetime.utcnow()
+            db.session.commit()
+        return None, {'status': 'failed', 'message': 'No valid targets found', 'scan_run_id': scan_run_id}
+    
+    # Join the sanitized targets back into a string
+    sanitized_target_string = ' '.join(sanitized_targets)
+    
+    # Decide before launch how Nmap gets the privileges its options need: as root, through the
+    # binary's file capabilities (--privileged) or through passwordless sudo
+    sudo_prefix, privilege_args, privilege_error = plan_privileges(nmap_args, capabilities)
+    if privilege_error:
+        current_app.logger.error(f"[ScanRun {scan_run_id}] {privilege_error}")
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            scan_run.status = 'failed'
+            scan_run.completed_at = datetime.utcnow()
+            scan_run.error_message = privilege_error
+            db.session.commit()
+        remove_liveness_exclude_file(xml_output)
+        return None, {'status': 'failed', 'message': privilege_error, 'scan_run_id': scan_run_id}
+    if privilege_args:
+        nmap_args += f" {privilege_args}"
+        shard_nmap_args += f" {privilege_args}"
+    if sudo_prefix or privilege_args:
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Running privileged scan {'through sudo' if sudo_prefix else 'with the binary file capabilities'}")
+    
+    # Niceness, IO priority, CPU affinity and rlimits of the Nmap processes, set by the profile
+    with current_app.app_context():
+        resource_prefix = build_resource_prefix(get_resource_limits(scan_profile))
+    if resource_prefix:
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Applying resource limits: {resource_prefix.strip()}")
+    
+    # Split the targets across several parallel Nmap processes if requested
+    shards = None
+    shard_base_cmd = None
+    shard_args = None
+    # At most as many shards run at once as the task asks for
+    shard_parallel = min(shard_count, max_shards)
+    if len(set(group_timing_args.values())) > 1:
+        # One set of shards per target group, each with the timing options of its group
+        sanitized_shard_args = sanitize_nmap_command(shard_nmap_args)
+        if sanitized_shard_args is None:
+            message = f"Invalid or potentially dangerous Nmap arguments detected: {shard_nmap_args}"
+            current_app.logger.error(f"[ScanRun {scan_run_id}] {message}")
+            with current_app.app_context():
                 scan_run = ScanRun.query.get(scan_run_id)
                 scan_run.status = 'failed'
                 scan_run.completed_at = datetime.utcnow()
+                scan_run.error_message = message
                 db.session.commit()
-            message = f'Error initializing Nmap scanner for scan_run_id {scan_run_id}: {str(e)}'
-            current_app.logger.error(message)
-            scan_run.error_message = message
-            db.session.commit()
-            return
-        
-        # Start the scan as a subprocess to capture real-time output
-        # Use the full path to nmap
-        nmap_path = "/usr/bin/nmap"
-        
-        # Sanitize the Nmap arguments to prevent command injection
-        sanitized_nmap_args = sanitize_nmap_command(nmap_args)
-        if sanitized_nmap_args is None:
-            current_app.logger.error(f"[ScanRun {scan_run_id}] Error: Invalid or potentially dangerous Nmap arguments detected: {nmap_args}")
-            with app.app_context():
-                scan_run = ScanRun.query.get(scan_run_id)
+            remove_liveness_exclude_file(xml_output)
+            return None, {'status': 'failed', 'message': message, 'scan_run_id': scan_run_id}
+        shards, shard_args = [], []
+        group_shard_count = max(1, shard_parallel // len(group_targets))
+        for group_id, values in group_targets:
+            group_sanitized = [t for value in values for t in sanitize_nmap_targets(value)]
+            timing_args = sanitize_nmap_command(group_timing_args.get(group_id, '')) or ''
+            for shard in shard_targets(group_sanitized, group_shard_count):
+                shards.append(shard)
+                shard_args.append(timing_args)
+        shard_base_cmd = f"{resource_prefix}{sudo_prefix}{nmap_path} -v {sanitized_shard_args}"
+    elif shard_count > 1:
+        sanitized_shard_args = sanitize_nmap_command(shard_nmap_args)
+        candidate_shards = shard_targets(sanitized_targets, shard_parallel)
+        if len(candidate_shards) > 1 and sanitized_shard_args:
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Splitting {len(sanitized_targets)} targets into {len(candidate_shards)} shards")
+            shards = candidate_shards
+            shard_base_cmd = f"{resource_prefix}{sudo_prefix}{nmap_path} -v {sanitized_shard_args}"
+    
+    # Continue an interrupted scan from its resume log; Nmap appends to the original output files
+    resumed = False
+    if resume_log:
+        if is_resumable_log(resume_log) and resume_xml_output:
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Resuming interrupted scan from {resume_log}")
+            xml_output = resume_xml_output
+            normal_output = resume_log
+            shards = None
+            shard_args = None
+            resumed = True
+        else:
+            current_app.logger.warning(f"[ScanRun {scan_run_id}] Resume log {resume_log} is missing or finished; starting the scan from scratch")
+    
+    # Share of the global packet rate budget, split evenly across the shards of the run
+    with current_app.app_context():
+        max_rate, budget_error, budget_deferred = reserve_rate_budget(scan_run_id, nmap_args, resumed)
+    if budget_deferred:
+        # Back in the queue as 'waiting'; the worker slot and task lock are released for other runs
+        remove_liveness_exclude_file(xml_output)
+        return None, {'status': 'waiting', 'message': 'Waiting for packet rate budget', 'scan_run_id': scan_run_id}
+    if budget_error:
+        current_app.logger.error(f"[ScanRun {scan_run_id}] {budget_error}")
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run.status in ('starting', 'waiting'):
                 scan_run.status = 'failed'
+                scan_run.error_message = budget_error
                 scan_run.completed_at = datetime.utcnow()
-                db.session.commit()
-            message = f"Invalid or potentially dangerous Nmap arguments detected for scan_run_id {scan_run_id}: {nmap_args}"
-            current_app.logger.error(message)
-            scan_run.error_message = message
             db.session.commit()
-            return
-        
-        # Update the scan task with sanitized arguments if they've changed
-        if sanitized_nmap_args != nmap_args:
-            current_app.logger.info(f"[ScanRun {scan_run_id}] Sanitized Nmap arguments from '{nmap_args}' to '{sanitized_nmap_args}'")
-            nmap_args = sanitized_nmap_args
+        remove_liveness_exclude_file(xml_output)
+        return None, {'status': 'failed', 'message': budget_error, 'scan_run_id': scan_run_id}
+    # A --min-rate from the profile, custom arguments or adaptive timing is lowered to the rate each process gets
+    if max_rate and not resumed:
+        nmap_args = cap_min_rate(f"{strip_max_rate(nmap_args)} --max-rate {max_rate}", max_rate)
+        if shards:
+            shard_rate = max(1, max_rate // len(shards))
+            shard_base_cmd = cap_min_rate(f"{strip_max_rate(shard_base_cmd)} --max-rate {shard_rate}", shard_rate)
+            if shard_args:
+                shard_args = [cap_min_rate(args, shard_rate) for args in shard_args]
+    
+    # Sweep engine: a fast port sweep of every target, then service scan batches of the open ports
+    sweep_tool = sweep_cmd = service_base_cmd = None
+    service_batch_hosts = service_parallel = None
+    if scan_engine == ENGINE_SWEEP and not resumed:
+        with current_app.app_context():
+            sweep_tool, sweep_cmd = plan_port_sweep(nmap_args, sanitized_targets, capabilities, resource_prefix, nmap_path, exclude_path, max_rate)
+            service_batch_hosts = current_app.config.get('NMAP_SWEEP_BATCH_HOSTS', 64)
+            service_parallel = min(shard_count, max_shards) if shard_count > 1 else current_app.config.get('NMAP_SWEEP_PARALLEL_BATCHES', 4)
+        service_args = build_service_args(sanitize_nmap_command(strip_max_rate(shard_nmap_args)) or '')
+        if max_rate:
+            service_rate = max(1, max_rate // service_parallel)
+            service_args = cap_min_rate(f"{service_args} --max-rate {service_rate}", service_rate)
+        service_base_cmd = f"{resource_prefix}{sudo_prefix}{nmap_path} -v {service_args}"
+        shards = None
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Sweep engine: port sweep with {sweep_tool}, then service scans in batches of {service_batch_hosts} hosts, {service_parallel} at a time")
+    
+    if resumed:
+        cmd = build_resume_command(resource_prefix + sudo_prefix, nmap_path, resume_log)
+    else:
+        # Add -v for verbose output to make it easier to track progress
+        cmd = f"{resource_prefix}{sudo_prefix}{nmap_path} -v {nmap_args} {sanitized_target_string}"
+    
+    # Record the output paths so the run can be resumed if this worker dies; the shard logs of
+    # a sharded run and the stages of a sweep cannot be resumed as one scan
+    with current_app.app_context():
+        scan_run = ScanRun.query.get(scan_run_id)
+        scan_run.xml_output_path = xml_output
+        scan_run.resume_log_path = None if shards or sweep_cmd else normal_output
+        scan_run.resume_pending = False
+        scan_run.timing_args = json.dumps(group_timing_args) if adaptive_timing else None
+        scan_run.full_sweep = full_sweep
+        scan_run.skipped_hosts = skipped_hosts
+        if not resumed:
+            scan_run.result_cache_key = cache_key
+            scan_run.cached_host_ids = json.dumps(cached_entry_ids) if cached_entry_ids else None
+            scan_run.cached_hosts = len(cached_entry_ids)
+        if resumed:
+            scan_run.resume_count = (scan_run.resume_count or 0) + 1
+        db.session.commit()
+    
+    return {
+        'scan_id': scan_id,
+        'reports_dir': reports_dir,
+        'xml_output': xml_output,
+        'normal_output': normal_output,
+        'nmap_args': nmap_args,
+        'cmd': cmd,
+        'shards': shards,
+        'shard_base_cmd': shard_base_cmd,
+        'shard_args': shard_args,
+        'shard_parallel': shard_parallel,
+        'resumed': resumed,
+        'deadline_seconds': deadline_seconds,
+        'engine': ENGINE_SWEEP if sweep_cmd else ENGINE_NMAP,
+        'sweep_tool': sweep_tool,
+        'sweep_cmd': sweep_cmd,
+        'service_base_cmd': service_base_cmd,
+        'service_batch_hosts': service_batch_hosts,
+        'service_parallel': service_parallel,
+        'cached_only': False
+    }, None
+
+@sqlite_task_lock(key_template="lock:run_nmap_scan:task_id_{scan_task_id_for_lock}", expire=43200) # 12 hours expire
+def run_nmap_scan(scan_run_id, scan_task_id_for_lock):
+    """
+    Run an Nmap scan as a background Celery task.
+    scan_task_id_for_lock is the ID of the parent ScanTask, used for locking to prevent concurrent runs of the same conceptual task.
+    """
+    # The on_task_exit function (formerly for Celery) is no longer needed.
+    # This function should run within an existing app context provided by the scheduler.
+    ingester = None
+    try:
+        plan, failure = prepare_nmap_scan(scan_run_id)
+        if plan is None:
+            return failure
+        if plan['cached_only']:
             with current_app.app_context():
-                scan_task.custom_args = sanitized_nmap_args
-                db.session.commit()
-        
-        # Sanitize target string to prevent command injection
-        sanitized_targets = []
-        for target in target_string.split():
-            sanitized_target = sanitize_nmap_targets(target)
-            if sanitized_target:
-                sanitized_targets.extend(sanitized_target)
+                return complete_from_cache(scan_run_id, plan['nmap_args'])
         
-        if not sanitized_targets:
-            current_app.logger.error(f"[ScanRun {scan_run_id}] Error: No valid targets found in '{target_string}'")
-            with current_app.app_context():
-                scan_run = ScanRun.query.get(scan_run_id)
-                scan_run.status = 'failed'
-                scan_run.completed_at = datetime.utcnow()
-                db.session.commit()
-            return {'status': 'failed', 'message': 'No valid targets found', 'scan_run_id': scan_run_id}
+        if plan['engine'] == ENGINE_SWEEP:
+            return run_prepared_sweep_scan(scan_run_id, plan)
         
-        # Join the sanitized targets back into a string
-        sanitized_target_string = ' '.join(sanitized_targets)
+        xml_output = plan['xml_output']
+        normal_output = plan['normal_output']
+        cmd = plan['cmd']
         
-        # Check if the scan requires root privileges
-        requires_root = False
+        with current_app.app_context():
+            monitor_timeout = current_app.config.get('NMAP_MONITOR_TIMEOUT', 1.0)
         
-        # OS detection (-O), SYN scan (-sS), and some other scan types require root
-        # Check for both space-separated flags and combined flags
-        root_flags = ['-O', '-sS', '-sU', '-sA', '-sW', '-sM']
+        # Ingest hosts into the report while Nmap is still running if enabled
+        ingester = create_report_ingester(scan_run_id, xml_output, normal_output)
         
-        # Check each flag individually to ensure we catch them regardless of format
-        for flag in root_flags:
-            if flag in nmap_args.split() or flag in nmap_args:
-                requires_root = True
-                current_app.logger.info(f"[ScanRun {scan_run_id}] Detected flag {flag} that requires root privileges")
-                break
-                
-        # Also check for OS detection in other formats (case insensitive)
-        if '--osscan-guess' in nmap_args.lower() or '--osscan-limit' in nmap_args.lower():
-            requires_root = True
-            current_app.logger.info(f"[ScanRun {scan_run_id}] Detected OS scan option that requires root privileges")
+        # Wall-clock limit of the scan, counted from the launch of Nmap
+        with current_app.app_context():
+            deadline = start_scan_deadline(plan['deadline_seconds'])
         
-        # Always use sudo for OS detection and other privileged operations
-        # This ensures we don't have to restart the scan later
-        if requires_root:
-            # Use sudo with NOPASSWD configuration
-            sudo_prefix = "sudo "
-            current_app.logger.info(f"[ScanRun {scan_run_id}] Detected operation requiring root privileges")
-            current_app.logger.info(f"[ScanRun {scan_run_id}] Using sudo for privileged operations (NOPASSWD configured)")
-        else:
-            sudo_prefix = ""
+        # Run the shards in parallel if the targets were split
+        if plan['shards']:
+            result = run_sharded_nmap_scan(
+                scan_run_id,
+                plan['shard_base_cmd'],
+                plan['shards'],
+                plan['scan_id'],
+                plan['reports_dir'],
+                xml_output,
+                normal_output,
+                ingester=ingester,
+                shard_args=plan['shard_args'],
+                deadline=deadline,
+                max_parallel=plan['shard_parallel']
+            )
+            if isinstance(result, dict):
+                return result
+            return_code, output_buffer, nmap_done, pid_label = result
+            result = finalize_scan_run(scan_run_id, return_code, output_buffer, xml_output, normal_output, pid_label, nmap_done=nmap_done, ingester=ingester, deadline_reached=deadline.reached)
+            discard_streamed_report(ingester, result)
+            return result
         
-        # Add -v for verbose output to make it easier to track progress
-        cmd = f"{sudo_prefix}{nmap_path} -v {nmap_args} {sanitized_target_string}"
+
         current_app.logger.info(f"[ScanRun {scan_run_id}] Executing Nmap command: {cmd}")
         
         try:
@@ -204,8 +491,7 @@ def run_nmap_scan(scan_run_id, scan_task_id_for_lock):
                 cmd,
                 shell=True,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True
+                stderr=subprocess.STDOUT
             )
             pid_msg = f"[ScanRun {scan_run_id}] Nmap process started with PID: {process.pid}"
             current_app.logger.info(pid_msg)
@@ -249,147 +535,55 @@ def run_nmap_scan(scan_run_id, scan_task_id_for_lock):
                     sys.stdout.flush()
             return {'status': 'failed', 'message': f'Error starting Nmap process: {str(e)}', 'scan_run_id': scan_run_id}
         
-        # Variables to track process state and errors
-        privilege_error_detected = False
-        quitting_detected = False
-        last_error_line = ""
-        output_buffer = []
+        if ingester:
+            ingester.watch(xml_output)
+            ingester.start()
+        
+        # Phase, progress and errors parsed from Nmap's output, and its last lines for error context
+        tracker = ScanPhaseTracker()
+        output_buffer = deque(maxlen=OUTPUT_BUFFER_LINES)
         
         # Print some debug info about the process
         print(f"TASK_DEBUG: [ScanRun {scan_run_id}] Monitoring nmap process with PID {process.pid}", file=sys.stdout)
         print(f"TASK_DEBUG: [ScanRun {scan_run_id}] Command: {cmd}", file=sys.stdout)
         sys.stdout.flush()
         
-        # Monitor progress
-        while process.poll() is None:
-            # Read output line by line
-            output = process.stdout.readline()
+        # Monitor progress; the monitor sleeps in select() while Nmap is quiet and
+        # keeps reading until EOF so output written just before exit is not lost
+        monitor = ProcessOutputMonitor(timeout=monitor_timeout)
+        monitor.register('nmap', process)
+        progress_reporter = get_progress_reporter()
+        for _, output in monitor.lines():
+            # Interrupt Nmap once the deadline has passed; the hosts it finished are salvaged below
+            deadline.check([process.pid])
             if not output:
+                # Idle: write any coalesced progress that is due
+                progress_reporter.tick()
                 continue
                 
             line = output.strip()
+            if not line:
+                continue
             current_app.logger.debug(f"[ScanRun {scan_run_id}] Nmap stdout: {line}")
             
             # Print significant nmap output to STDOUT for debugging
-            if any(x in line.lower() for x in ['starting', 'error', 'warning', 'quit', 'fail', 'done', '% complete', 'pid']):
+            if SIGNIFICANT_OUTPUT_RE.search(line):
                 print(f"NMAP_OUTPUT: [ScanRun {scan_run_id}] {line}", file=sys.stdout)
                 sys.stdout.flush()
             
             # Store recent output lines for context
             output_buffer.append(line)
-            if len(output_buffer) > 10:  # Keep last 10 lines
-                output_buffer.pop(0)
-            
-            # Check for errors requiring root privileges
-            privilege_error = False
-            
-            # Look for common privilege error messages
-            if any(msg in line for msg in [
-                'requires root privileges',
-                'requires privileged access',
-                'TCP/IP fingerprinting (for OS scan) requires root privileges'
-            ]):
-                privilege_error = True
-                privilege_error_detected = True
-                last_error_line = line
             
-            # Check for QUITTING message
-            if 'QUITTING!' in line:
-                quitting_detected = True
-                
-                # If we've seen a privilege error before QUITTING, it's definitely a privilege issue
-                if privilege_error_detected:
-                    privilege_error = True
-                
-                # Also check if any recent output lines contain privilege errors
-                for recent_line in output_buffer:
-                    if any(msg in recent_line for msg in [
-                        'root privileges', 'privileged access', 'TCP/IP fingerprinting'
-                    ]):
-                        privilege_error = True
-                        break
-                
-            if privilege_error:
-                error_msg = f"[ScanRun {scan_run_id}] DETECTED PRIVILEGE ERROR: Restarting scan with sudo..."
-                current_app.logger.error(error_msg)
-                print(f"ERROR: {error_msg}", file=sys.stdout)
-                
-                context_msg = f"[ScanRun {scan_run_id}] Error context: {last_error_line}"
-                current_app.logger.error(context_msg)
-                print(f"ERROR: {context_msg}", file=sys.stdout)
-                sys.stdout.flush()
-                
-                # Kill the current process
-                print(f"TASK_EVENT: [ScanRun {scan_run_id}] Terminating process with PID {process.pid} due to privilege error", file=sys.stdout)
-                process.terminate()
-                process.wait(timeout=5)
-                
-                # Restart with sudo (using NOPASSWD configuration)
-                cmd = f"sudo {nmap_path} -v {nmap_args} {target_string}"
-                restart_msg = f"[ScanRun {scan_run_id}] Restarting with sudo (NOPASSWD): {cmd}"
-                current_app.logger.info(restart_msg)
-                print(f"TASK_EVENT: {restart_msg}", file=sys.stdout)
-                sys.stdout.flush()
-                
-                try:
-                    process = subprocess.Popen(
-                        cmd,
-                        shell=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        universal_newlines=True
-                    )
-                    
-                    # Update the stored PID and reset status
-                    with current_app.app_context():
-                        scan_run = ScanRun.query.get(scan_run_id)
-                        if scan_run:
-                            scan_run.nmap_pid = process.pid
-                            # Ensure status is set to running in case it was changed
-                            scan_run.status = 'running'
-                            pid_update_msg = f"[ScanRun {scan_run_id}] (Sudo Restart) Attempting to commit new PID {process.pid} and status 'running'."
-                            current_app.logger.info(pid_update_msg)
-                            print(f"TASK_EVENT: {pid_update_msg}", file=sys.stdout)
-                            sys.stdout.flush()
-                            db.session.commit()
-                            pid_success_msg = f"[ScanRun {scan_run_id}] (Sudo Restart) Successfully committed new PID {process.pid} and status 'running'."
-                            current_app.logger.info(pid_success_msg)
-                            print(f"TASK_EVENT: {pid_success_msg}", file=sys.stdout)
-                            sys.stdout.flush()
-                    
-                    # Reset error tracking for the new process
-                    privilege_error_detected = False
-                    quitting_detected = False
-                    last_error_line = ""
-                    output_buffer = []
-                    continue
-                except Exception as e:
-                    current_app.logger.error(f"[ScanRun {scan_run_id}] Error restarting with sudo: {str(e)}")
-                    with current_app.app_context():
-                        scan_run = ScanRun.query.get(scan_run_id)
-                        scan_run.status = 'failed'
-                        scan_run.completed_at = datetime.utcnow()
-                        db.session.commit()
-                    return {'status': 'failed', 'message': f'Error restarting with sudo: {str(e)}', 'scan_run_id': scan_run_id}
+            event = tracker.feed(line)
+            if event is None:
+                continue
             
-            # Check for progress updates
-            if 'About' in line and '% done' in line:
-                try:
-                    # Extract progress percentage
-                    progress_str = line.split('About ')[1].split('% done')[0].strip()
-                    progress = int(float(progress_str))
-                    
-                    # Update progress in database
-                    with current_app.app_context():
-                        scan_run = ScanRun.query.get(scan_run_id)
-                        if scan_run:
-                            scan_run.progress = progress
-                            db.session.commit()
-                except Exception as e:
-                    current_app.logger.error(f"[ScanRun {scan_run_id}] Error parsing progress: {str(e)}")
+            # Coalesced progress and phase update; written on meaningful change or interval
+            if event.kind in PROGRESS_EVENTS:
+                progress_reporter.update(scan_run_id, tracker.progress, tracker.phase, tracker.phase_progress, tracker.eta)
             
             # Check for scan completion
-            if 'Nmap done' in line: 
+            if event.kind == SCAN_DONE:
                 completion_msg = f"[ScanRun {scan_run_id}] Scan completed successfully!"
                 current_app.logger.info(completion_msg)
                 print(f"TASK_EVENT: {completion_msg}", file=sys.stdout)
@@ -410,354 +604,372 @@ def run_nmap_scan(scan_run_id, scan_task_id_for_lock):
                         print(f"ERROR: {not_found_error}", file=sys.stdout)
                         sys.stdout.flush()
         
-        # Process has completed
-        return_code = process.poll()
-        print(f"TASK_EVENT: [ScanRun {scan_run_id}] Nmap process with PID {process.pid} exited with return code {return_code}", file=sys.stdout)
+        # Process has completed (stdout reached EOF)
+        monitor.close()
+        progress_reporter.finish(scan_run_id)
+        return_code = process.wait()
+        result = finalize_scan_run(scan_run_id, return_code, list(output_buffer), xml_output, normal_output, process.pid, ingester=ingester, resumed=plan['resumed'], deadline_reached=deadline.reached)
+        discard_streamed_report(ingester, result)
+        return result
+    except Exception as e:
+        unhandled_error = f"[ScanRun {scan_run_id}] Unhandled exception in run_nmap_scan: {str(e)}"
+        current_app.logger.error(unhandled_error, exc_info=True)
+        print(f"CRITICAL ERROR: {unhandled_error}", file=sys.stdout)
+        # Print stack trace to STDOUT for debugging
+        import traceback
+        print(f"EXCEPTION TRACE: [ScanRun {scan_run_id}]\n{traceback.format_exc()}", file=sys.stdout)
+        sys.stdout.flush()
+        discard_streamed_report(ingester, None)
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run:
+                scan_run.status = 'failed'
+                scan_run.error_message = str(e)  # Store the exception message
+                scan_run.completed_at = datetime.utcnow()
+                print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task failed due to unhandled exception", file=sys.stdout)
+                sys.stdout.flush()
+                db.session.commit()
+            else:
+                print(f"ERROR: [ScanRun {scan_run_id}] Could not update scan run status - object not found", file=sys.stdout)
+                sys.stdout.flush()
+        return {'status': 'failed', 'message': str(e), 'scan_run_id': scan_run_id}
+
+def run_prepared_sweep_scan(scan_run_id, plan):
+    """Run both stages of a prepared sweep engine run and finalize it; returns the run's result"""
+    ingester = create_report_ingester(scan_run_id, plan['xml_output'], plan['normal_output'])
+    try:
+        with current_app.app_context():
+            deadline = start_scan_deadline(plan['deadline_seconds'])
+        result = run_sweep_scan(scan_run_id, plan, ingester=ingester, deadline=deadline)
+        if isinstance(result, dict):
+            discard_streamed_report(ingester, result)
+            return result
+        return_code, output_buffer, nmap_done, pid_label = result
+        result = finalize_scan_run(scan_run_id, return_code, output_buffer, plan['xml_output'], plan['normal_output'], pid_label, nmap_done=nmap_done, ingester=ingester, deadline_reached=deadline.reached)
+        discard_streamed_report(ingester, result)
+        return result
+    except Exception:
+        discard_streamed_report(ingester, None)
+        raise
+
+def create_report_ingester(scan_run_id, xml_output, normal_output):
+    """Return a StreamingReportIngester for the run if streaming ingest is enabled, else None"""
+    with current_app.app_context():
+        if not current_app.config.get('NMAP_STREAMING_INGEST', False):
+            return None
+        return StreamingReportIngester(
+            scan_run_id,
+            xml_output,
+            normal_output,
+            batch_size=current_app.config.get('NMAP_STREAMING_BATCH_SIZE', 50),
+            flush_interval=current_app.config.get('NMAP_STREAMING_FLUSH_SECONDS', 5)
+        )
+
+def discard_streamed_report(ingester, result):
+    """Remove the partially streamed report of a run that did not complete"""
+    if ingester is None or (result and result.get('status') == 'completed'):
+        return
+    try:
+        ingester.abort()
+    except Exception as e:
+        current_app.logger.error(f"[ScanRun {ingester.scan_run_id}] Error discarding streamed report: {str(e)}", exc_info=True)
+
+def finalize_scan_run(scan_run_id, return_code, output_buffer, xml_output, normal_output, process_pid, nmap_done=None, ingester=None, resumed=False, deadline_reached=False):
+    """
+    Record the outcome of a finished Nmap run and create its report.
+    nmap_done overrides the 'Nmap done' marker check on output_buffer (used by sharded runs).
+    If an ingester streamed the hosts during the scan, its report is finalized instead of parsing the XML again.
+    resumed marks a run relaunched with --resume, whose XML output holds several appended documents.
+    deadline_reached marks a run stopped at its deadline, whose completed hosts are salvaged into a partial report.
+    """
+    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Nmap process with PID {process_pid} exited with return code {return_code}", file=sys.stdout)
+    sys.stdout.flush()
+    remove_liveness_exclude_file(xml_output)
+    
+    if deadline_reached:
+        return salvage_scan_run(scan_run_id, xml_output, normal_output, ingester=ingester, resumed=resumed)
+    
+    # Process tracking is now handled by the database PID and external cleanup scripts.
+    
+    # Check if there was any output at all
+    if not output_buffer:
+        no_output_error = f"[ScanRun {scan_run_id}] No output received from Nmap process"
+        current_app.logger.error(no_output_error)
+        print(f"ERROR: {no_output_error}", file=sys.stdout)
+        # Add PID debugging info to help track down missing PID issues
+        print(f"PID_DEBUG: [ScanRun {scan_run_id}] Last known PID: {process_pid}, Process returncode: {return_code}", file=sys.stdout)
+        sys.stdout.flush()
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run:
+                scan_run.status = 'failed'
+                scan_run.error_message = 'No output received from Nmap process'
+                scan_run.completed_at = datetime.utcnow()
+                print(f"TASK_EVENT: [ScanRun {scan_run_id}] Updated status to 'failed' due to no output from Nmap process", file=sys.stdout)
+                sys.stdout.flush()
+                db.session.commit()
+        return {'status': 'failed', 'message': 'No output received from Nmap process', 'scan_run_id': scan_run_id}
+
+    # Determine if Nmap considers itself done by checking the entire output buffer
+    if nmap_done is not None:
+        nmap_truly_done_in_output = nmap_done
+    else:
+        nmap_truly_done_in_output = any("Nmap done" in l for l in output_buffer)
+
+    if return_code == 0 and nmap_truly_done_in_output:
+        success_msg = f"[ScanRun {scan_run_id}] Nmap process completed successfully (return_code 0, 'Nmap done' found). Attempting to create report."
+        current_app.logger.info(success_msg)
+        print(f"TASK_EVENT: {success_msg}", file=sys.stdout)
         sys.stdout.flush()
         
-        # Process tracking is now handled by the database PID and external cleanup scripts.
-        
-        # Check if there was any output at all
-        if not output_buffer:
-            no_output_error = f"[ScanRun {scan_run_id}] No output received from Nmap process"
-            current_app.logger.error(no_output_error)
-            print(f"ERROR: {no_output_error}", file=sys.stdout)
-            # Add PID debugging info to help track down missing PID issues
-            print(f"PID_DEBUG: [ScanRun {scan_run_id}] Last known PID: {process.pid}, Process returncode: {return_code}", file=sys.stdout)
+        # xml_output and normal_output are defined earlier in this function
+        if not os.path.exists(xml_output):
+            missing_file_msg = f"[ScanRun {scan_run_id}] XML output file {xml_output} not found after successful Nmap run."
+            current_app.logger.error(missing_file_msg)
+            print(f"ERROR: {missing_file_msg}", file=sys.stdout)
             sys.stdout.flush()
             with current_app.app_context():
                 scan_run = ScanRun.query.get(scan_run_id)
                 if scan_run:
                     scan_run.status = 'failed'
-                    scan_run.error_message = 'No output received from Nmap process'
+                    scan_run.error_message = f"Nmap completed but XML output file missing: {os.path.basename(xml_output)}"
                     scan_run.completed_at = datetime.utcnow()
-                    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Updated status to 'failed' due to no output from Nmap process", file=sys.stdout)
+                    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Updated status to 'failed' due to missing XML output file", file=sys.stdout)
                     sys.stdout.flush()
                     db.session.commit()
-            return {'status': 'failed', 'message': 'No output received from Nmap process', 'scan_run_id': scan_run_id}
-
-        # Determine if Nmap considers itself done by checking the entire output buffer
-        nmap_truly_done_in_output = any("Nmap done" in l for l in output_buffer)
-
-        if return_code == 0 and nmap_truly_done_in_output:
-            success_msg = f"[ScanRun {scan_run_id}] Nmap process completed successfully (return_code 0, 'Nmap done' found). Attempting to create report."
-            current_app.logger.info(success_msg)
-            print(f"TASK_EVENT: {success_msg}", file=sys.stdout)
+        else:
+            # Call create_scan_report. 
+            print(f"TASK_EVENT: [ScanRun {scan_run_id}] Attempting to create scan report from output files", file=sys.stdout)
             sys.stdout.flush()
+            if resumed:
+                # Stop tailing before the XML file is rewritten
+                if ingester:
+                    ingester.stop()
+                try:
+                    repair_resumed_xml(xml_output)
+                except Exception as e:
+                    current_app.logger.error(f"[ScanRun {scan_run_id}] Error merging resumed XML output: {str(e)}", exc_info=True)
+            if ingester:
+                new_report = ingester.finish()
+            else:
+                new_report = create_scan_report(scan_run_id, xml_output, normal_output) # Removed current_app, as create_scan_report was refactored
             
-            # xml_output and normal_output are defined earlier in this function
-            if not os.path.exists(xml_output):
-                missing_file_msg = f"[ScanRun {scan_run_id}] XML output file {xml_output} not found after successful Nmap run."
-                current_app.logger.error(missing_file_msg)
-                print(f"ERROR: {missing_file_msg}", file=sys.stdout)
-                sys.stdout.flush()
-                with current_app.app_context():
-                    scan_run = ScanRun.query.get(scan_run_id)
-                    if scan_run:
-                        scan_run.status = 'failed'
-                        scan_run.error_message = f"Nmap completed but XML output file missing: {os.path.basename(xml_output)}"
+            with current_app.app_context(): # Ensure app context for DB operations
+                scan_run = ScanRun.query.get(scan_run_id) # Re-fetch for current session
+                if scan_run:
+                    if new_report:
+                        report_success_msg = f"[ScanRun {scan_run_id}] Report created successfully (Report ID: {new_report.id})."
+                        current_app.logger.info(report_success_msg)
+                        print(f"TASK_EVENT: {report_success_msg}", file=sys.stdout)
+                        scan_run.status = 'completed'
+                        scan_run.report = new_report # Link the report object
+                        scan_run.error_message = None # Clear any previous error
                         scan_run.completed_at = datetime.utcnow()
-                        print(f"TASK_EVENT: [ScanRun {scan_run_id}] Updated status to 'failed' due to missing XML output file", file=sys.stdout)
+                        print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task completed successfully at {scan_run.completed_at.strftime('%Y-%m-%d %H:%M:%S')}", file=sys.stdout)
                         sys.stdout.flush()
                         db.session.commit()
-            else:
-                # Call create_scan_report. 
-                print(f"TASK_EVENT: [ScanRun {scan_run_id}] Attempting to create scan report from output files", file=sys.stdout)
-                sys.stdout.flush()
-                new_report = create_scan_report(scan_run_id, xml_output, normal_output) # Removed current_app, as create_scan_report was refactored
-                
-                with current_app.app_context(): # Ensure app context for DB operations
-                    scan_run = ScanRun.query.get(scan_run_id) # Re-fetch for current session
-                    if scan_run:
-                        if new_report:
-                            report_success_msg = f"[ScanRun {scan_run_id}] Report created successfully (Report ID: {new_report.id})."
-                            current_app.logger.info(report_success_msg)
-                            print(f"TASK_EVENT: {report_success_msg}", file=sys.stdout)
-                            scan_run.status = 'completed'
-                            scan_run.report = new_report # Link the report object
-                            scan_run.error_message = None # Clear any previous error
-                            scan_run.completed_at = datetime.utcnow()
-                            print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task completed successfully at {scan_run.completed_at.strftime('%Y-%m-%d %H:%M:%S')}", file=sys.stdout)
-                            sys.stdout.flush()
-                            db.session.commit()
-                            return {'status': 'completed', 'scan_run_id': scan_run_id, 'report_id': new_report.id}
-                        else:
-                            report_fail_msg = f"[ScanRun {scan_run_id}] Failed to create report from Nmap output."
-                            current_app.logger.error(report_fail_msg)
-                            print(f"ERROR: {report_fail_msg}", file=sys.stdout)
-                            scan_run.status = 'failed'
-                            scan_run.error_message = "Report creation failed after Nmap scan."
-                            scan_run.completed_at = datetime.utcnow()
-                            print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task failed due to report creation error", file=sys.stdout)
-                            sys.stdout.flush()
-                            db.session.commit()
-                            return {'status': 'failed', 'message': "Report creation failed after Nmap scan.", 'scan_run_id': scan_run_id}
+                        record_run_timing(scan_run_id, xml_output)
+                        record_run_liveness(scan_run_id, new_report.id)
+                        cache_run_results(scan_run_id, new_report.id)
+                        merge_cached_hosts(scan_run_id, new_report.id)
+                        compress_report_artifacts(scan_run_id, new_report.id)
+                        return {'status': 'completed', 'scan_run_id': scan_run_id, 'report_id': new_report.id}
                     else:
-                        not_found_error = f"[ScanRun {scan_run_id}] ScanRun object not found when trying to finalize after report creation attempt."
-                        current_app.logger.error(not_found_error)
-                        print(f"ERROR: {not_found_error}", file=sys.stdout)
+                        report_fail_msg = f"[ScanRun {scan_run_id}] Failed to create report from Nmap output."
+                        current_app.logger.error(report_fail_msg)
+                        print(f"ERROR: {report_fail_msg}", file=sys.stdout)
+                        scan_run.status = 'failed'
+                        scan_run.error_message = "Report creation failed after Nmap scan."
+                        scan_run.completed_at = datetime.utcnow()
+                        print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task failed due to report creation error", file=sys.stdout)
                         sys.stdout.flush()
-                        return {'status': 'failed', 'message': "ScanRun object not found when trying to finalize after report creation attempt.", 'scan_run_id': scan_run_id}
-
-        elif return_code != 0:
-            error_msg = f"[ScanRun {scan_run_id}] Nmap process exited with non-zero return code: {return_code}."
-            current_app.logger.error(error_msg)
-            print(f"ERROR: {error_msg}", file=sys.stdout)
-            sys.stdout.flush()
-            detailed_error_message = f"Nmap process failed with return code {return_code}."
-            
-            # Try to find a more specific error message from output_buffer
-            extracted_nmap_error = None
-            for i, l_item in enumerate(output_buffer):
-                if 'QUITTING!' in l_item:
-                    if i > 0:
-                        extracted_nmap_error = output_buffer[i-1].strip()
-                    else:
-                        extracted_nmap_error = "Nmap quit unexpectedly (QUITTING! found at start of output)."
-                    break # Found the primary error indicator
-            
-            if extracted_nmap_error:
-                detailed_error_message = extracted_nmap_error
-            elif output_buffer: # If no QUITTING msg, use last few lines as potential error context
-                context_lines = "\n".join(output_buffer[-5:])
-                detailed_error_message += f"\nLast output lines:\n{context_lines}"
-
-            with current_app.app_context():
-                scan_run = ScanRun.query.get(scan_run_id)
-                if scan_run:
-                    scan_run.status = 'failed'
-                    scan_run.error_message = str(detailed_error_message)[:1023] # Ensure fits in DB
-                    scan_run.completed_at = datetime.utcnow()
-                    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task failed with non-zero exit code - updating error message", file=sys.stdout)
-                    sys.stdout.flush()
-                    db.session.commit()
+                        db.session.commit()
+                        return {'status': 'failed', 'message': "Report creation failed after Nmap scan.", 'scan_run_id': scan_run_id}
                 else:
-                    not_found_msg = f"[ScanRun {scan_run_id}] ScanRun object not found when handling Nmap process failure (return_code {return_code})."
-                    current_app.logger.error(not_found_msg)
-                    print(f"ERROR: {not_found_msg}", file=sys.stdout)
+                    not_found_error = f"[ScanRun {scan_run_id}] ScanRun object not found when trying to finalize after report creation attempt."
+                    current_app.logger.error(not_found_error)
+                    print(f"ERROR: {not_found_error}", file=sys.stdout)
                     sys.stdout.flush()
+                    return {'status': 'failed', 'message': "ScanRun object not found when trying to finalize after report creation attempt.", 'scan_run_id': scan_run_id}
 
-        else: # return_code == 0 but not nmap_truly_done_in_output
-            incomplete_msg = f"[ScanRun {scan_run_id}] Nmap process finished with return_code 0, but 'Nmap done' was not found in output. Scan may be incomplete or output corrupted."
-            current_app.logger.warning(incomplete_msg)
-            print(f"WARNING: {incomplete_msg}", file=sys.stdout)
-            sys.stdout.flush()
-            with current_app.app_context():
-                scan_run = ScanRun.query.get(scan_run_id)
-                if scan_run:
-                    scan_run.status = 'failed'
-                    scan_run.error_message = "Nmap finished (code 0) but output indicates incompletion or error (no 'Nmap done' marker)."
-                    scan_run.completed_at = datetime.utcnow()
-                    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task marked as failed due to incomplete output", file=sys.stdout)
-                    sys.stdout.flush()
-                    db.session.commit()
+    elif return_code != 0:
+        error_msg = f"[ScanRun {scan_run_id}] Nmap process exited with non-zero return code: {return_code}."
+        current_app.logger.error(error_msg)
+        print(f"ERROR: {error_msg}", file=sys.stdout)
+        sys.stdout.flush()
+        detailed_error_message = f"Nmap process failed with return code {return_code}."
+        
+        # Try to find a more specific error message from output_buffer
+        extracted_nmap_error = None
+        for i, l_item in enumerate(output_buffer):
+            if 'QUITTING!' in l_item:
+                if i > 0:
+                    extracted_nmap_error = output_buffer[i-1].strip()
                 else:
-                    not_found_msg = f"[ScanRun {scan_run_id}] ScanRun object not found when handling incomplete Nmap scan (code 0, no 'Nmap done')."
-                    current_app.logger.error(not_found_msg)
-                    print(f"ERROR: {not_found_msg}", file=sys.stdout)
-                    sys.stdout.flush()
-            return {'status': 'failed', 'message': "Nmap finished (code 0) but output indicates incompletion or error (no 'Nmap done' marker).", 'scan_run_id': scan_run_id}
-    except Exception as e:
-        unhandled_error = f"[ScanRun {scan_run_id}] Unhandled exception in run_nmap_scan: {str(e)}"
-        current_app.logger.error(unhandled_error, exc_info=True)
-        print(f"CRITICAL ERROR: {unhandled_error}", file=sys.stdout)
-        # Print stack trace to STDOUT for debugging
-        import traceback
-        print(f"EXCEPTION TRACE: [ScanRun {scan_run_id}]\n{traceback.format_exc()}", file=sys.stdout)
+                    extracted_nmap_error = "Nmap quit unexpectedly (QUITTING! found at start of output)."
+                break # Found the primary error indicator
+        
+        if extracted_nmap_error:
+            detailed_error_message = extracted_nmap_error
+        elif output_buffer: # If no QUITTING msg, use last few lines as potential error context
+            context_lines = "\n".join(output_buffer[-5:])
+            detailed_error_message += f"\nLast output lines:\n{context_lines}"
+
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run:
+                scan_run.status = 'failed'
+                scan_run.error_message = str(detailed_error_message)[:1023] # Ensure fits in DB
+                scan_run.completed_at = datetime.utcnow()
+                print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task failed with non-zero exit code - updating error message", file=sys.stdout)
+                sys.stdout.flush()
+                db.session.commit()
+            else:
+                not_found_msg = f"[ScanRun {scan_run_id}] ScanRun object not found when handling Nmap process failure (return_code {return_code})."
+                current_app.logger.error(not_found_msg)
+                print(f"ERROR: {not_found_msg}", file=sys.stdout)
+                sys.stdout.flush()
+
+    else: # return_code == 0 but not nmap_truly_done_in_output
+        incomplete_msg = f"[ScanRun {scan_run_id}] Nmap process finished with return_code 0, but 'Nmap done' was not found in output. Scan may be incomplete or output corrupted."
+        current_app.logger.warning(incomplete_msg)
+        print(f"WARNING: {incomplete_msg}", file=sys.stdout)
         sys.stdout.flush()
         with current_app.app_context():
             scan_run = ScanRun.query.get(scan_run_id)
             if scan_run:
                 scan_run.status = 'failed'
-                scan_run.error_message = str(e)  # Store the exception message
+                scan_run.error_message = "Nmap finished (code 0) but output indicates incompletion or error (no 'Nmap done' marker)."
                 scan_run.completed_at = datetime.utcnow()
-                print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task failed due to unhandled exception", file=sys.stdout)
+                print(f"TASK_EVENT: [ScanRun {scan_run_id}] Task marked as failed due to incomplete output", file=sys.stdout)
                 sys.stdout.flush()
                 db.session.commit()
             else:
-                print(f"ERROR: [ScanRun {scan_run_id}] Could not update scan run status - object not found", file=sys.stdout)
+                not_found_msg = f"[ScanRun {scan_run_id}] ScanRun object not found when handling incomplete Nmap scan (code 0, no 'Nmap done')."
+                current_app.logger.error(not_found_msg)
+                print(f"ERROR: {not_found_msg}", file=sys.stdout)
                 sys.stdout.flush()
-        return {'status': 'failed', 'message': str(e), 'scan_run_id': scan_run_id}
+        return {'status': 'failed', 'message': "Nmap finished (code 0) but output indicates incompletion or error (no 'Nmap done' marker).", 'scan_run_id': scan_run_id}
+
+def salvage_scan_run(scan_run_id, xml_output, normal_output, ingester=None, resumed=False):
+    """
+    Create a partial report from the hosts a run completed before it was stopped at its deadline,
+    and mark the run completed so its slot is freed. The timing and liveness history are not
+    updated from a partial run, since the hosts it did not reach are missing from it.
+    """
+    with current_app.app_context():
+        scan_run = ScanRun.query.get(scan_run_id)
+        deadline_seconds = get_scan_deadline_seconds(scan_run.task) if scan_run else None
+    deadline_text = f"Deadline of {deadline_seconds // 60} minutes reached" if deadline_seconds else "Deadline reached"
+    current_app.logger.warning(f"[ScanRun {scan_run_id}] {deadline_text}; salvaging the hosts Nmap completed")
+    print(f"TASK_EVENT: [ScanRun {scan_run_id}] {deadline_text}; salvaging partial results", file=sys.stdout)
+    sys.stdout.flush()
+    
+    # Stop tailing before the XML file is rewritten
+    if ingester:
+        ingester.stop()
+    salvaged_hosts = None
+    try:
+        salvaged_hosts = salvage_partial_xml(xml_output)
+        if salvaged_hosts is not None and resumed:
+            repair_resumed_xml(xml_output)
+    except Exception as e:
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error salvaging partial XML output: {str(e)}", exc_info=True)
+    
+    new_report = None
+    if salvaged_hosts is not None:
+        new_report = ingester.finish() if ingester else create_scan_report(scan_run_id, xml_output, normal_output)
+    
+    with current_app.app_context():
+        scan_run = ScanRun.query.get(scan_run_id)
+        if not scan_run:
+            return {'status': 'failed', 'message': "ScanRun object not found when salvaging partial results.", 'scan_run_id': scan_run_id}
+        scan_run.completed_at = datetime.utcnow()
+        if not new_report:
+            message = f"{deadline_text} before Nmap completed any host; no report was created"
+            scan_run.status = 'failed'
+            scan_run.error_message = message
+            db.session.commit()
+            return {'status': 'failed', 'message': message, 'scan_run_id': scan_run_id}
+        
+        report = ScanReport.query.get(new_report.id)
+        report.partial = True
+        scan_run.status = 'completed'
+        scan_run.report = report
+        scan_run.error_message = f"{deadline_text}; the report is partial and holds the {salvaged_hosts} hosts completed before Nmap was stopped"
+        db.session.commit()
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Partial report created (Report ID: {report.id}, {salvaged_hosts} hosts)")
+        cache_run_results(scan_run_id, report.id)
+        merge_cached_hosts(scan_run_id, report.id)
+        compress_report_artifacts(scan_run_id, report.id)
+        return {'status': 'completed', 'partial': True, 'scan_run_id': scan_run_id, 'report_id': report.id}
 
 def create_scan_report(scan_run_id, xml_path, normal_path):
     """
     Parse Nmap XML output and create a report in the database
-    Also enforces the maximum reports per task setting by deleting older reports
+    The XML is parsed incrementally and hosts are committed in batches of NMAP_INGEST_BATCH_SIZE,
+    so memory use stays flat however large the output is; the report is 'ingesting' until done.
+    Reports beyond the task's maximum are deleted later by the retention job
     """
     print(f"TASK_EVENT: [ScanRun {scan_run_id}] Starting to create scan report from {xml_path}", file=sys.stdout)
     sys.stdout.flush()
-    parsed_summary = {}
-    parsed_hosts_data = []
-
-    try:
-        if not os.path.exists(xml_path):
-            current_app.logger.error(f"[ScanRun {scan_run_id}] Nmap XML output file not found: {xml_path}")
-            return None
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-
-        # Extract summary information
-        parsed_summary = {
-            'scanner': root.get('scanner', ''),
-            'args': root.get('args', ''),
-            'start': root.get('start', ''),
-            'startstr': root.get('startstr', ''),
-            'version': root.get('version', ''),
-            'xmloutputversion': root.get('xmloutputversion', '')
-        }
-        run_stats = root.find('runstats')
-        if run_stats is not None:
-            hosts_stats = run_stats.find('hosts')
-            if hosts_stats is not None:
-                parsed_summary['hosts_total'] = hosts_stats.get('total', '0')
-                parsed_summary['hosts_up'] = hosts_stats.get('up', '0')
-                parsed_summary['hosts_down'] = hosts_stats.get('down', '0')
-
-        # Process each host from XML
-        for host_elem in root.findall('host'):
-            host_data = {}
-            status_elem = host_elem.find('status')
-            host_data['status'] = status_elem.get('state') if status_elem is not None else 'unknown'
-            address_elem = host_elem.find('address')
-            host_data['ip_address'] = address_elem.get('addr') if address_elem is not None else ''
-            
-            hostnames_elem = host_elem.find('hostnames')
-            hostname = None
-            if hostnames_elem is not None:
-                hostname_elem = hostnames_elem.find('hostname')
-                if hostname_elem is not None:
-                    hostname = hostname_elem.get('name')
-            host_data['hostname'] = hostname
-
-            os_info_parts = []
-            os_elem = host_elem.find('os')
-            if os_elem is not None:
-                for osmatch_elem in os_elem.findall('osmatch'):
-                    os_name = osmatch_elem.get('name', 'Unknown OS')
-                    os_accuracy = osmatch_elem.get('accuracy', '0')
-                    os_info_parts.append(f"{os_name} (Accuracy: {os_accuracy}%)")
-                    for osclass_elem in osmatch_elem.findall('osclass'):
-                        os_vendor = osclass_elem.get('vendor', '')
-                        os_family = osclass_elem.get('osfamily', '')
-                        os_gen = osclass_elem.get('osgen', '')
-                        os_class_type = osclass_elem.get('type', '')
-                        os_info_parts.append(f"  Class: {os_class_type} | Vendor: {os_vendor} | Family: {os_family} | Gen: {os_gen}")
-            host_data['os_info'] = json.dumps(os_info_parts) if os_info_parts else None
-            
-            host_data['ports'] = []
-            ports_elem = host_elem.find('ports')
-            if ports_elem is not None:
-                for port_elem in ports_elem.findall('port'):
-                    port_data = {}
-                    port_data['port_number'] = port_elem.get('portid')
-                    port_data['protocol'] = port_elem.get('protocol')
-                    state_elem = port_elem.find('state')
-                    port_data['state'] = state_elem.get('state') if state_elem is not None else 'unknown'
-                    
-                    service_elem = port_elem.find('service')
-                    service_name = ''
-                    service_version = ''
-                    if service_elem is not None:
-                        service_parts = [
-                            service_elem.get('name', ''),
-                            service_elem.get('product', ''),
-                            service_elem.get('extrainfo', '')
-                        ]
-                        service_name = ' '.join(filter(None, service_parts)).strip()
-                        service_version = service_elem.get('version')
-                    port_data['service'] = service_name
-                    port_data['version'] = service_version
-                    host_data['ports'].append(port_data)
-            parsed_hosts_data.append(host_data)
-
-    except Exception as e:
-        current_app.logger.error(f"[ScanRun {scan_run_id}] Error during XML parsing phase: {str(e)}", exc_info=True)
+    if not os.path.exists(xml_path):
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Nmap XML output file not found: {xml_path}")
         return None
+    batch_size = max(1, current_app.config.get('NMAP_INGEST_BATCH_SIZE', 500))
+    report_id = None
 
-    # Database transaction part
     try:
         with current_app.app_context():
             scan_run = ScanRun.query.get(scan_run_id)
             if not scan_run:
                 current_app.logger.error(f"[ScanRun {scan_run_id}] Scan run {scan_run_id} not found before DB operations.")
                 return None
-            scan_task = scan_run.task
 
-            if scan_task.use_global_max_reports:
-                from app.models.settings import SystemSettings
-                max_reports = SystemSettings.get_int('max_reports_per_task', 15)
-            else:
-                max_reports = scan_task.max_reports or 15
-
-            # Create new ScanReport object
+            # Create the report first so that hosts can be committed to it batch by batch
             new_report = ScanReport(
                 scan_run_id=scan_run_id,
                 xml_report_path=xml_path,
                 normal_report_path=normal_path,
-                summary=json.dumps(parsed_summary)
+                status='ingesting'
             )
-
-            # Create HostFinding and PortFinding objects from parsed data
-            for host_data in parsed_hosts_data:
-                host_finding = HostFinding(
-                    ip_address=host_data['ip_address'],
-                    hostname=host_data['hostname'],
-                    status=host_data['status'],
-                    os_info=host_data['os_info']
-                    # report_id will be set by relationship
-                )
-                for port_data in host_data['ports']:
-                    port_finding = PortFinding(
-                        port_number=int(port_data['port_number']),
-                        protocol=port_data['protocol'],
-                        state=port_data['state'],
-                        service=port_data['service'],
-                        version=port_data['version']
-                        # host_id will be set by relationship
-                    )
-                    host_finding.ports.append(port_finding)
-                new_report.hosts.append(host_finding)
-            
             db.session.add(new_report)
+            db.session.commit()
+            report_id = new_report.id
 
-            # Cleanup old reports - Query needs to be effective *after* the new report is conceptually part of the task's reports
-            # To do this safely, we might need to flush to get the new_report an ID if the query relies on it, 
-            # or adjust the query. For now, let's assume the query for task_reports correctly includes the pending new_report.
-            # A safer way is to commit the new report first, then cleanup. But let's try with current structure.
-            # If issues persist, this part may need adjustment (e.g. commit new_report, then query and delete old ones in a new transaction or step).
-            
-            # Get all reports for this task, ordered by creation date (newest first)
-            # We need to ensure 'new_report' is considered in this list if it's already added to session
-            # A flush might be needed here if the query doesn't see 'new_report' yet.
-            db.session.flush() # Ensure new_report gets an ID and is queryable if needed by relationships in task_reports query
+            parsed_summary = {}
+            hosts_ingested = 0
+            batch = []
+            for host_data in iter_report_hosts(xml_path, parsed_summary):
+                batch.append(host_data)
+                if len(batch) >= batch_size:
+                    _commit_host_batch(report_id, batch)
+                    hosts_ingested += len(batch)
+                    batch = []
+            if batch:
+                _commit_host_batch(report_id, batch)
+                hosts_ingested += len(batch)
 
-            task_reports = ScanReport.query.join(ScanRun).filter(
-                ScanRun.task_id == scan_task.id
-            ).order_by(ScanReport.created_at.desc(), ScanReport.id.desc()).all()
-            
-            if len(task_reports) > max_reports:
-                reports_to_delete = task_reports[max_reports:] # Oldest reports are at the end
-                current_app.logger.info(f"[ScanRun {scan_run_id}] Cleaning up {len(reports_to_delete)} old reports for task {scan_task.id} to maintain max of {max_reports}")
-                for old_report_to_delete in reports_to_delete:
-                    if old_report_to_delete.id == new_report.id: # Should not happen if ordering is correct and new_report is fresh
-                        current_app.logger.warning(f"[ScanRun {scan_run_id}] Attempted to delete the new report (ID: {new_report.id}) during cleanup. Skipping.")
-                        continue
-                    
-                    if old_report_to_delete.xml_report_path and os.path.exists(old_report_to_delete.xml_report_path):
-                        try: os.remove(old_report_to_delete.xml_report_path)
-                        except Exception as e: current_app.logger.error(f"[ScanRun {scan_run_id}] Error deleting XML file {old_report_to_delete.xml_report_path}: {str(e)}")
-                    if old_report_to_delete.normal_report_path and os.path.exists(old_report_to_delete.normal_report_path):
-                        try: os.remove(old_report_to_delete.normal_report_path)
-                        except Exception as e: current_app.logger.error(f"[ScanRun {scan_run_id}] Error deleting normal file {old_report_to_delete.normal_report_path}: {str(e)}")
-                    db.session.delete(old_report_to_delete)
-            
+            new_report = ScanReport.query.get(report_id)
+            new_report.summary = json.dumps(parsed_summary)
+            new_report.status = 'complete'
             db.session.commit()
-            current_app.logger.info(f"[ScanRun {scan_run_id}] Scan report created successfully. Report ID: {new_report.id}")
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Scan report created successfully. Report ID: {new_report.id}, hosts: {hosts_ingested}")
             return new_report
 
     except Exception as e:
-        # This will catch errors from the database transaction part or if app_context fails
+        # Parse errors surface while hosts are being ingested, so the partial report is removed here
         with current_app.app_context(): # Ensure context for rollback if error was in DB part
             db.session.rollback()
-        current_app.logger.error(f"[ScanRun {scan_run_id}] Error in create_scan_report DB phase: {str(e)}", exc_info=True)
+            if report_id is not None:
+                partial_report = ScanReport.query.get(report_id)
+                if partial_report:
+                    db.session.delete(partial_report)
+                    db.session.commit()
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error in create_scan_report: {str(e)}", exc_info=True)
         return None
+
+def _commit_host_batch(report_id, batch):
+    """Bulk insert a batch of parsed host dicts into a report and commit it"""
+    insert_host_findings(report_id, batch)
+    db.session.commit()
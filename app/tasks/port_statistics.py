@@ -0,0 +1,120 @@
+"""
+Learned port priorities: open port findings of all stored reports are aggregated into global and
+per-target-group frequency tables, from which the "learned top ports" scan profile is generated.
+"""
+from collections import Counter
+from sqlalchemy import func, insert, delete
+from flask import current_app
+from app import db
+from app.models.task import ScanTask, ScanRun
+from app.models.report import ScanReport, HostFinding, PortFinding, PortFrequency
+from app.utils.target_groups import build_group_matchers, match_target_group
+
+# Rows per executemany batch when the frequency table is rewritten
+PORT_FREQUENCY_BATCH_SIZE = 1000
+
+def _open_ports_query(*columns):
+    return db.session.query(*columns, func.count(PortFinding.id)).select_from(PortFinding) \
+        .join(HostFinding, PortFinding.host_id == HostFinding.id) \
+        .join(ScanReport, HostFinding.report_id == ScanReport.id) \
+        .join(ScanRun, ScanReport.scan_run_id == ScanRun.id) \
+        .filter(PortFinding.state == 'open')
+
+def rebuild_port_frequencies():
+    """
+    Recompute the port frequency tables from the open ports of every stored report.
+    Reports of a task with one target group count towards that group; for tasks with several
+    groups each host is attributed to the group whose targets cover it.
+    Must be called within an app context. Returns the number of rows written.
+    """
+    frequencies = Counter()
+    port = (PortFinding.port_number, PortFinding.protocol)
+
+    for port_number, protocol, count in _open_ports_query(*port).group_by(*port):
+        frequencies[(None, port_number, protocol)] += count
+
+    tasks = {task.id: task for task in ScanTask.query.all()}
+    multi_group_task_ids = []
+    for task_id, port_number, protocol, count in _open_ports_query(ScanRun.task_id, *port).group_by(ScanRun.task_id, *port):
+        task = tasks.get(task_id)
+        if task is None or not task.target_groups:
+            continue
+        if len(task.target_groups) == 1:
+            frequencies[(task.target_groups[0].id, port_number, protocol)] += count
+        elif task_id not in multi_group_task_ids:
+            multi_group_task_ids.append(task_id)
+
+    for task_id in multi_group_task_ids:
+        matchers = build_group_matchers(tasks[task_id].target_groups)
+        rows = _open_ports_query(HostFinding.ip_address, HostFinding.hostname, *port) \
+            .filter(ScanRun.task_id == task_id) \
+            .group_by(HostFinding.ip_address, HostFinding.hostname, *port)
+        for ip_address, hostname, port_number, protocol, count in rows:
+            group_id = match_target_group(matchers, ip_address, [hostname.lower()] if hostname else [])
+            if group_id is not None:
+                frequencies[(group_id, port_number, protocol)] += count
+
+    values = [
+        {'target_group_id': group_id, 'port_number': port_number, 'protocol': protocol, 'open_count': count}
+        for (group_id, port_number, protocol), count in frequencies.items()
+    ]
+    db.session.execute(delete(PortFrequency))
+    for start in range(0, len(values), PORT_FREQUENCY_BATCH_SIZE):
+        db.session.execute(insert(PortFrequency), values[start:start + PORT_FREQUENCY_BATCH_SIZE])
+    db.session.commit()
+    current_app.logger.info(f"Rebuilt port frequency tables: {len(values)} rows from open port findings")
+    return len(values)
+
+def get_learned_top_ports(target_group_ids, limit):
+    """
+    Return up to limit (port_number, protocol) tuples, most frequently open first.
+    Ports seen open in the given target groups come first; the global table fills the rest.
+    Must be called within an app context.
+    """
+    if PortFrequency.query.first() is None:
+        rebuild_port_frequencies()
+
+    ports = []
+    if target_group_ids:
+        group_rows = db.session.query(PortFrequency.port_number, PortFrequency.protocol, func.sum(PortFrequency.open_count).label('total')) \
+            .filter(PortFrequency.target_group_id.in_(target_group_ids)) \
+            .group_by(PortFrequency.port_number, PortFrequency.protocol) \
+            .order_by(func.sum(PortFrequency.open_count).desc(), PortFrequency.port_number) \
+            .limit(limit)
+        ports = [(port_number, protocol) for port_number, protocol, _ in group_rows]
+
+    if len(ports) < limit:
+        chosen = set(ports)
+        global_rows = PortFrequency.query.filter(PortFrequency.target_group_id.is_(None)) \
+            .order_by(PortFrequency.open_count.desc(), PortFrequency.port_number) \
+            .limit(limit + len(ports))
+        for row in global_rows:
+            if (row.port_number, row.protocol) not in chosen:
+                ports.append((row.port_number, row.protocol))
+                chosen.add((row.port_number, row.protocol))
+                if len(ports) >= limit:
+                    break
+    return ports
+
+def build_learned_profile_args(scan_task):
+    """
+    Build the Nmap arguments of the learned top ports profile for a task.
+    Falls back to nmap's own top ports (-F) while there is no history yet.
+    Must be called within an app context.
+    """
+    base_args = current_app.config.get('NMAP_LEARNED_PROFILE_ARGS', '-T4')
+    limit = current_app.config.get('NMAP_LEARNED_TOP_PORTS', 100)
+    ports = get_learned_top_ports([group.id for group in scan_task.target_groups], limit)
+    if not ports:
+        return f"{base_args} -F"
+
+    tcp_ports = sorted(port for port, protocol in ports if protocol == 'tcp')
+    udp_ports = sorted(port for port, protocol in ports if protocol == 'udp')
+    port_specs = []
+    if tcp_ports:
+        port_specs.append('T:' + ','.join(str(port) for port in tcp_ports))
+    if udp_ports:
+        port_specs.append('U:' + ','.join(str(port) for port in udp_ports))
+    # UDP ports need a UDP scan next to the SYN scan
+    scan_types = ' -sS -sU' if udp_ports else ''
+    return f"{base_args}{scan_types} -p {','.join(port_specs)}"
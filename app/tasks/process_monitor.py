@@ -0,0 +1,98 @@
+"""
+Selector-driven monitor for the stdout of Nmap child processes.
+Output is read with non-blocking binary reads, so a worker sleeps in select() while
+Nmap is quiet and a single thread can watch several processes at once.
+"""
+import os
+import re
+import selectors
+
+READ_CHUNK_SIZE = 65536
+
+# Nmap output lines worth echoing to the worker log
+SIGNIFICANT_OUTPUT_RE = re.compile(r'starting|error|warning|quit|fail|done|% complete|pid', re.IGNORECASE)
+# Lines of output kept per Nmap process as context for error messages
+OUTPUT_BUFFER_LINES = 10
+
+class ProcessOutputMonitor:
+    """
+    Watch the stdout pipes of one or more child processes and yield complete lines.
+
+    Each process is registered under a key; lines() yields (key, line) tuples until every
+    registered pipe has reached EOF, which also drains any output written just before exit.
+    When no output arrives within `timeout` seconds, lines() yields (None, None) so the
+    caller can do periodic work without busy-waiting.
+    """
+
+    def __init__(self, timeout=1.0):
+        self.timeout = timeout
+        self._selector = selectors.DefaultSelector()
+        self._streams = {}
+        self._buffers = {}
+
+    def register(self, key, process):
+        """Start watching process.stdout (opened in binary mode) under key"""
+        fd = process.stdout.fileno()
+        os.set_blocking(fd, False)
+        self._selector.register(fd, selectors.EVENT_READ, key)
+        self._streams[key] = fd
+        self._buffers[key] = b''
+
+    def unregister(self, key):
+        """Stop watching the stream registered under key, discarding any unread output"""
+        fd = self._streams.pop(key, None)
+        self._buffers.pop(key, None)
+        if fd is not None:
+            try:
+                self._selector.unregister(fd)
+            except (KeyError, ValueError):
+                pass
+
+    def active_count(self):
+        """Number of registered streams that have not reached EOF yet"""
+        return len(self._streams)
+
+    def close(self):
+        for key in list(self._streams):
+            self.unregister(key)
+        self._selector.close()
+
+    def _decode(self, data):
+        return data.decode('utf-8', errors='replace').rstrip('\r')
+
+    def lines(self):
+        """Yield (key, line) for every line of output, or (None, None) on an idle timeout"""
+        while self._streams:
+            events = self._selector.select(self.timeout)
+            if not events:
+                yield None, None
+                continue
+            for selector_key, _ in events:
+                key = selector_key.data
+                # Skip events for streams that were unregistered while handling earlier lines
+                if self._streams.get(key) != selector_key.fd:
+                    continue
+                try:
+                    chunk = os.read(selector_key.fd, READ_CHUNK_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b''
+
+                if not chunk:
+                    # EOF: emit any trailing partial line and stop watching this stream
+                    remainder = self._buffers.get(key, b'')
+                    self.unregister(key)
+                    if remainder:
+                        yield key, self._decode(remainder)
+                    continue
+
+                if b'\r' in chunk:
+                    # Status lines redrawn in place (e.g. masscan's) end with a bare carriage return
+                    chunk = chunk.replace(b'\r', b'\n')
+                data = self._buffers[key] + chunk
+                *complete, self._buffers[key] = data.split(b'\n')
+                for raw_line in complete:
+                    yield key, self._decode(raw_line)
+                    if self._streams.get(key) != selector_key.fd:
+                        break
@@ -0,0 +1,115 @@
+"""
+Coalesced scan progress reporting.
+Progress updates (with the current Nmap phase and its estimated completion) are kept in memory
+and written only when they change meaningfully or when the flush interval has passed; all pending
+runs are written in a single transaction.
+"""
+import time
+import threading
+from sqlalchemy import update
+from flask import current_app
+from app import db
+from app.models.task import ScanRun
+
+class ProgressReporter:
+    """
+    Collects progress updates of the scan runs handled by this process.
+
+    update() records a value and flushes only if it differs from the last written value by
+    at least min_delta (or reaches 100) or the phase changed, or if flush_interval seconds have
+    passed since the last flush. A flush writes every pending run with one executemany UPDATE.
+    """
+
+    def __init__(self, min_delta=5, flush_interval=10.0):
+        self.min_delta = min_delta
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._written = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, scan_run_id, progress, phase=None, phase_progress=None, eta=None):
+        """
+        Record the progress of a run, and optionally the phase Nmap is in, the phase's progress
+        and its estimated completion time, without writing it.
+        Returns True if the change is meaningful enough to flush now.
+        """
+        progress = max(0, min(100, int(progress)))
+        if phase_progress is not None:
+            phase_progress = max(0, min(100, int(phase_progress)))
+        if phase:
+            phase = phase[:64]
+        state = (progress, phase, phase_progress, eta)
+        with self._lock:
+            last = self._written.get(scan_run_id)
+            if last == state:
+                self._pending.pop(scan_run_id, None)
+                return False
+            self._pending[scan_run_id] = state
+            return last is None or progress == 100 or abs(progress - last[0]) >= self.min_delta or phase != last[1]
+
+    def update(self, scan_run_id, progress, phase=None, phase_progress=None, eta=None):
+        """Record the progress of a run and flush if the change is meaningful or an interval has passed"""
+        if self.record(scan_run_id, progress, phase, phase_progress, eta):
+            self.flush()
+        else:
+            self.tick()
+
+    def is_due(self):
+        """Return True if pending updates are older than the flush interval"""
+        return bool(self._pending) and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def tick(self):
+        """Flush pending updates if the flush interval has passed; call this periodically"""
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        """Write all pending progress states in one transaction"""
+        with self._lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            self._last_flush = time.monotonic()
+        try:
+            with current_app.app_context():
+                db.session.execute(
+                    update(ScanRun),
+                    [
+                        {'id': scan_run_id, 'progress': progress, 'scan_phase': phase, 'phase_progress': phase_progress, 'phase_eta': eta}
+                        for scan_run_id, (progress, phase, phase_progress, eta) in batch.items()
+                    ]
+                )
+                db.session.commit()
+        except Exception as e:
+            current_app.logger.error(f"Error flushing scan progress for runs {list(batch)}: {str(e)}")
+            with self._lock:
+                # Keep the values for the next flush unless newer ones arrived meanwhile
+                for scan_run_id, state in batch.items():
+                    self._pending.setdefault(scan_run_id, state)
+            return
+        with self._lock:
+            self._written.update(batch)
+
+    def finish(self, scan_run_id):
+        """Flush any pending progress of a run and stop tracking it"""
+        if scan_run_id in self._pending:
+            self.flush()
+        with self._lock:
+            self._pending.pop(scan_run_id, None)
+            self._written.pop(scan_run_id, None)
+
+_reporter = None
+_reporter_lock = threading.Lock()
+
+def get_progress_reporter():
+    """Return the process-wide ProgressReporter, created from the app config on first use"""
+    global _reporter
+    with _reporter_lock:
+        if _reporter is None:
+            _reporter = ProgressReporter(
+                min_delta=current_app.config.get('NMAP_PROGRESS_MIN_DELTA', 5),
+                flush_interval=current_app.config.get('NMAP_PROGRESS_FLUSH_SECONDS', 10)
+            )
+        return _reporter
@@ -0,0 +1,130 @@
+"""
+Global packet rate budget: the total packets per second set in the system settings is split across
+the scan runs that are active at the same time. Every run reserves its share as --max-rate when it
+launches and gives it back when it finishes. Nmap cannot change its rate while it runs, so the
+shares are rebalanced whenever a run starts or ends. A run that finds too little budget left goes
+back to the queue in the 'waiting' state, without holding a worker, and the task processor retries it.
+"""
+import re
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models.task import ScanRun, TaskLock
+from app.models.settings import SystemSettings
+from app.utils.decorators import acquire_sqlite_lock, release_sqlite_lock
+
+RATE_BUDGET_LOCK_KEY = 'lock:rate_budget'
+# A lock older than this was left behind by a dead worker
+STALE_LOCK_SECONDS = 60
+# A run starts once it can get at least this fraction of its fair share
+MIN_SHARE_FRACTION = 0.25
+# Statuses of runs that hold a reservation
+ACTIVE_STATUSES = ('starting', 'running')
+
+MAX_RATE_RE = re.compile(r'\s*--max-rate(?:=|\s+)(\d+(?:\.\d+)?)')
+MIN_RATE_RE = re.compile(r'--min-rate(?:=|\s+)(\d+(?:\.\d+)?)')
+
+def get_requested_max_rate(nmap_args):
+    """Return the --max-rate given in nmap_args as an int, or None"""
+    match = MAX_RATE_RE.search(nmap_args)
+    return int(float(match.group(1))) if match else None
+
+def strip_max_rate(nmap_args):
+    return MAX_RATE_RE.sub('', nmap_args)
+
+def cap_min_rate(nmap_args, max_rate):
+    """Lower every --min-rate above max_rate to max_rate; Nmap refuses to run with min-rate > max-rate"""
+    def _cap(match):
+        return f"--min-rate {max_rate}" if float(match.group(1)) > max_rate else match.group(0)
+    return MIN_RATE_RE.sub(_cap, nmap_args)
+
+def _acquire_budget_lock():
+    while not acquire_sqlite_lock(RATE_BUDGET_LOCK_KEY):
+        lock = db.session.get(TaskLock, RATE_BUDGET_LOCK_KEY)
+        if lock and lock.created_at < datetime.utcnow() - timedelta(seconds=STALE_LOCK_SECONDS):
+            current_app.logger.warning("Removing stale rate budget lock")
+            release_sqlite_lock(RATE_BUDGET_LOCK_KEY)
+            continue
+        time.sleep(0.2)
+
+def get_max_concurrent_runs():
+    """Return the effective concurrency limit: the max_concurrent_tasks setting, capped by the worker capacity"""
+    # Imported here: worker_manager imports nmap_tasks, which imports this module
+    from app.worker_manager import get_worker_capacity
+    return max(1, min(SystemSettings.get_int('max_concurrent_tasks', 4), get_worker_capacity()))
+
+def try_reserve_rate(scan_run_id, budget, requested=None, required=None):
+    """
+    Reserve a share of the packet rate budget for a run and record it as ScanRun.max_rate.
+    requested caps the share at the rate the scan arguments ask for; required is the exact rate
+    a resumed scan was started with. Must be called within an app context.
+    Returns the granted packets per second, or None if not enough budget is free yet.
+    """
+    _acquire_budget_lock()
+    try:
+        active = ScanRun.query.filter(
+            ScanRun.status.in_(ACTIVE_STATUSES),
+            ScanRun.max_rate.isnot(None),
+            ScanRun.id != scan_run_id
+        ).all()
+        remaining = budget - sum(run.max_rate for run in active)
+
+        if required:
+            grant = required if remaining >= required else None
+        else:
+            # Every run gets an even share for the most runs that can be active at once, so a run
+            # started later always finds its share free
+            share = budget // get_max_concurrent_runs()
+            if requested:
+                share = min(share, requested)
+            grant = min(share, remaining)
+            if grant < max(1, int(share * MIN_SHARE_FRACTION)):
+                grant = None
+
+        if grant:
+            scan_run = ScanRun.query.get(scan_run_id)
+            scan_run.max_rate = grant
+            db.session.commit()
+        return grant
+    finally:
+        release_sqlite_lock(RATE_BUDGET_LOCK_KEY)
+
+def reserve_rate_budget(scan_run_id, nmap_args, resumed=False):
+    """
+    Try once to reserve the run's share of the global packet rate budget. Must be called within an app context.
+    Returns (max_rate, error, deferred): max_rate is None when no budget is configured; deferred is
+    True when too little budget is free and the run was put back in the queue as 'waiting'; error is
+    set once the run has waited longer than NMAP_RATE_BUDGET_MAX_WAIT seconds.
+    """
+    budget = SystemSettings.get_int('global_max_rate', 0)
+    if budget <= 0:
+        return None, None, False
+
+    required = None
+    if resumed:
+        # Nmap --resume reuses the original arguments, including the rate the run was given
+        required = ScanRun.query.get(scan_run_id).max_rate
+        if not required:
+            return None, None, False
+    requested = get_requested_max_rate(nmap_args)
+
+    grant = try_reserve_rate(scan_run_id, budget, requested, required)
+    scan_run = ScanRun.query.get(scan_run_id)
+    if grant:
+        scan_run.rate_wait_since = None
+        db.session.commit()
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Reserved --max-rate {grant} of the {budget} pps budget")
+        return grant, None, False
+
+    max_wait = current_app.config.get('NMAP_RATE_BUDGET_MAX_WAIT', 3600)
+    now = datetime.utcnow()
+    if scan_run.rate_wait_since and now - scan_run.rate_wait_since >= timedelta(seconds=max_wait):
+        return None, f"No packet rate budget became free within {max_wait} seconds", False
+    if not scan_run.rate_wait_since:
+        scan_run.rate_wait_since = now
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Waiting for packet rate budget to become free")
+    scan_run.status = 'waiting'
+    scan_run.error_message = f"Waiting for a share of the {budget} pps packet rate budget"
+    db.session.commit()
+    return None, None, True
@@ -0,0 +1,263 @@
+"""
+Remote scan agents: tasks with an agent label are not run by the local workers but pulled from
+the queue by run_agent.py processes on other hosts, e.g. inside network segments the server
+cannot reach. An agent claims a queued run with a lease, keeps renewing it while Nmap runs and
+uploads the XML and normal output, which are ingested like the output of a local run. A run
+whose lease runs out is put back in the queue for another agent.
+"""
+import os
+import json
+import secrets
+from datetime import datetime, timedelta
+from sqlalchemy import update, func
+from flask import current_app
+from app import db
+from app.models.task import ScanRun, ScanTask
+from app.models.agent import ScanAgent
+from app.utils.sanitize import sanitize_nmap_command, sanitize_nmap_targets
+from app.tasks.nmap_tasks import select_nmap_args, finalize_scan_run
+from app.tasks.adaptive_timing import get_group_timing_args
+from app.tasks.host_liveness import plan_liveness_exclusion
+from app.tasks.result_cache import result_cache_key, get_result_cache_ttl, plan_cached_targets, complete_from_cache
+from app.tasks.scan_deadline import deadline_passed
+
+# Task label routing a task to any registered agent
+ANY_AGENT_LABEL = 'any'
+# Statuses of runs held by an agent
+LEASED_STATUSES = ('starting', 'running')
+
+def register_agent(name, labels, capacity, address):
+    """
+    Register an agent, or re-register an existing one under the same name, and issue its API token.
+    Re-registering revokes the previous token. Returns (agent, token); only the hash is stored.
+    """
+    token = secrets.token_urlsafe(32)
+    agent = ScanAgent.query.filter_by(name=name).first()
+    if not agent:
+        agent = ScanAgent(name=name)
+        db.session.add(agent)
+    agent.labels = ','.join(labels)
+    agent.capacity = max(1, capacity)
+    agent.address = address
+    agent.token_hash = ScanAgent.hash_token(token)
+    agent.last_seen_at = datetime.utcnow()
+    db.session.commit()
+    current_app.logger.info(f"Registered scan agent '{name}' (labels: {agent.labels or 'none'}, capacity: {agent.capacity})")
+    return agent, token
+
+def authenticate_agent(token, address=None):
+    """Return the agent owning an API token and record that it was seen, or None"""
+    if not token:
+        return None
+    agent = ScanAgent.query.filter_by(token_hash=ScanAgent.hash_token(token)).first()
+    if agent:
+        agent.last_seen_at = datetime.utcnow()
+        if address:
+            agent.address = address
+        db.session.commit()
+    return agent
+
+def _lease_expiry():
+    return datetime.utcnow() + timedelta(seconds=current_app.config.get('AGENT_LEASE_SECONDS', 120))
+
+def _fail_agent_run(scan_run, message):
+    current_app.logger.error(f"[ScanRun {scan_run.id}] {message}")
+    scan_run.status = 'failed'
+    scan_run.error_message = message
+    scan_run.completed_at = datetime.utcnow()
+    scan_run.lease_expires_at = None
+    db.session.commit()
+
+def build_agent_job(scan_run_id):
+    """
+    Build the work order of a claimed run: sanitized Nmap arguments without output options, the
+    targets and the addresses to exclude. Liveness exclusion, the result cache and common adaptive
+    timing options apply as for local runs. Returns None if the run failed or was completed from
+    the cache without Nmap.
+    """
+    scan_run = ScanRun.query.get(scan_run_id)
+    scan_task = scan_run.task
+    group_targets = [(group.id, [target.value for target in group.targets]) for group in scan_task.target_groups]
+    targets = [value for _, values in group_targets for value in values]
+    if not targets:
+        _fail_agent_run(scan_run, "No targets specified")
+        return None
+
+    nmap_args = select_nmap_args(scan_task)
+    if scan_task.adaptive_timing:
+        # The agent runs a single Nmap process, so per-group timing only applies when the groups agree
+        group_timing_args = get_group_timing_args(scan_task, nmap_args)
+        if len(set(group_timing_args.values())) == 1 and next(iter(group_timing_args.values())):
+            nmap_args += f" {next(iter(group_timing_args.values()))}"
+        scan_run.timing_args = json.dumps(group_timing_args)
+
+    exclude_addresses = []
+    scan_run.full_sweep = False
+    scan_run.skipped_hosts = 0
+    if scan_task.is_scheduled:
+        dead_hosts, scan_run.full_sweep = plan_liveness_exclusion(scan_task, targets)
+        scan_run.skipped_hosts = len(dead_hosts)
+        exclude_addresses.extend(dead_hosts)
+
+    cached_entry_ids = []
+    result_cache_ttl = get_result_cache_ttl(scan_task.scan_profile)
+    if result_cache_ttl > 0:
+        cache_key = result_cache_key(nmap_args)
+        group_targets, cached_addresses, cached_entry_ids = plan_cached_targets(group_targets, cache_key, result_cache_ttl)
+        scan_run.result_cache_key = cache_key
+        scan_run.cached_host_ids = json.dumps(cached_entry_ids) if cached_entry_ids else None
+        scan_run.cached_hosts = len(cached_entry_ids)
+        if cached_entry_ids:
+            targets = [value for _, values in group_targets for value in values]
+            exclude_addresses.extend(cached_addresses)
+    db.session.commit()
+
+    if cached_entry_ids and not targets:
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Every target was served from the result cache; not sent to an agent")
+        complete_from_cache(scan_run_id, nmap_args)
+        return None
+
+    sanitized_nmap_args = sanitize_nmap_command(nmap_args)
+    if sanitized_nmap_args is None:
+        _fail_agent_run(scan_run, f"Invalid or potentially dangerous Nmap arguments detected: {nmap_args}")
+        return None
+    sanitized_targets = [value for target in targets for value in sanitize_nmap_targets(target)]
+    if not sanitized_targets:
+        _fail_agent_run(scan_run, "No valid targets found")
+        return None
+
+    return {
+        'scan_run_id': scan_run_id,
+        'task_name': scan_task.name,
+        'nmap_args': sanitized_nmap_args,
+        'targets': sanitized_targets,
+        'exclude': exclude_addresses,
+        'lease_seconds': current_app.config.get('AGENT_LEASE_SECONDS', 120)
+    }
+
+def claim_scan_run(agent):
+    """
+    Lease the oldest queued run routed to one of the agent's labels, if the agent has a free slot.
+    The lease is taken with a conditional UPDATE, so concurrent agents never claim the same run.
+    Returns the job of the claimed run, or None if there is nothing to do.
+    """
+    held = ScanRun.query.filter(ScanRun.agent_id == agent.id, ScanRun.status.in_(LEASED_STATUSES)).count()
+    if held >= (agent.capacity or 1):
+        return None
+
+    labels = set(agent.get_labels()) | {ANY_AGENT_LABEL}
+    candidates = ScanRun.query.join(ScanTask).filter(
+        ScanRun.status == 'queued',
+        ScanTask.agent_label.in_(labels)
+    ).order_by(ScanRun.started_at.asc()).all()
+
+    for candidate in candidates:
+        # Like the task lock of the local workers: one active run per task
+        busy = ScanRun.query.filter(
+            ScanRun.task_id == candidate.task_id,
+            ScanRun.status.in_(['waiting', 'starting', 'running']),
+            ScanRun.id != candidate.id
+        ).count()
+        if busy:
+            continue
+        claimed = db.session.execute(
+            update(ScanRun)
+            .where(ScanRun.id == candidate.id, ScanRun.status == 'queued')
+            .values(
+                status='starting',
+                agent_id=agent.id,
+                started_at=datetime.utcnow(),
+                lease_expires_at=_lease_expiry(),
+                lease_count=func.coalesce(ScanRun.lease_count, 0) + 1,
+                progress=0,
+                error_message=None
+            )
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            continue
+        db.session.expire_all()
+        current_app.logger.info(f"[ScanRun {candidate.id}] Claimed by scan agent '{agent.name}'")
+        job = build_agent_job(candidate.id)
+        if job:
+            return job
+    return None
+
+def get_leased_run(agent, scan_run_id):
+    """Return the run if it is leased by the agent, else None"""
+    scan_run = ScanRun.query.get(scan_run_id)
+    if not scan_run or scan_run.agent_id != agent.id:
+        return None
+    return scan_run
+
+def renew_lease(scan_run, progress=None):
+    """
+    Extend the lease of a run its agent is still working on and record its progress.
+    Returns the run's status; anything but 'running' tells the agent to stop Nmap.
+    'deadline' tells it to interrupt Nmap and upload the partial output.
+    """
+    if scan_run.status not in LEASED_STATUSES:
+        return scan_run.status
+    scan_run.status = 'running'
+    scan_run.lease_expires_at = _lease_expiry()
+    if progress is not None:
+        scan_run.progress = max(0, min(100, int(progress)))
+    db.session.commit()
+    if deadline_passed(scan_run):
+        return 'deadline'
+    return scan_run.status
+
+def complete_agent_run(agent, scan_run, return_code, output_lines, xml_data, normal_data):
+    """Store the output uploaded by an agent in the reports directory and finalize the run with it"""
+    scan_run_id = scan_run.id
+    reports_dir = current_app.config['NMAP_REPORTS_DIR']
+    os.makedirs(reports_dir, exist_ok=True)
+    scan_id = f"scan_{scan_run_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+    xml_output = os.path.join(reports_dir, f"{scan_id}.xml")
+    normal_output = os.path.join(reports_dir, f"{scan_id}.txt")
+    # Without XML, finalize_scan_run fails the run because the file is missing
+    if xml_data:
+        with open(xml_output, 'wb') as xml_file:
+            xml_file.write(xml_data)
+    with open(normal_output, 'wb') as normal_file:
+        normal_file.write(normal_data or b'')
+
+    scan_run.xml_output_path = xml_output
+    scan_run.lease_expires_at = None
+    if return_code == 0:
+        scan_run.progress = 100
+    db.session.commit()
+    current_app.logger.info(f"[ScanRun {scan_run_id}] Scan agent '{agent.name}' uploaded its output (return code {return_code})")
+    # An agent interrupts Nmap when told the deadline passed, so a failed run past it is salvaged
+    deadline_reached = return_code != 0 and deadline_passed(scan_run)
+    return finalize_scan_run(scan_run_id, return_code, output_lines, xml_output, normal_output, f"agent:{agent.name}", deadline_reached=deadline_reached)
+
+def expire_agent_leases():
+    """
+    Requeue runs whose agent stopped renewing the lease, so another agent can pick them up;
+    a run whose lease ran out AGENT_MAX_LEASES times is failed. Must be called within an app context.
+    Returns the number of expired leases.
+    """
+    max_leases = current_app.config.get('AGENT_MAX_LEASES', 3)
+    expired = ScanRun.query.filter(
+        ScanRun.agent_id.isnot(None),
+        ScanRun.status.in_(LEASED_STATUSES),
+        ScanRun.lease_expires_at < datetime.utcnow()
+    ).all()
+    for scan_run in expired:
+        agent_name = scan_run.agent.name if scan_run.agent else scan_run.agent_id
+        if (scan_run.lease_count or 0) < max_leases:
+            scan_run.status = 'queued'
+            scan_run.agent_id = None
+            scan_run.progress = 0
+            scan_run.error_message = f"Lease of scan agent '{agent_name}' expired; requeued"
+            current_app.logger.warning(f"[ScanRun {scan_run.id}] Lease of scan agent '{agent_name}' expired; requeued")
+        else:
+            scan_run.status = 'failed'
+            scan_run.completed_at = datetime.utcnow()
+            scan_run.error_message = f"Lease of scan agent '{agent_name}' expired {scan_run.lease_count} times"
+            current_app.logger.error(f"[ScanRun {scan_run.id}] {scan_run.error_message}; giving up")
+        scan_run.lease_expires_at = None
+    if expired:
+        db.session.commit()
+    return len(expired)
@@ -0,0 +1,62 @@
+"""
+Compressed storage of report files: once a run's report is ingested, its Nmap XML and normal
+output are compressed with the method of NMAP_ARTIFACT_COMPRESSION and the report points at
+the compressed files.
+"""
+import os
+from flask import current_app
+from app import db
+from app.models.task import ScanRun
+from app.models.report import ScanReport
+from app.utils.artifact_compression import artifact_encoding, resolve_compression, compress_artifact
+from app.tasks.report_retention import get_artifact_remover
+
+def compress_report_artifacts(scan_run_id, report_id):
+    """
+    Compress the XML and normal output files of a report if artifact compression is enabled.
+    Must be called within an app context, after everything that reads the files uncompressed.
+    Returns the number of files compressed; a file that fails is left uncompressed.
+    """
+    method = current_app.config.get('NMAP_ARTIFACT_COMPRESSION', 'none')
+    encoding = resolve_compression(method)
+    if encoding is None:
+        return 0
+    if encoding != method.lower():
+        current_app.logger.warning(f"[ScanRun {scan_run_id}] zstandard is not installed; compressing report files with {encoding}")
+
+    report = ScanReport.query.get(report_id)
+    if not report:
+        return 0
+    # Original path -> compressed path
+    replaced = {}
+    for attr in ('xml_report_path', 'normal_report_path'):
+        path = getattr(report, attr)
+        if not path or artifact_encoding(path) or not os.path.exists(path):
+            continue
+        try:
+            original_size = os.path.getsize(path)
+            compressed_path = compress_artifact(path, encoding)
+        except OSError as e:
+            current_app.logger.error(f"[ScanRun {scan_run_id}] Error compressing {path}: {str(e)}")
+            continue
+        setattr(report, attr, compressed_path)
+        replaced[path] = compressed_path
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Compressed {path} with {encoding}: {original_size} -> {os.path.getsize(compressed_path)} bytes")
+    if not replaced:
+        return 0
+
+    scan_run = ScanRun.query.get(scan_run_id)
+    if scan_run and scan_run.xml_output_path in replaced:
+        scan_run.xml_output_path = replaced[scan_run.xml_output_path]
+    try:
+        db.session.commit()
+    except Exception:
+        # The report still points at the originals; drop the compressed copies
+        db.session.rollback()
+        for compressed_path in replaced.values():
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
+        raise
+    # The originals are only removed once the report points at the compressed files
+    get_artifact_remover().remove(list(replaced))
+    return len(replaced)
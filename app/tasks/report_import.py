@@ -0,0 +1,324 @@
+"""
+Bulk import of Nmap XML produced outside the application. The XML files of a directory, tarball
+or zip archive are hashed and parsed in a process pool; files whose content was imported before
+are skipped, and every other file becomes a completed run of the chosen task whose report is
+written with the same bulk inserts as reports of scans run here. Files uploaded on a task page are
+queued as ReportImport rows and imported by a background job.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from werkzeug.utils import secure_filename
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from app.models.task import ScanTask, ScanRun, ReportImport
+from app.models.report import ScanReport
+from app.tasks.report_parsing import iter_report_hosts, insert_host_findings
+from app.tasks.report_artifacts import compress_report_artifacts
+from app.utils.artifact_compression import open_artifact
+
+# Files taken from a directory or archive; compressed XML is read as it is stored
+IMPORT_SUFFIXES = ('.xml', '.xml.gz', '.xml.zst')
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files submitted for parsing per worker at a time
+IMPORT_PARSE_AHEAD = 2
+
+class ImportStats:
+    """Counters and throughput of one import"""
+
+    def __init__(self):
+        self.files = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.hosts = 0
+        self.ports = 0
+        self.elapsed = 0.0
+
+    @property
+    def files_per_second(self):
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def rows_per_second(self):
+        return (self.hosts + self.ports) / self.elapsed if self.elapsed else 0.0
+
+    def describe(self):
+        return (f"Imported {self.imported} of {self.files} file(s) ({self.duplicates} already imported, {self.failed} failed): "
+                f"{self.hosts} hosts and {self.ports} ports in {self.elapsed:.1f}s, "
+                f"{self.files_per_second:.1f} files/s, {self.rows_per_second:.0f} rows/s")
+
+def collect_import_files(source, workdir, max_extract_bytes=None):
+    """
+    Return the (path, name) of every Nmap XML file of a directory, tarball, zip archive or single file.
+    Archive members are extracted into workdir under flattened names; other archive content is ignored.
+    Raises ValueError for a source that is none of these, or an archive whose XML files extract to
+    more than max_extract_bytes in total.
+    """
+    files = []
+    extracted = 0
+
+    def extract(src, name):
+        nonlocal extracted
+        remaining = max_extract_bytes - extracted if max_extract_bytes else None
+        path, size = _extract_member(src, name, len(files), workdir, remaining)
+        if path is None:
+            raise ValueError(f"The XML files of {os.path.basename(source)} extract to more than "
+                             f"{max_extract_bytes // (1024 * 1024)} MB (IMPORT_MAX_EXTRACT_MB)")
+        extracted += size
+        return path
+
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(IMPORT_SUFFIXES):
+                    path = os.path.join(dirpath, filename)
+                    files.append((path, os.path.relpath(path, source)))
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and member.filename.lower().endswith(IMPORT_SUFFIXES):
+                    with archive.open(member) as src:
+                        files.append((extract(src, member.filename), member.filename))
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source, 'r:*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(IMPORT_SUFFIXES):
+                    with archive.extractfile(member) as src:
+                        files.append((extract(src, member.name), member.name))
+    elif os.path.isfile(source) and source.lower().endswith(IMPORT_SUFFIXES):
+        files.append((source, os.path.basename(source)))
+    else:
+        raise ValueError(f"{os.path.basename(source)} is not an Nmap XML file, a directory, a tarball or a zip archive")
+    return files
+
+def _extract_member(src, name, number, workdir, max_bytes=None):
+    """
+    Copy an archive member into workdir and return (path, size), or (None, 0) once it exceeds
+    max_bytes; the size is counted while copying, since the sizes an archive declares can be forged.
+    """
+    # Member names are never used as paths, so entries like ../../etc cannot escape workdir
+    path = os.path.join(workdir, f"{number:06d}_{secure_filename(os.path.basename(name)) or 'report.xml'}")
+    size = 0
+    with open(path, 'wb') as dst:
+        while True:
+            chunk = src.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                # The partial file is removed with workdir
+                return None, 0
+            dst.write(chunk)
+    return path, size
+
+def hash_import_file(path):
+    """SHA-256 of the uncompressed content of an XML file; runs in the import pool"""
+    digest = hashlib.sha256()
+    with open_artifact(path) as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def parse_import_file(path):
+    """Return (summary, hosts) of an XML file, parsed incrementally; runs in the import pool"""
+    summary = {}
+    with open_artifact(path) as f:
+        hosts = list(iter_report_hosts(f, summary))
+    return summary, hosts
+
+def _find_imported_hashes(hashes):
+    imported = set()
+    hashes = list(hashes)
+    for start in range(0, len(hashes), 500):
+        rows = db.session.query(ScanReport.content_hash).filter(ScanReport.content_hash.in_(hashes[start:start + 500])).all()
+        imported.update(content_hash for (content_hash,) in rows)
+    return imported
+
+def _store_report(scan_task, path, name, content_hash, summary, hosts, stats):
+    """Create the completed run and report of one parsed file, committing its hosts in batches"""
+    batch_size = max(1, current_app.config.get('NMAP_INGEST_BATCH_SIZE', 500))
+    start = summary.get('start', '')
+    scanned_at = datetime.utcfromtimestamp(int(start)) if start.isdigit() else datetime.utcnow()
+
+    scan_run = ScanRun(task_id=scan_task.id, status='completed', progress=100, started_at=scanned_at, completed_at=scanned_at)
+    db.session.add(scan_run)
+    db.session.flush()
+    # The report keeps its own copy of the file; compressed sources keep their suffix
+    suffix = next(s for s in IMPORT_SUFFIXES[::-1] if name.lower().endswith(s))
+    stored_path = os.path.join(current_app.config['NMAP_REPORTS_DIR'], f"import_{scan_run.id}_{content_hash[:12]}{suffix}")
+    shutil.copyfile(path, stored_path)
+    report = ScanReport(
+        scan_run_id=scan_run.id,
+        xml_report_path=stored_path,
+        summary=json.dumps(summary),
+        status='ingesting',
+        content_hash=content_hash,
+        created_at=scanned_at
+    )
+    db.session.add(report)
+    db.session.commit()
+    report_id = report.id
+
+    try:
+        ports = 0
+        for batch_start in range(0, len(hosts), batch_size):
+            ports += insert_host_findings(report_id, hosts[batch_start:batch_start + batch_size])
+            db.session.commit()
+        report = ScanReport.query.get(report_id)
+        report.status = 'complete'
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        db.session.delete(ScanRun.query.get(scan_run.id))
+        db.session.commit()
+        if os.path.exists(stored_path):
+            os.remove(stored_path)
+        raise
+    compress_report_artifacts(scan_run.id, report_id)
+    stats.imported += 1
+    stats.hosts += len(hosts)
+    stats.ports += ports
+
+def import_nmap_xml(source, scan_task, workers=None):
+    """
+    Import the Nmap XML files of a directory, tarball, zip archive or single file into a task.
+    Must be called within an app context. Returns an ImportStats.
+    """
+    workers = max(1, workers or current_app.config.get('IMPORT_WORKERS', 4))
+    stats = ImportStats()
+    started = time.monotonic()
+    workdir = tempfile.mkdtemp(prefix='nmapwebui-import-')
+    try:
+        max_extract_mb = current_app.config.get('IMPORT_MAX_EXTRACT_MB', 5120)
+        files = collect_import_files(source, workdir, max_extract_mb * 1024 * 1024 if max_extract_mb > 0 else None)
+        stats.files = len(files)
+        if not files:
+            return stats
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(files)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            hashes = list(pool.map(hash_import_file, [path for path, _ in files], chunksize=8))
+            imported_hashes = _find_imported_hashes(set(hashes))
+            queued = []
+            for (path, name), content_hash in zip(files, hashes):
+                if content_hash in imported_hashes:
+                    stats.duplicates += 1
+                    continue
+                imported_hashes.add(content_hash)
+                queued.append((path, name, content_hash))
+
+            # Parsed files wait in memory for their inserts, so only a few are submitted ahead
+            max_in_flight = workers * IMPORT_PARSE_AHEAD
+            queued = iter(queued)
+            pending = {}
+            while True:
+                for path, name, content_hash in queued:
+                    pending[pool.submit(parse_import_file, path)] = (path, name, content_hash)
+                    if len(pending) >= max_in_flight:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, name, content_hash = pending.pop(future)
+                    try:
+                        summary, hosts = future.result()
+                        _store_report(scan_task, path, name, content_hash, summary, hosts, stats)
+                    except Exception as e:
+                        db.session.rollback()
+                        stats.failed += 1
+                        current_app.logger.warning(f"Could not import {name} into task {scan_task.id}: {str(e)}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        stats.elapsed = time.monotonic() - started
+    current_app.logger.info(f"Import into task {scan_task.id} from {os.path.basename(source)}: {stats.describe()}")
+    return stats
+
+def queue_report_import(scan_task, upload):
+    """
+    Save an uploaded file under NMAP_REPORTS_DIR and queue its import into a task.
+    Returns the ReportImport; the caller is responsible for committing the session.
+    """
+    filename = secure_filename(upload.filename) or 'upload'
+    report_import = ReportImport(task_id=scan_task.id, filename=filename[:255], status='queued')
+    db.session.add(report_import)
+    db.session.flush()
+    # One directory per import keeps the uploaded name, which errors about the file refer to
+    upload_dir = os.path.join(current_app.config['NMAP_REPORTS_DIR'], 'imports', str(report_import.id))
+    os.makedirs(upload_dir, exist_ok=True)
+    report_import.upload_path = os.path.join(upload_dir, filename)
+    upload.save(report_import.upload_path)
+    return report_import
+
+def _claim_report_import(import_id):
+    # Conditional update, so an import is only run once even if two processes look at the queue
+    claimed = db.session.execute(
+        update(ReportImport).where(ReportImport.id == import_id, ReportImport.status == 'queued')
+        .values(status='running', started_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+def run_queued_report_imports():
+    """
+    Run the queued imports of uploaded files one after the other, recording the statistics or the
+    error of each and removing its upload. Must be called within an app context.
+    Returns the number of imports run.
+    """
+    import_ids = [import_id for (import_id,) in db.session.query(ReportImport.id)
+                  .filter(ReportImport.status == 'queued').order_by(ReportImport.id).all()]
+    run = 0
+    for import_id in import_ids:
+        if not _claim_report_import(import_id):
+            continue
+        report_import = ReportImport.query.get(import_id)
+        scan_task = ScanTask.query.get(report_import.task_id)
+        try:
+            stats = import_nmap_xml(report_import.upload_path, scan_task)
+            report_import = ReportImport.query.get(import_id)
+            report_import.status = 'completed'
+            report_import.message = stats.describe()
+        except ValueError as e:
+            # Not a file that can be imported; the message is shown to the uploader
+            db.session.rollback()
+            current_app.logger.warning(f"Could not import {report_import.filename} into task {report_import.task_id}: {str(e)}")
+            report_import = ReportImport.query.get(import_id)
+            report_import.status = 'failed'
+            report_import.message = str(e)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error importing {report_import.filename} into task {report_import.task_id}: {str(e)}", exc_info=True)
+            report_import = ReportImport.query.get(import_id)
+            report_import.status = 'failed'
+            report_import.message = 'The import failed. Please check logs.'
+        report_import.completed_at = datetime.utcnow()
+        upload_path = report_import.upload_path
+        report_import.upload_path = None
+        db.session.commit()
+        if upload_path:
+            shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+        run += 1
+    return run
+
+def requeue_interrupted_report_imports():
+    """
+    Queue the imports left 'running' by a restart again; files they already stored are skipped
+    as duplicates on the next attempt. Must be called within an app context.
+    Returns the number of imports requeued.
+    """
+    requeued = ReportImport.query.filter_by(status='running').update({'status': 'queued', 'started_at': None})
+    db.session.commit()
+    return requeued
@@ -0,0 +1,209 @@
+"""
+Helpers shared by the report creation paths to turn Nmap XML elements into report rows.
+"""
+import json
+try:
+    from lxml import etree as iterparse_etree
+    LXML_AVAILABLE = True
+except ImportError:
+    import xml.etree.ElementTree as iterparse_etree
+    LXML_AVAILABLE = False
+from app import db
+from app.models.report import HostFinding, PortFinding, ScriptResult
+from app.tasks.finding_lookups import encode_port_rows
+
+def parse_nmaprun_summary(attrs):
+    """Build the report summary dict from the attributes of the <nmaprun> element"""
+    return {
+        'scanner': attrs.get('scanner', ''),
+        'args': attrs.get('args', ''),
+        'start': attrs.get('start', ''),
+        'startstr': attrs.get('startstr', ''),
+        'version': attrs.get('version', ''),
+        'xmloutputversion': attrs.get('xmloutputversion', '')
+    }
+
+def parse_runstats(run_stats, summary):
+    """Add the host counters of a <runstats> element to the summary dict"""
+    if run_stats is None:
+        return summary
+    hosts_stats = run_stats.find('hosts')
+    if hosts_stats is not None:
+        summary['hosts_total'] = hosts_stats.get('total', '0')
+        summary['hosts_up'] = hosts_stats.get('up', '0')
+        summary['hosts_down'] = hosts_stats.get('down', '0')
+    return summary
+
+def _parse_script_table(elem):
+    """Structured script output: a dict when every <elem>/<table> child has a key, a list otherwise"""
+    children = [child for child in elem if child.tag in ('elem', 'table')]
+    values = [_parse_script_table(child) if child.tag == 'table' else (child.text or '') for child in children]
+    if children and all(child.get('key') is not None for child in children):
+        return {child.get('key'): value for child, value in zip(children, values)}
+    return values
+
+def parse_script_element(script_elem):
+    """Extract the id, output and structured data of a <script> element into a dict"""
+    data = _parse_script_table(script_elem)
+    return {
+        'id': script_elem.get('id', ''),
+        'output': script_elem.get('output'),
+        'data': data or None
+    }
+
+def parse_host_element(host_elem):
+    """Extract the host, OS and port data of a single <host> element into a dict"""
+    host_data = {}
+    status_elem = host_elem.find('status')
+    host_data['status'] = status_elem.get('state') if status_elem is not None else 'unknown'
+    address_elem = host_elem.find('address')
+    host_data['ip_address'] = address_elem.get('addr') if address_elem is not None else ''
+
+    hostnames_elem = host_elem.find('hostnames')
+    hostname = None
+    if hostnames_elem is not None:
+        hostname_elem = hostnames_elem.find('hostname')
+        if hostname_elem is not None:
+            hostname = hostname_elem.get('name')
+    host_data['hostname'] = hostname
+
+    os_info_parts = []
+    os_elem = host_elem.find('os')
+    if os_elem is not None:
+        for osmatch_elem in os_elem.findall('osmatch'):
+            os_name = osmatch_elem.get('name', 'Unknown OS')
+            os_accuracy = osmatch_elem.get('accuracy', '0')
+            os_info_parts.append(f"{os_name} (Accuracy: {os_accuracy}%)")
+            for osclass_elem in osmatch_elem.findall('osclass'):
+                os_vendor = osclass_elem.get('vendor', '')
+                os_family = osclass_elem.get('osfamily', '')
+                os_gen = osclass_elem.get('osgen', '')
+                os_class_type = osclass_elem.get('type', '')
+                os_info_parts.append(f"  Class: {os_class_type} | Vendor: {os_vendor} | Family: {os_family} | Gen: {os_gen}")
+    host_data['os_info'] = json.dumps(os_info_parts) if os_info_parts else None
+
+    host_data['ports'] = []
+    ports_elem = host_elem.find('ports')
+    if ports_elem is not None:
+        for port_elem in ports_elem.findall('port'):
+            port_data = {}
+            port_data['port_number'] = port_elem.get('portid')
+            port_data['protocol'] = port_elem.get('protocol')
+            state_elem = port_elem.find('state')
+            port_data['state'] = state_elem.get('state') if state_elem is not None else 'unknown'
+
+            service_elem = port_elem.find('service')
+            port_data['service_name'] = None
+            port_data['product'] = None
+            port_data['version'] = None
+            port_data['extrainfo'] = None
+            port_data['cpe'] = None
+            if service_elem is not None:
+                port_data['service_name'] = service_elem.get('name')
+                port_data['product'] = service_elem.get('product')
+                port_data['version'] = service_elem.get('version')
+                port_data['extrainfo'] = service_elem.get('extrainfo', '')[:255] or None
+                cpe_elem = service_elem.find('cpe')
+                port_data['cpe'] = cpe_elem.text if cpe_elem is not None else None
+            port_data['scripts'] = [parse_script_element(script_elem) for script_elem in port_elem.findall('script')]
+            host_data['ports'].append(port_data)
+
+    hostscript_elem = host_elem.find('hostscript')
+    host_data['scripts'] = [parse_script_element(script_elem) for script_elem in hostscript_elem.findall('script')] if hostscript_elem is not None else []
+    return host_data
+
+def iter_report_hosts(xml_path, summary):
+    """
+    Parse an Nmap XML file (a path or binary file object) incrementally and yield the dict of
+    each <host> element in turn.
+    The summary dict is filled from the <nmaprun> and <runstats> elements as they are read.
+    Every top-level element is dropped from the tree once handled, so memory use does not
+    grow with the size of the file. Uses lxml when it is installed, ElementTree otherwise.
+    """
+    root = None
+    depth = 0
+    for event, elem in iterparse_etree.iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                root = elem
+                summary.update(parse_nmaprun_summary(elem.attrib))
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if elem.tag == 'host':
+            yield parse_host_element(elem)
+        elif elem.tag == 'runstats':
+            parse_runstats(elem, summary)
+        # Only the element just finished is left under the root, so clearing it is cheap
+        root.clear()
+
+def _insert_returning_ids(table, rows):
+    """Insert rows with one executemany and return their IDs in the order of the rows"""
+    if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        return db.session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+    # Databases without multi-row RETURNING (e.g. MySQL) get one insert per row
+    return [db.session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+def _script_rows(host_id, port_id, scripts):
+    return [{
+        'host_id': host_id,
+        'port_id': port_id,
+        'script_id': script['id'][:64],
+        'output': script['output'],
+        'data': json.dumps(script['data']) if script['data'] else None
+    } for script in scripts]
+
+def insert_host_findings(report_id, hosts):
+    """
+    Insert parsed host dicts and their ports into a report with bulk Core inserts: one executemany
+    for the hosts, whose RETURNING gives their IDs in parameter order, one for all their ports,
+    whose service values are first replaced by the IDs of their lookup table rows, and one for
+    their NSE script results (the port IDs are returned the same way when there are any).
+    Returns the number of port rows inserted. The caller is responsible for committing the session.
+    """
+    if not hosts:
+        return 0
+    host_rows = [{
+        'report_id': report_id,
+        'ip_address': host_data['ip_address'],
+        'hostname': host_data['hostname'],
+        'status': host_data['status'],
+        'os_info': host_data['os_info']
+    } for host_data in hosts]
+    host_ids = _insert_returning_ids(HostFinding.__table__, host_rows)
+
+    port_rows = [{
+        'host_id': host_id,
+        'port_number': int(port_data['port_number']),
+        'protocol': port_data['protocol'],
+        'state': port_data['state'],
+        'service_name': port_data.get('service_name'),
+        'product': port_data.get('product'),
+        'version': port_data.get('version'),
+        'cpe': port_data.get('cpe'),
+        'extrainfo': port_data.get('extrainfo')
+    } for host_id, host_data in zip(host_ids, hosts) for port_data in host_data['ports']]
+    script_rows = []
+    for host_id, host_data in zip(host_ids, hosts):
+        script_rows.extend(_script_rows(host_id, None, host_data.get('scripts', ())))
+    if port_rows:
+        encode_port_rows(port_rows)
+        port_scripts = [port_data.get('scripts', ()) for host_data in hosts for port_data in host_data['ports']]
+        if any(port_scripts):
+            port_ids = _insert_returning_ids(PortFinding.__table__, port_rows)
+            for port_id, port_row, scripts in zip(port_ids, port_rows, port_scripts):
+                script_rows.extend(_script_rows(port_row['host_id'], port_id, scripts))
+        else:
+            db.session.execute(PortFinding.__table__.insert(), port_rows)
+    if script_rows:
+        db.session.execute(ScriptResult.__table__.insert(), script_rows)
+    return len(port_rows)
+
+def get_task_max_reports(scan_task):
+    """Return the maximum number of reports to keep for a task"""
+    if scan_task.use_global_max_reports:
+        from app.models.settings import SystemSettings
+        return SystemSettings.get_int('max_reports_per_task', 15)
+    return scan_task.max_reports or 15
@@ -0,0 +1,124 @@
+"""
+Report retention: a periodic job deletes the scan reports of each task beyond its maximum report
+setting; imported reports are kept. Findings are removed with set-based DELETEs over chunks of hosts, each chunk in its own
+short transaction followed by a pause, so that scans writing their reports are never kept waiting
+on the SQLite write lock for long; a run stops after a time budget and the next run continues.
+The report files are removed by a background thread once their rows are gone.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from sqlalchemy import delete, select
+from flask import current_app
+from app import db
+from app.models.task import ScanTask, ScanRun
+from app.models.report import ScanReport, HostFinding, PortFinding, ScriptResult
+from app.tasks.report_parsing import get_task_max_reports
+
+logger = logging.getLogger(__name__)
+
+class ArtifactRemover:
+    """Deletes report files queued by the retention job on its own daemon thread"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def remove(self, paths):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='report-artifact-remover', daemon=True)
+                self._thread.start()
+        for path in paths:
+            self._queue.put(path)
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error deleting report file {path}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every queued file has been handled"""
+        self._queue.join()
+
+_artifact_remover = ArtifactRemover()
+
+def get_artifact_remover():
+    return _artifact_remover
+
+def find_expired_reports():
+    """
+    Return the (id, xml_report_path, normal_report_path) rows of the reports beyond their task's limit, oldest last.
+    Imported reports (those with a content hash) neither count against the limit nor expire.
+    """
+    expired = []
+    for scan_task in ScanTask.query.all():
+        rows = db.session.query(ScanReport.id, ScanReport.xml_report_path, ScanReport.normal_report_path, ScanReport.status) \
+            .join(ScanRun, ScanRun.id == ScanReport.scan_run_id) \
+            .filter(ScanRun.task_id == scan_task.id, ScanReport.content_hash.is_(None)) \
+            .order_by(ScanReport.created_at.desc(), ScanReport.id.desc()) \
+            .offset(get_task_max_reports(scan_task)).all()
+        # A report still being written belongs to a running scan; it is counted but left alone
+        expired.extend((row.id, row.xml_report_path, row.normal_report_path) for row in rows if row.status != 'ingesting')
+    return expired
+
+def _pause(pause_seconds, deadline):
+    if time.monotonic() + pause_seconds < deadline:
+        time.sleep(pause_seconds)
+
+def delete_report_rows(report_ids, chunk_size, pause_seconds, deadline):
+    """
+    Delete the findings and script results of the given reports chunk_size hosts at a time, then the reports.
+    Returns True when everything was deleted, False if the deadline (monotonic) came first.
+    """
+    while True:
+        host_ids = db.session.execute(
+            select(HostFinding.id).where(HostFinding.report_id.in_(report_ids)).limit(chunk_size)
+        ).scalars().all()
+        if not host_ids:
+            break
+        db.session.execute(delete(ScriptResult).where(ScriptResult.host_id.in_(host_ids)))
+        db.session.execute(delete(PortFinding).where(PortFinding.host_id.in_(host_ids)))
+        db.session.execute(delete(HostFinding).where(HostFinding.id.in_(host_ids)))
+        db.session.commit()
+        if time.monotonic() >= deadline:
+            return False
+        _pause(pause_seconds, deadline)
+    db.session.execute(delete(ScanReport).where(ScanReport.id.in_(report_ids)))
+    db.session.commit()
+    return True
+
+def purge_expired_reports():
+    """
+    Delete the reports beyond each task's maximum report setting, with their findings and files.
+    Returns (deleted, remaining): the number of reports deleted and of expired reports left for the next run.
+    """
+    chunk_size = max(1, current_app.config.get('REPORT_RETENTION_CHUNK_HOSTS', 1000))
+    pause_seconds = current_app.config.get('REPORT_RETENTION_PAUSE_SECONDS', 0.1)
+    deadline = time.monotonic() + current_app.config.get('REPORT_RETENTION_MAX_SECONDS', 30)
+    reports_per_chunk = max(1, current_app.config.get('REPORT_RETENTION_CHUNK_REPORTS', 20))
+
+    expired = find_expired_reports()
+    # The ORM query session is not needed any more; end its read transaction before deleting
+    db.session.commit()
+    deleted = 0
+    for start in range(0, len(expired), reports_per_chunk):
+        chunk = expired[start:start + reports_per_chunk]
+        if not delete_report_rows([report_id for report_id, _, _ in chunk], chunk_size, pause_seconds, deadline):
+            break
+        get_artifact_remover().remove([path for _, xml_path, normal_path in chunk for path in (xml_path, normal_path) if path])
+        deleted += len(chunk)
+        if time.monotonic() >= deadline:
+            break
+        _pause(pause_seconds, deadline)
+    return deleted, len(expired) - deleted
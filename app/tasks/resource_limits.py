@@ -0,0 +1,147 @@
+"""
+Resource governance for Nmap children: every Nmap command is prefixed with nice, ionice, taskset
+and prlimit so that intense scans cannot starve the web worker on the same host. The limits are
+the NMAP_* defaults of the config, overridden per scan profile by NMAP_PROFILE_RESOURCE_LIMITS.
+"""
+import re
+import time
+import shutil
+import psutil
+from flask import current_app
+from app.models.task import ScanRun
+
+IONICE_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+CPU_LIST_RE = re.compile(r'^[0-9]+(-[0-9]+)?(,[0-9]+(-[0-9]+)?)*$')
+
+def get_resource_limits(scan_profile):
+    """Return the resource limits for Nmap processes of a scan profile"""
+    config = current_app.config
+    limits = {
+        'nice': config.get('NMAP_NICE', 0),
+        'ionice_class': config.get('NMAP_IONICE_CLASS', ''),
+        'ionice_level': config.get('NMAP_IONICE_LEVEL', 7),
+        'cpu_affinity': config.get('NMAP_CPU_AFFINITY', ''),
+        'max_memory_mb': config.get('NMAP_MAX_MEMORY_MB', 0),
+        'max_open_files': config.get('NMAP_MAX_OPEN_FILES', 0)
+    }
+    limits.update(config.get('NMAP_PROFILE_RESOURCE_LIMITS', {}).get(scan_profile, {}))
+    return limits
+
+def build_resource_prefix(limits):
+    """
+    Build the command prefix applying the limits; the settings are inherited through sudo by Nmap.
+    Limits whose tool is not installed or whose value is invalid are skipped with a warning.
+    Returns an empty string or the prefix followed by a space.
+    """
+    parts = []
+
+    def tool(name):
+        path = shutil.which(name)
+        if not path:
+            current_app.logger.warning(f"{name} not found; Nmap resource limit skipped")
+        return path
+
+    nice = int(limits.get('nice') or 0)
+    if nice and tool('nice'):
+        parts.append(f"nice -n {max(-20, min(19, nice))}")
+
+    ionice_class = (limits.get('ionice_class') or '').lower()
+    if ionice_class:
+        if ionice_class not in IONICE_CLASSES:
+            current_app.logger.warning(f"Unknown IO scheduling class '{ionice_class}'; expected one of {', '.join(IONICE_CLASSES)}")
+        elif tool('ionice'):
+            ionice = f"ionice -c {IONICE_CLASSES[ionice_class]}"
+            if ionice_class != 'idle':
+                ionice += f" -n {max(0, min(7, int(limits.get('ionice_level') or 0)))}"
+            parts.append(ionice)
+
+    cpu_affinity = str(limits.get('cpu_affinity') or '').replace(' ', '')
+    if cpu_affinity:
+        if not CPU_LIST_RE.match(cpu_affinity):
+            current_app.logger.warning(f"Invalid CPU list '{cpu_affinity}' for Nmap CPU affinity")
+        elif tool('taskset'):
+            parts.append(f"taskset -c {cpu_affinity}")
+
+    rlimits = []
+    max_memory_mb = int(limits.get('max_memory_mb') or 0)
+    if max_memory_mb > 0:
+        rlimits.append(f"--as={max_memory_mb * 1024 * 1024}")
+    max_open_files = int(limits.get('max_open_files') or 0)
+    if max_open_files > 0:
+        rlimits.append(f"--nofile={max_open_files}")
+    if rlimits and tool('prlimit'):
+        parts.append(f"prlimit {' '.join(rlimits)}")
+
+    return ' '.join(parts) + ' ' if parts else ''
+
+def _process_tree(pid):
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.Error:
+        return []
+
+def sample_scan_resource_usage(interval=0.5):
+    """
+    Sample the CPU and memory usage of the Nmap process trees of running scans with psutil,
+    together with the priority, IO class and CPU affinity their Nmap process actually got.
+    Must be called within an app context. Returns a list of dicts, one per scan run.
+    """
+    trees = []
+    for scan_run in ScanRun.query.filter(ScanRun.status.in_(['waiting', 'starting', 'running']), ScanRun.agent_id.is_(None)).order_by(ScanRun.id):
+        processes = []
+        for pid in scan_run.get_nmap_pids():
+            processes.extend(_process_tree(pid))
+        trees.append((scan_run, processes))
+
+    # cpu_percent() measures since its previous call, so every process is primed first
+    for _, processes in trees:
+        for process in processes:
+            try:
+                process.cpu_percent(None)
+            except psutil.Error:
+                pass
+    if any(processes for _, processes in trees):
+        time.sleep(interval)
+
+    usage = []
+    for scan_run, processes in trees:
+        entry = {
+            'scan_run_id': scan_run.id,
+            'task_name': scan_run.task.name if scan_run.task else '',
+            'status': scan_run.status,
+            'max_rate': scan_run.max_rate if scan_run.status != 'waiting' else None,
+            'processes': 0,
+            'cpu_percent': 0.0,
+            'rss_mb': 0.0,
+            'nice': None,
+            'ionice': None,
+            'cpu_affinity': None
+        }
+        nmap_process = None
+        for process in processes:
+            try:
+                entry['cpu_percent'] += process.cpu_percent(None)
+                entry['rss_mb'] += process.memory_info().rss / (1024 * 1024)
+                entry['processes'] += 1
+                if nmap_process is None and process.name() == 'nmap':
+                    nmap_process = process
+            except psutil.Error:
+                continue
+        # Without a process named nmap, the innermost process of the shell/sudo chain is the scanner
+        nmap_process = nmap_process or (processes[-1] if processes else None)
+        if nmap_process is not None:
+            for key, read in (('nice', nmap_process.nice), ('ionice', nmap_process.ionice), ('cpu_affinity', nmap_process.cpu_affinity)):
+                try:
+                    value = read()
+                except (psutil.Error, AttributeError, OSError):
+                    continue
+                if key == 'ionice':
+                    value = f"{value.ioclass.name.replace('IOPRIO_CLASS_', '').lower()}/{value.value}"
+                elif key == 'cpu_affinity':
+                    value = ','.join(str(cpu) for cpu in value) if len(value) < psutil.cpu_count() else 'all'
+                entry[key] = value
+        entry['cpu_percent'] = round(entry['cpu_percent'], 1)
+        entry['rss_mb'] = round(entry['rss_mb'], 1)
+        usage.append(entry)
+    return usage
@@ -0,0 +1,279 @@
+"""
+Scan result reuse: the host results of every completed run are cached per address and per
+normalized set of Nmap arguments. A later run with the same arguments takes the addresses that
+were scanned within the TTL of its profile from the cache and only sends the misses to Nmap.
+"""
+import json
+import hashlib
+import ipaddress
+from datetime import datetime, timedelta
+from sqlalchemy import insert, delete
+from flask import current_app
+from app import db
+from app.models.task import ScanRun
+from app.models.report import ScanReport, HostFinding, PortFinding, ScriptResult, ScanResultCache
+from app.utils.sanitize import sanitize_nmap_command, sanitize_nmap_targets
+from app.tasks.report_parsing import insert_host_findings
+
+# Number of addresses per IN (...) lookup and per executemany batch
+RESULT_CACHE_CHUNK_SIZE = 500
+
+# Options that only change where output goes, how much is logged, which addresses are skipped
+# or how fast the scan runs, not what a host's result looks like. --open (closed and filtered ports
+# left out) and --host-timeout (hosts cut off part way) do change it, so they are part of the key.
+NEUTRAL_VALUE_OPTIONS = {
+    '-oX', '-oN', '-oG', '-oA', '-oS', '--stats-every', '--excludefile', '--exclude',
+    '--min-rate', '--max-retries', '--min-hostgroup'
+}
+NEUTRAL_FLAGS = {'-v', '-vv', '-vvv', '-d', '-dd', '--reason'}
+
+def result_cache_key(nmap_args):
+    """Return the cache key of a set of Nmap arguments: a hash of the sanitized, normalized argv"""
+    tokens = (sanitize_nmap_command(nmap_args) or nmap_args).split()
+    kept = []
+    skip_value = False
+    for token in tokens:
+        if skip_value:
+            skip_value = False
+            continue
+        option = token.split('=', 1)[0]
+        if option in NEUTRAL_VALUE_OPTIONS:
+            skip_value = '=' not in token
+            continue
+        if token in NEUTRAL_FLAGS:
+            continue
+        kept.append(token)
+    return hashlib.sha256(' '.join(kept).encode('utf-8')).hexdigest()
+
+def get_result_cache_ttl(scan_profile):
+    """Return the result cache TTL in seconds for a scan profile, 0 if reuse is disabled"""
+    if not current_app.config.get('NMAP_RESULT_CACHE', False):
+        return 0
+    ttls = current_app.config.get('NMAP_RESULT_CACHE_TTLS', {})
+    return max(0, int(ttls.get(scan_profile, current_app.config.get('NMAP_RESULT_CACHE_TTL', 0))))
+
+def _expand_target(target, max_addresses):
+    """Return the addresses of an IP or CIDR target, or None if it cannot be served from the cache"""
+    try:
+        network = ipaddress.ip_network(target, strict=False)
+    except ValueError:
+        return None  # Hostnames and Nmap ranges are always scanned
+    if network.num_addresses > max_addresses:
+        return None
+    return [str(address) for address in network]
+
+def lookup_cached_hosts(addresses, cache_key, ttl):
+    """Return {ip_address: entry_id} of the fresh cache entries among addresses"""
+    fresh_after = datetime.utcnow() - timedelta(seconds=ttl)
+    hits = {}
+    for start in range(0, len(addresses), RESULT_CACHE_CHUNK_SIZE):
+        chunk = addresses[start:start + RESULT_CACHE_CHUNK_SIZE]
+        rows = db.session.query(ScanResultCache.id, ScanResultCache.ip_address).filter(
+            ScanResultCache.cache_key == cache_key,
+            ScanResultCache.ip_address.in_(chunk),
+            ScanResultCache.cached_at >= fresh_after
+        )
+        for entry_id, ip_address in rows:
+            hits[ip_address] = entry_id
+    return hits
+
+def plan_cached_targets(group_targets, cache_key, ttl):
+    """
+    Split the targets of a run into cache hits and the rest.
+    group_targets is a list of (target_group_id, [target values]). Targets whose addresses are
+    all cached are dropped; cached addresses of partly cached targets are to be excluded.
+    Must be called within an app context.
+    Returns (remaining group_targets, cached addresses to exclude, cache entry IDs to reuse).
+    """
+    max_addresses = current_app.config.get('NMAP_RESULT_CACHE_MAX_ADDRESSES', 4096)
+    expanded = {}
+    for _, values in group_targets:
+        for value in values:
+            for target in sanitize_nmap_targets(value):
+                if target not in expanded:
+                    expanded[target] = _expand_target(target, max_addresses)
+
+    addresses = sorted({address for target_addresses in expanded.values() if target_addresses for address in target_addresses})
+    hits = lookup_cached_hosts(addresses, cache_key, ttl) if addresses else {}
+    if not hits:
+        return group_targets, [], []
+
+    remaining = []
+    for group_id, values in group_targets:
+        kept = []
+        for value in values:
+            for target in sanitize_nmap_targets(value):
+                target_addresses = expanded.get(target)
+                if target_addresses and all(address in hits for address in target_addresses):
+                    continue
+                kept.append(target)
+        if kept:
+            remaining.append((group_id, kept))
+
+    # Every hit is excluded so that a hostname or large network covering it does not scan it again
+    cached_addresses = sorted(hits, key=ipaddress.ip_address)
+    return remaining, cached_addresses, sorted(hits.values())
+
+def _report_host_data(report_id, skip_addresses=()):
+    """Rebuild the parsed host dicts of a report from its findings"""
+    hosts = {}
+    for host in HostFinding.query.filter_by(report_id=report_id):
+        if host.ip_address in skip_addresses:
+            continue
+        hosts[host.id] = {
+            'ip_address': host.ip_address,
+            'hostname': host.hostname,
+            'status': host.status,
+            'os_info': host.os_info,
+            'ports': [],
+            'scripts': []
+        }
+    host_ids = list(hosts)
+    for start in range(0, len(host_ids), RESULT_CACHE_CHUNK_SIZE):
+        chunk = host_ids[start:start + RESULT_CACHE_CHUNK_SIZE]
+        ports = {}
+        for port in PortFinding.query.filter(PortFinding.host_id.in_(chunk)):
+            ports[port.id] = {
+                'port_number': port.port_number,
+                'protocol': port.protocol,
+                'state': port.state,
+                'service_name': port.service_name,
+                'product': port.product,
+                'version': port.version,
+                'extrainfo': port.extrainfo,
+                'cpe': port.cpe,
+                'scripts': []
+            }
+            hosts[port.host_id]['ports'].append(ports[port.id])
+        for script in ScriptResult.query.filter(ScriptResult.host_id.in_(chunk)).order_by(ScriptResult.id):
+            script_data = {'id': script.script_id, 'output': script.output, 'data': json.loads(script.data) if script.data else None}
+            if script.port_id is None:
+                hosts[script.host_id]['scripts'].append(script_data)
+            elif script.port_id in ports:
+                ports[script.port_id]['scripts'].append(script_data)
+    return list(hosts.values())
+
+def _load_cached_entries(entry_ids):
+    entries = []
+    for start in range(0, len(entry_ids), RESULT_CACHE_CHUNK_SIZE):
+        chunk = entry_ids[start:start + RESULT_CACHE_CHUNK_SIZE]
+        entries.extend(ScanResultCache.query.filter(ScanResultCache.id.in_(chunk)))
+    return entries
+
+def cache_run_results(scan_run_id, report_id):
+    """Store the hosts Nmap scanned in a completed run in the result cache"""
+    try:
+        scan_run = ScanRun.query.get(scan_run_id)
+        if not scan_run or not scan_run.result_cache_key:
+            return
+        cached_addresses = {entry.ip_address for entry in _load_cached_entries(scan_run.get_cached_host_ids())}
+        cached_at = scan_run.completed_at or datetime.utcnow()
+        values = [
+            {
+                'ip_address': host_data['ip_address'],
+                'cache_key': scan_run.result_cache_key,
+                'host_data': json.dumps(host_data),
+                'scan_run_id': scan_run_id,
+                'cached_at': cached_at
+            }
+            for host_data in _report_host_data(report_id, cached_addresses)
+            if host_data['ip_address']
+        ]
+        for start in range(0, len(values), RESULT_CACHE_CHUNK_SIZE):
+            chunk = values[start:start + RESULT_CACHE_CHUNK_SIZE]
+            db.session.execute(delete(ScanResultCache).where(
+                ScanResultCache.cache_key == scan_run.result_cache_key,
+                ScanResultCache.ip_address.in_([value['ip_address'] for value in chunk])
+            ))
+            db.session.execute(insert(ScanResultCache), chunk)
+        db.session.commit()
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Cached the results of {len(values)} address(es)")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error caching scan results: {str(e)}", exc_info=True)
+
+def merge_cached_hosts(scan_run_id, report_id):
+    """Add the cached hosts reused by a run to its report and count them in the summary"""
+    try:
+        scan_run = ScanRun.query.get(scan_run_id)
+        report = ScanReport.query.get(report_id)
+        if not scan_run or not report or not scan_run.cached_host_ids:
+            return 0
+        present = {ip_address for (ip_address,) in db.session.query(HostFinding.ip_address).filter(HostFinding.report_id == report_id)}
+        added = {'up': 0, 'down': 0}
+        merged_hosts = []
+        for entry in _load_cached_entries(scan_run.get_cached_host_ids()):
+            if entry.ip_address in present:
+                continue
+            host_data = json.loads(entry.host_data)
+            merged_hosts.append(host_data)
+            present.add(entry.ip_address)
+            if host_data['status'] in added:
+                added[host_data['status']] += 1
+        insert_host_findings(report_id, merged_hosts)
+
+        summary = json.loads(report.summary) if report.summary else {}
+        summary['hosts_up'] = str(int(summary.get('hosts_up', 0) or 0) + added['up'])
+        summary['hosts_down'] = str(int(summary.get('hosts_down', 0) or 0) + added['down'])
+        summary['hosts_total'] = str(int(summary.get('hosts_total', 0) or 0) + added['up'] + added['down'])
+        summary['cached_hosts'] = str(added['up'] + added['down'])
+        report.summary = json.dumps(summary)
+        db.session.commit()
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Merged {added['up'] + added['down']} cached host(s) into report {report_id}")
+        return added['up'] + added['down']
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"[ScanRun {scan_run_id}] Error merging cached hosts: {str(e)}", exc_info=True)
+        return 0
+
+def complete_from_cache(scan_run_id, nmap_args):
+    """Create the report of a run whose targets were all served from the result cache, without running Nmap"""
+    scan_run = ScanRun.query.get(scan_run_id)
+    if not scan_run:
+        return {'status': 'failed', 'message': 'Scan run not found', 'scan_run_id': scan_run_id}
+    try:
+        report = ScanReport(
+            scan_run_id=scan_run_id,
+            summary=json.dumps({'scanner': 'nmap', 'args': nmap_args, 'hosts_total': '0', 'hosts_up': '0', 'hosts_down': '0'})
+        )
+        db.session.add(report)
+        scan_run.report = report
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        message = f"Error creating report from cached results: {str(e)}"
+        current_app.logger.error(f"[ScanRun {scan_run_id}] {message}", exc_info=True)
+        scan_run = ScanRun.query.get(scan_run_id)
+        scan_run.status = 'failed'
+        scan_run.error_message = message
+        scan_run.completed_at = datetime.utcnow()
+        db.session.commit()
+        return {'status': 'failed', 'message': message, 'scan_run_id': scan_run_id}
+
+    merge_cached_hosts(scan_run_id, report.id)
+    scan_run = ScanRun.query.get(scan_run_id)
+    scan_run.status = 'completed'
+    scan_run.progress = 100
+    scan_run.error_message = None
+    scan_run.completed_at = datetime.utcnow()
+    db.session.commit()
+    current_app.logger.info(f"[ScanRun {scan_run_id}] Completed from the result cache (Report ID: {report.id})")
+    return {'status': 'completed', 'scan_run_id': scan_run_id, 'report_id': report.id}
+
+def purge_result_cache():
+    """
+    Delete cache entries older than the longest TTL, except those still to be merged into the
+    report of an unfinished run. Must be called within an app context.
+    """
+    ttls = list(current_app.config.get('NMAP_RESULT_CACHE_TTLS', {}).values())
+    ttls.append(current_app.config.get('NMAP_RESULT_CACHE_TTL', 0))
+    expired_before = datetime.utcnow() - timedelta(seconds=max(ttls))
+    in_use = set()
+    for scan_run in ScanRun.query.filter(ScanRun.status.in_(['queued', 'starting', 'running']), ScanRun.cached_host_ids.isnot(None)):
+        in_use.update(scan_run.get_cached_host_ids())
+    statement = delete(ScanResultCache).where(ScanResultCache.cached_at < expired_before)
+    if in_use:
+        statement = statement.where(ScanResultCache.id.notin_(in_use))
+    result = db.session.execute(statement)
+    db.session.commit()
+    return result.rowcount
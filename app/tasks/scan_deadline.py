@@ -0,0 +1,115 @@
+"""
+Hard wall-clock deadlines for scan runs: a scan that is still running when its task's deadline
+expires is interrupted like Ctrl+C, killed if it does not exit within a grace period, and the
+hosts already completed in its partial -oX output are salvaged into a report flagged as partial.
+"""
+import os
+import re
+import time
+import signal
+from datetime import datetime, timedelta
+import psutil
+from flask import current_app
+from app.tasks.scan_resume import NMAPRUN_START_RE, HOST_STATUS_RE
+
+START_TIME_RE = re.compile(r'\bstart="(\d+)"')
+
+def get_scan_deadline_seconds(scan_task):
+    """Return the wall-clock limit of a task's runs in seconds, or None if they may run indefinitely"""
+    minutes = scan_task.deadline_minutes or current_app.config.get('NMAP_SCAN_DEADLINE_MINUTES', 0)
+    return int(minutes) * 60 if minutes and int(minutes) > 0 else None
+
+def deadline_passed(scan_run):
+    """Return True if a run started longer ago than its task's deadline (used for runs on remote agents)"""
+    seconds = get_scan_deadline_seconds(scan_run.task)
+    return bool(seconds and scan_run.started_at and scan_run.started_at + timedelta(seconds=seconds) <= datetime.utcnow())
+
+def signal_process_trees(pids, sig):
+    """Send sig to every process in the trees rooted at pids; processes we may not signal are skipped"""
+    processes = []
+    for pid in pids:
+        try:
+            root = psutil.Process(pid)
+            processes.extend([root] + root.children(recursive=True))
+        except psutil.Error:
+            continue
+    for process in processes:
+        try:
+            process.send_signal(sig)
+        except psutil.Error:
+            continue
+
+class ScanDeadline:
+    """
+    Deadline of one scan run. check() is called periodically from the loop that reads Nmap's
+    output; once the deadline has passed it interrupts the Nmap process trees with SIGINT so
+    they stop cleanly, and kills whatever is left after the grace period.
+    """
+
+    def __init__(self, seconds, grace_seconds=30):
+        self.seconds = seconds
+        self.grace_seconds = grace_seconds
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self.reached = False
+        self._interrupted_at = None
+        self._killed = False
+
+    def check(self, pids):
+        """Enforce the deadline on the given process IDs; returns True once it has been reached"""
+        if self.expires_at is None or self._killed:
+            return self.reached
+        now = time.monotonic()
+        if not self.reached:
+            if now >= self.expires_at:
+                self.reached = True
+                self._interrupted_at = now
+                signal_process_trees(pids, signal.SIGINT)
+        elif now - self._interrupted_at >= self.grace_seconds:
+            self._killed = True
+            signal_process_trees(pids, signal.SIGKILL)
+        return self.reached
+
+def start_scan_deadline(seconds):
+    """Start the deadline of a run whose Nmap processes are launched now. Must be called within an app context."""
+    return ScanDeadline(seconds, current_app.config.get('NMAP_DEADLINE_GRACE_SECONDS', 30))
+
+def salvage_partial_xml(xml_path):
+    """
+    Make the XML output of a scan stopped before it finished parseable: everything after the
+    last complete <host> element is dropped and a <runstats> marking the run as interrupted
+    closes the document. Output that already parses is left alone.
+    Returns the number of complete hosts, or None if the file has no Nmap header at all.
+    """
+    if not os.path.exists(xml_path):
+        return None
+    with open(xml_path, 'r', encoding='utf-8', errors='replace') as xml_file:
+        content = xml_file.read()
+    header = NMAPRUN_START_RE.search(content)
+    if not header:
+        return None
+    if content.rstrip().endswith('</nmaprun>'):
+        return len(HOST_STATUS_RE.findall(content))
+
+    last_host_end = content.rfind('</host>')
+    if last_host_end > header.end():
+        body = content[:last_host_end + len('</host>')]
+    else:
+        body = content[:header.end()]
+    states = HOST_STATUS_RE.findall(body)
+    hosts_up = sum(1 for state in states if state == 'up')
+
+    now = int(time.time())
+    start = START_TIME_RE.search(header.group(0))
+    elapsed = now - int(start.group(1)) if start else 0
+    timestr = time.strftime('%a %b %d %H:%M:%S %Y', time.localtime(now))
+    runstats = (
+        f'\n<runstats><finished time="{now}" timestr="{timestr}" elapsed="{elapsed}" '
+        f'summary="Scan stopped at its deadline; {len(states)} hosts completed" exit="error"/>'
+        f'<hosts up="{hosts_up}" down="{len(states) - hosts_up}" total="{len(states)}"/>\n</runstats>\n</nmaprun>\n'
+    )
+    temp_path = f"{xml_path}.salvage"
+    with open(temp_path, 'w', encoding='utf-8') as xml_file:
+        xml_file.write(body.rstrip() + runstats)
+    os.replace(temp_path, xml_path)
+    current_app.logger.info(f"Salvaged {len(states)} completed hosts from the partial Nmap output {xml_path}")
+    return len(states)
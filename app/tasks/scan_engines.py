@@ -0,0 +1,307 @@
+"""
+Scan engines of a scan task. The 'nmap' engine runs the task's Nmap arguments against every
+target. The 'sweep' engine runs in two stages for large ranges: a fast stateless port sweep
+(masscan, or Nmap -sS --min-rate where masscan is not available) finds the open ports of the
+whole range, then Nmap service detection runs only on the discovered host:port pairs, in
+parallel batches whose outputs are merged into the run's report like shards.
+"""
+import re
+import sys
+import time
+import shutil
+import ipaddress
+import subprocess
+import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models.task import ScanRun
+from app.tasks.process_monitor import ProcessOutputMonitor, SIGNIFICANT_OUTPUT_RE, OUTPUT_BUFFER_LINES
+from app.tasks.nmap_events import ScanPhaseTracker, PORT_DISCOVERED
+from app.tasks.nmap_preflight import plan_privileges
+from app.tasks.progress import get_progress_reporter
+from app.tasks.sharded_scan import run_sharded_nmap_scan
+
+ENGINE_NMAP = 'nmap'
+ENGINE_SWEEP = 'sweep'
+SCAN_ENGINES = {
+    ENGINE_NMAP: 'Nmap',
+    ENGINE_SWEEP: 'Fast sweep + Nmap service scan'
+}
+
+SWEEP_PHASE = 'Port sweep'
+# Seconds masscan waits for late replies after its last probe
+MASSCAN_WAIT_SECONDS = 5
+# masscan status line: "rate:  9.98-kpps, 42.17% done,   0:01:23 remaining, found=12"
+MASSCAN_STATUS_RE = re.compile(r'rate:.*?([\d.]+)% done,\s+(\d+):(\d\d):(\d\d) remaining')
+# Port selection options of the task's arguments; the sweep picks the ports, the batches get the open ones
+PORT_SPEC_RE = re.compile(r'(?:^|\s)-p\s*(\S+)')
+PORT_SELECTION_RE = re.compile(r'(?:^|\s)(?:-p\s*\S+|-F|--top-ports(?:=|\s+)\d+|--port-ratio(?:=|\s+)[\d.]+|-sn|-Pn)(?=\s|$)')
+
+def get_scan_engine(scan_task):
+    """Return the engine a task runs with, falling back to Nmap for unknown values"""
+    engine = getattr(scan_task, 'scan_engine', None) or ENGINE_NMAP
+    return engine if engine in SCAN_ENGINES else ENGINE_NMAP
+
+def get_sweep_ports(nmap_args):
+    """Ports the sweep probes: the task's -p option, or NMAP_SWEEP_PORTS"""
+    match = PORT_SPEC_RE.search(nmap_args)
+    if not match:
+        return current_app.config.get('NMAP_SWEEP_PORTS', '1-65535')
+    ports = match.group(1)
+    if ports == '-':
+        return '1-65535'
+    # Only TCP ports are swept; Nmap's "T:" prefix is dropped and UDP ranges are left out
+    tcp_ports = [part[2:] if part.startswith('T:') else part for part in ports.split(',') if not part.startswith(('U:', 'S:'))]
+    return ','.join(tcp_ports) or current_app.config.get('NMAP_SWEEP_PORTS', '1-65535')
+
+def build_service_args(nmap_args):
+    """The task's arguments for the service scan batches: ports and host discovery removed, -sV added"""
+    args = PORT_SELECTION_RE.sub('', nmap_args).strip()
+    tokens = args.split()
+    if '-sV' not in tokens and '-A' not in tokens:
+        args += ' -sV'
+    # Every host of a batch answered the sweep
+    return f"{args} -Pn".strip()
+
+def _masscan_targets(targets):
+    """Return True if every target is an address or network masscan accepts"""
+    for target in targets:
+        try:
+            ipaddress.ip_network(target, strict=False)
+        except ValueError:
+            return False
+    return True
+
+def plan_port_sweep(nmap_args, targets, capabilities, resource_prefix, nmap_path, exclude_path=None, max_rate=None):
+    """
+    Build the command of the sweep stage. masscan is used when it is installed, can get root
+    privileges and every target is an address or network; otherwise Nmap sweeps with a SYN scan,
+    or a connect scan if it cannot get raw socket privileges.
+    Returns (tool, cmd). Must be called within an app context.
+    """
+    ports = get_sweep_ports(nmap_args)
+    rate = current_app.config.get('NMAP_SWEEP_RATE', 10000)
+    if max_rate:
+        rate = min(rate, max_rate)
+    exclude = f" --excludefile {exclude_path}" if exclude_path else ''
+    target_string = ' '.join(targets)
+
+    masscan_path = current_app.config.get('MASSCAN_PATH', '')
+    if masscan_path and shutil.which(masscan_path) and _masscan_targets(targets):
+        if capabilities.is_root or capabilities.passwordless_sudo:
+            sudo_prefix = '' if capabilities.is_root else 'sudo -n '
+            cmd = f"{resource_prefix}{sudo_prefix}{masscan_path} -p{ports} --rate {rate} --wait {MASSCAN_WAIT_SECONDS}{exclude} {target_string}"
+            return 'masscan', cmd
+        current_app.logger.warning("masscan needs root or passwordless sudo; sweeping with Nmap instead")
+
+    sudo_prefix, privilege_args, privilege_error = plan_privileges('-sS', capabilities)
+    scan_type = '-sS'
+    if privilege_error:
+        scan_type, sudo_prefix, privilege_args = '-sT', '', ''
+    privilege_args = f" {privilege_args}" if privilege_args else ''
+    cmd = (
+        f"{resource_prefix}{sudo_prefix}{nmap_path} -v -n -Pn {scan_type} -p {ports} "
+        f"--min-rate {rate} --max-rate {rate} --max-retries 1 --stats-every 5s{exclude}{privilege_args} {target_string}"
+    )
+    return 'nmap', cmd
+
+def build_service_batches(open_ports, batch_hosts):
+    """
+    Split the discovered host:port pairs into service scan batches of at most batch_hosts hosts.
+    Hosts are ordered by their open ports so that hosts with the same ports share a batch; each
+    batch scans the union of its hosts' ports.
+    Returns (shards, shard_args) in the form run_sharded_nmap_scan() takes.
+    """
+    hosts = sorted(open_ports, key=lambda host: (sorted(open_ports[host]), host))
+    shards, shard_args = [], []
+    for start in range(0, len(hosts), max(1, batch_hosts)):
+        batch = hosts[start:start + max(1, batch_hosts)]
+        ports = sorted(set().union(*(open_ports[host] for host in batch)))
+        shards.append((batch, len(batch)))
+        shard_args.append(f"-p {','.join(str(port) for port in ports)}")
+    return shards, shard_args
+
+def write_sweep_xml(xml_path, normal_path, open_ports, tool, cmd, started_at):
+    """
+    Write the sweep's findings as Nmap XML and normal output, for runs that end after the sweep:
+    no open port was found, or the deadline was reached before the service scans.
+    """
+    now = int(time.time())
+    root = ET.Element('nmaprun', {
+        'scanner': 'nmap',
+        'args': cmd,
+        'start': str(started_at),
+        'startstr': time.strftime('%a %b %d %H:%M:%S %Y', time.localtime(started_at)),
+        'version': tool,
+        'xmloutputversion': '1.05'
+    })
+    ET.SubElement(root, 'scaninfo', {'type': 'syn', 'protocol': 'tcp', 'numservices': '0', 'services': ''})
+    for host in sorted(open_ports):
+        host_elem = ET.SubElement(root, 'host', {'starttime': str(started_at), 'endtime': str(now)})
+        ET.SubElement(host_elem, 'status', {'state': 'up', 'reason': 'syn-ack'})
+        address_type = 'ipv6' if ':' in host else 'ipv4'
+        ET.SubElement(host_elem, 'address', {'addr': host, 'addrtype': address_type})
+        ports_elem = ET.SubElement(host_elem, 'ports')
+        for port in sorted(open_ports[host]):
+            port_elem = ET.SubElement(ports_elem, 'port', {'protocol': 'tcp', 'portid': str(port)})
+            ET.SubElement(port_elem, 'state', {'state': 'open', 'reason': 'syn-ack'})
+    run_stats = ET.SubElement(root, 'runstats')
+    ET.SubElement(run_stats, 'finished', {
+        'time': str(now),
+        'timestr': time.strftime('%a %b %d %H:%M:%S %Y', time.localtime(now)),
+        'elapsed': str(now - started_at),
+        'summary': f"Port sweep with {tool} found {sum(len(ports) for ports in open_ports.values())} open ports on {len(open_ports)} hosts",
+        'exit': 'success'
+    })
+    ET.SubElement(run_stats, 'hosts', {'up': str(len(open_ports)), 'down': '0', 'total': str(len(open_ports))})
+    ET.ElementTree(root).write(xml_path, encoding='utf-8', xml_declaration=True)
+
+    with open(normal_path, 'w') as normal_file:
+        normal_file.write(f"# Port sweep ({tool}): {cmd}\n")
+        for host in sorted(open_ports):
+            normal_file.write(f"{host}: {','.join(str(port) for port in sorted(open_ports[host]))}\n")
+
+def run_port_sweep(scan_run_id, tool, cmd, deadline=None):
+    """
+    Run the sweep stage and collect the open ports it reports; masscan and Nmap both print
+    "Discovered open port 80/tcp on 10.0.0.1" for every open port they find.
+    Returns (return_code, open_ports, output_buffer, pid), where open_ports maps each host to
+    the set of its open TCP ports, or a failure dict if the sweep could not be started.
+    """
+    current_app.logger.info(f"[ScanRun {scan_run_id}] Executing port sweep ({tool}): {cmd}")
+    try:
+        process = subprocess.Popen(
+            cmd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+    except Exception as e:
+        error_msg = f"[ScanRun {scan_run_id}] Error starting port sweep: {str(e)}"
+        current_app.logger.error(error_msg)
+        print(f"ERROR: {error_msg}", file=sys.stdout)
+        sys.stdout.flush()
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run:
+                scan_run.status = 'failed'
+                scan_run.completed_at = datetime.utcnow()
+                scan_run.error_message = str(e)
+                db.session.commit()
+        return {'status': 'failed', 'message': f'Error starting port sweep: {str(e)}', 'scan_run_id': scan_run_id}
+
+    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Port sweep ({tool}) started with PID: {process.pid}", file=sys.stdout)
+    sys.stdout.flush()
+    with current_app.app_context():
+        scan_run = ScanRun.query.get(scan_run_id)
+        if scan_run:
+            scan_run.status = 'running'
+            scan_run.nmap_pid = process.pid
+            scan_run.shard_pids = None
+            db.session.commit()
+
+    open_ports = {}
+    tracker = ScanPhaseTracker()
+    output_buffer = deque(maxlen=OUTPUT_BUFFER_LINES)
+    progress_reporter = get_progress_reporter()
+    monitor = ProcessOutputMonitor(timeout=current_app.config.get('NMAP_MONITOR_TIMEOUT', 1.0))
+    monitor.register('sweep', process)
+    for _, output in monitor.lines():
+        if deadline:
+            deadline.check([process.pid])
+        if not output:
+            progress_reporter.tick()
+            continue
+
+        line = output.strip()
+        if not line:
+            continue
+
+        event = tracker.feed(line)
+        if event is not None:
+            if event.kind == PORT_DISCOVERED:
+                if event.protocol == 'tcp':
+                    open_ports.setdefault(event.host, set()).add(event.port)
+                continue
+            if tracker.phase:
+                progress_reporter.update(scan_run_id, tracker.progress, f"{SWEEP_PHASE}: {tracker.phase}", tracker.phase_progress, tracker.eta)
+        elif line.startswith('rate:'):
+            # masscan redraws its status line several times a second; only the progress is kept
+            match = MASSCAN_STATUS_RE.match(line)
+            if match:
+                remaining = int(match.group(2)) * 3600 + int(match.group(3)) * 60 + int(match.group(4))
+                tracker.progress = float(match.group(1))
+                tracker.eta = datetime.utcnow() + timedelta(seconds=remaining)
+                progress_reporter.update(scan_run_id, tracker.progress, SWEEP_PHASE, tracker.progress, tracker.eta)
+            continue
+
+        current_app.logger.debug(f"[ScanRun {scan_run_id}] Port sweep stdout: {line}")
+        if SIGNIFICANT_OUTPUT_RE.search(line):
+            print(f"NMAP_OUTPUT: [ScanRun {scan_run_id}] [sweep] {line}", file=sys.stdout)
+            sys.stdout.flush()
+        output_buffer.append(line)
+
+    monitor.close()
+    progress_reporter.finish(scan_run_id)
+    return_code = process.wait()
+    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Port sweep exited with return code {return_code}; "
+          f"{sum(len(ports) for ports in open_ports.values())} open ports on {len(open_ports)} hosts", file=sys.stdout)
+    sys.stdout.flush()
+    return return_code, open_ports, list(output_buffer), process.pid
+
+def run_sweep_scan(scan_run_id, plan, ingester=None, deadline=None):
+    """
+    Run both stages of the sweep engine for a prepared run: the port sweep over every target,
+    then parallel Nmap service scan batches over the discovered host:port pairs, merged into the
+    run's output files.
+
+    Returns (return_code, output_buffer, nmap_done, pid_label) like run_sharded_nmap_scan(),
+    for finalize_scan_run(), or a failure dict if a stage could not be started.
+    """
+    xml_output = plan['xml_output']
+    normal_output = plan['normal_output']
+    started_at = int(time.time())
+
+    result = run_port_sweep(scan_run_id, plan['sweep_tool'], plan['sweep_cmd'], deadline)
+    if isinstance(result, dict):
+        return result
+    return_code, open_ports, output_buffer, pid = result
+
+    if deadline and deadline.reached:
+        # Keep the open ports found so far; there is no time left for service detection
+        write_sweep_xml(xml_output, normal_output, open_ports, plan['sweep_tool'], plan['sweep_cmd'], started_at)
+        if ingester:
+            ingester.watch(xml_output)
+            ingester.start()
+        return 0, output_buffer, False, str(pid)
+    if return_code != 0:
+        return return_code, output_buffer, False, str(pid)
+
+    if not open_ports:
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Port sweep found no open ports; skipping the service scans")
+        write_sweep_xml(xml_output, normal_output, open_ports, plan['sweep_tool'], plan['sweep_cmd'], started_at)
+        if ingester:
+            ingester.watch(xml_output)
+            ingester.start()
+        return 0, output_buffer + ['Nmap done: port sweep found no open ports'], True, str(pid)
+
+    shards, shard_args = build_service_batches(open_ports, plan['service_batch_hosts'])
+    current_app.logger.info(
+        f"[ScanRun {scan_run_id}] Port sweep found {sum(len(ports) for ports in open_ports.values())} open ports on "
+        f"{len(open_ports)} hosts; running {len(shards)} service scan batches, {plan['service_parallel']} at a time"
+    )
+    return run_sharded_nmap_scan(
+        scan_run_id,
+        plan['service_base_cmd'],
+        shards,
+        f"{plan['scan_id']}_service",
+        plan['reports_dir'],
+        xml_output,
+        normal_output,
+        ingester=ingester,
+        shard_args=shard_args,
+        deadline=deadline,
+        max_parallel=plan['service_parallel']
+    )
@@ -0,0 +1,123 @@
+"""
+Recovery of interrupted scans with nmap --resume.
+Every single-process run keeps its -oN output as a resume log; when the worker or the host
+dies mid-scan, the run is requeued and relaunched from that log instead of from zero.
+"""
+import os
+import re
+import shlex
+from flask import current_app
+from app import db
+
+# First line of an Nmap normal-output log, which carries the original command line
+NMAP_LOG_HEADER_RE = re.compile(rb'^# Nmap \S+ scan initiated .* as: ')
+# Written as the last line of the log when the scan finished
+NMAP_LOG_DONE_RE = re.compile(rb'^# Nmap done at ', re.M)
+# Start of each XML document; nmap --resume appends a complete new document to the old file
+XML_DECLARATION_RE = re.compile(r'<\?xml\s+version')
+NMAPRUN_START_RE = re.compile(r'<nmaprun\b[^>]*>')
+# Start tag and status of a host element, e.g. <host starttime="..." endtime="..."><status state="up"
+HOST_STATUS_RE = re.compile(r'<host\b[^>]*>\s*<status\s+state="(\w+)"')
+# Host counts of <runstats>, which only cover the hosts of the last resumed attempt
+RUNSTATS_HOSTS_RE = re.compile(r'<hosts\s+up="\d+"\s+down="\d+"\s+total="\d+"\s*/>')
+
+LOG_TAIL_BYTES = 4096
+
+def is_resumable_log(path):
+    """Return True if path is the normal-output log of an Nmap scan that did not finish"""
+    if not path or not os.path.exists(path):
+        return False
+    try:
+        with open(path, 'rb') as log_file:
+            if not NMAP_LOG_HEADER_RE.match(log_file.readline()):
+                return False
+            # The completion line is at the end of the log, so only the tail needs checking
+            log_file.seek(0, os.SEEK_END)
+            log_file.seek(max(0, log_file.tell() - LOG_TAIL_BYTES))
+            return not NMAP_LOG_DONE_RE.search(log_file.read())
+    except OSError:
+        return False
+
+def build_resume_command(command_prefix, nmap_path, resume_log):
+    """
+    Nmap takes no other options with --resume; the original ones are read from the log.
+    command_prefix holds the resource limit and sudo prefixes of the command.
+    """
+    return f"{command_prefix}{nmap_path} --resume {shlex.quote(resume_log)}"
+
+def queue_scan_run_for_resume(scan_run, max_attempts):
+    """
+    Requeue an interrupted run so that its next attempt relaunches Nmap with --resume.
+    Returns False, leaving the run untouched, if it has no usable resume log or has used up
+    its resume attempts. The caller commits and releases the task lock.
+    """
+    resume_count = scan_run.resume_count or 0
+    if resume_count >= max_attempts:
+        current_app.logger.info(f"[ScanRun {scan_run.id}] Not resuming: {resume_count} of {max_attempts} resume attempts used.")
+        return False
+    if not is_resumable_log(scan_run.resume_log_path):
+        return False
+
+    # Hosts streamed in by the interrupted attempt are ingested again from the appended XML
+    if scan_run.report is not None:
+        db.session.delete(scan_run.report)
+
+    scan_run.status = 'queued'
+    scan_run.resume_pending = True
+    scan_run.nmap_pid = None
+    scan_run.shard_pids = None
+    scan_run.completed_at = None
+    scan_run.error_message = f"Interrupted; queued to resume from {os.path.basename(scan_run.resume_log_path)} (attempt {resume_count + 1} of {max_attempts})"
+    return True
+
+def repair_resumed_xml(xml_path):
+    """
+    Rewrite the XML output of a resumed scan as a single document.
+
+    nmap --resume appends a new <nmaprun> document to the unfinished one, so the file holds the
+    header and completed hosts of each interrupted attempt followed by the final document.
+    The hosts of every attempt are kept, a host element cut off by the interruption is dropped,
+    and the <runstats> of the final attempt closes the document, with its host counts recomputed
+    from the hosts that were kept.
+    Returns True if the file was rewritten.
+    """
+    with open(xml_path, 'r', encoding='utf-8', errors='replace') as xml_file:
+        content = xml_file.read()
+
+    starts = [match.start() for match in XML_DECLARATION_RE.finditer(content)]
+    if len(starts) < 2:
+        return False
+
+    documents = [content[start:end] for start, end in zip(starts, starts[1:] + [len(content)])]
+    parts = []
+    for index, document in enumerate(documents):
+        if index > 0:
+            # Drop the prolog and <nmaprun> start tag of appended documents
+            header = NMAPRUN_START_RE.search(document)
+            document = document[header.end():] if header else ''
+        if index < len(documents) - 1:
+            # Interrupted attempt: keep everything up to the last complete host
+            last_host_end = document.rfind('</host>')
+            if last_host_end != -1:
+                document = document[:last_host_end + len('</host>')]
+            elif index > 0:
+                document = ''
+            else:
+                header = NMAPRUN_START_RE.search(document)
+                document = document[:header.end()] if header else document
+        parts.append(document.rstrip() + '\n')
+    merged = ''.join(parts)
+
+    states = HOST_STATUS_RE.findall(merged)
+    hosts_up = sum(1 for state in states if state == 'up')
+    hosts = f'<hosts up="{hosts_up}" down="{len(states) - hosts_up}" total="{len(states)}"/>'
+    runstats_start = merged.rfind('<runstats>')
+    if runstats_start != -1:
+        merged = merged[:runstats_start] + RUNSTATS_HOSTS_RE.sub(hosts, merged[runstats_start:], count=1)
+
+    temp_path = f"{xml_path}.repair"
+    with open(temp_path, 'w', encoding='utf-8') as xml_file:
+        xml_file.write(merged)
+    os.replace(temp_path, xml_path)
+    current_app.logger.info(f"Merged {len(documents)} resumed Nmap XML documents in {xml_path}")
+    return True
@@ -5,6 +5,14 @@ from app.models.task import ScanTask, ScanRun, TaskLock
 from app.models.settings import SystemSettings
 from app.models.user import User
 from app.tasks.nmap_tasks import run_nmap_scan
+from app.tasks.scan_resume import queue_scan_run_for_resume
+from app.tasks.port_statistics import rebuild_port_frequencies
+from app.tasks.result_cache import purge_result_cache
+from app.tasks.remote_agents import expire_agent_leases
+from app.tasks.target_resolution import resolve_pending_targets
+from app.tasks.report_retention import purge_expired_reports
+from app.tasks.report_import import run_queued_report_imports, requeue_interrupted_report_imports
+from app.utils.decorators import release_sqlite_lock
 from datetime import datetime, timedelta
 import json
 import pytz
@@ -20,14 +28,15 @@ from app.utils.timezone_utils import convert_local_to_utc, get_user_timezone
 logger = logging.getLogger(__name__)
 
 def _is_scan_process_running(pid, scan_engine='nmap'):
-    """Check if a process with the given PID is running and is a scan process (nmap)"""
+    """Check if a process with the given PID is running and is a scan process (nmap, or masscan for the sweep engine)"""
     if pid is None:
         return False
     try:
         process = psutil.Process(pid)
         process_cmdline = ' '.join(process.cmdline()).lower()
         process_name = process.name().lower()
-        return 'nmap' in process_name or 'nmap' in process_cmdline
+        scanners = ('nmap', 'masscan') if scan_engine == 'sweep' else ('nmap',)
+        return any(scanner in process_name or scanner in process_cmdline for scanner in scanners)
     except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
         return False
 
@@ -336,6 +345,52 @@ def check_missed_scheduled_runs():
             logger.error(f"Unexpected error in check_missed_scheduled_runs: {str(e)}", exc_info=True)
             return False # Maintain previous behavior, though consider if scheduler should handle this
 
+def _requeue_interrupted_scan_run(scan):
+    """
+    Requeue an interrupted run to be relaunched with nmap --resume and release its task lock.
+    Must be called within an app context. Returns True if the run was requeued.
+    """
+    if not current_app.config.get('NMAP_RESUME_INTERRUPTED', True):
+        return False
+    try:
+        if not queue_scan_run_for_resume(scan, current_app.config.get('NMAP_MAX_RESUME_ATTEMPTS', 3)):
+            return False
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error requeueing interrupted ScanRun {scan.id} for resume: {e}")
+        if db.session.is_active:
+            db.session.rollback()
+        return False
+    release_sqlite_lock(f"lock:run_nmap_scan:task_id_{scan.task_id}")
+    logger.info(f"Requeued interrupted ScanRun {scan.id} to resume from {scan.resume_log_path}.")
+    print(f"TASK_EVENT: [ScanRun {scan.id}] Interrupted scan requeued to resume from {scan.resume_log_path}", file=sys.stdout)
+    sys.stdout.flush()
+    return True
+
+def recover_interrupted_scan_runs():
+    """
+    Requeue scan runs left 'starting' or 'running' by a worker or host crash so that they
+    continue with nmap --resume instead of starting over. Runs whose Nmap process is still
+    alive are left alone, and runs that cannot be resumed are left for the zombie cleanup.
+    Called at startup by the primary worker, within an app context.
+    """
+    interrupted = ScanRun.query.filter(
+        ScanRun.status.in_(['starting', 'running']),
+        ScanRun.resume_log_path.isnot(None),
+        ScanRun.agent_id.is_(None)
+    ).all()
+
+    recovered_count = 0
+    for scan in interrupted:
+        if any(_is_scan_process_running(pid) for pid in scan.get_nmap_pids()):
+            logger.info(f"ScanRun {scan.id} still has a running Nmap process; not resuming it.")
+            continue
+        if _requeue_interrupted_scan_run(scan):
+            recovered_count += 1
+
+    if recovered_count:
+        logger.info(f"Requeued {recovered_count} interrupted scan run(s) for resume at startup.")
+
 def cleanup_zombie_scan_runs():
     """Checks for 'running' or 'starting' scan tasks whose nmap/masscan processes are no longer active and marks them as 'failed'."""
     if _current_flask_app is None:
@@ -349,11 +404,12 @@ def cleanup_zombie_scan_runs():
 
         # Get all running and starting scan runs
         # Added a filter for tasks started more than a minute ago to give them time to register a PID
-        # or for very short scans to complete.
+        # or for very short scans to complete. Runs held by remote agents are covered by their lease.
         time_threshold_for_pid_check = now_utc - timedelta(minutes=1)
         scans_to_check = ScanRun.query.filter(
             ScanRun.status.in_(['starting', 'running']),
-            ScanRun.started_at < time_threshold_for_pid_check
+            ScanRun.started_at < time_threshold_for_pid_check,
+            ScanRun.agent_id.is_(None)
         ).all()
 
         if not scans_to_check:
@@ -377,7 +433,8 @@ def cleanup_zombie_scan_runs():
 
             is_zombie = False
             if scan.nmap_pid is not None:
-                if not _is_scan_process_running(scan.nmap_pid, scan_engine):
+                # Sharded runs have several processes; the run is alive while any of them is
+                if not any(_is_scan_process_running(pid, scan_engine) for pid in scan.get_nmap_pids()):
                     logger.warning(f"ZOMBIE DETECTED: ScanRun {scan.id} (Engine: {scan_engine}, PID: {scan.nmap_pid}) process is not running.")
                     is_zombie = True
                 else:
@@ -401,6 +458,9 @@ def cleanup_zombie_scan_runs():
 
             if is_zombie:
                 zombie_count += 1
+                # Scans with a resume log continue where they stopped instead of failing
+                if _requeue_interrupted_scan_run(scan):
+                    continue
                 scan.status = 'failed'
                 scan.error_message = f"Zombie task detected: {scan_engine} process (PID: {scan.nmap_pid if scan.nmap_pid else 'N/A'}) not found or task stuck in starting/running without PID."
                 scan.completed_at = datetime.now(pytz.UTC)
@@ -425,6 +485,100 @@ def cleanup_zombie_scan_runs():
         
         logger.info(f"Zombie Task Cleanup job finished. Found and processed {zombie_count} zombie task(s).")
 
+def refresh_port_frequencies():
+    """Periodically rebuild the learned port frequency tables from the stored reports"""
+    if _current_flask_app is None:
+        logger.error("CRITICAL: Flask app instance (_current_flask_app) is None in refresh_port_frequencies.")
+        return
+
+    with _current_flask_app.app_context():
+        try:
+            rebuild_port_frequencies()
+        except Exception as e:
+            logger.error(f"Error rebuilding port frequency tables: {e}", exc_info=True)
+            if db.session.is_active:
+                db.session.rollback()
+
+def purge_expired_scan_results():
+    """Periodically delete result cache entries that no TTL can reuse anymore"""
+    if _current_flask_app is None:
+        logger.error("CRITICAL: Flask app instance (_current_flask_app) is None in purge_expired_scan_results.")
+        return
+
+    with _current_flask_app.app_context():
+        try:
+            purged = purge_result_cache()
+            if purged:
+                logger.info(f"Purged {purged} expired scan result cache entries")
+        except Exception as e:
+            logger.error(f"Error purging the scan result cache: {e}", exc_info=True)
+            if db.session.is_active:
+                db.session.rollback()
+
+def expire_scan_agent_leases():
+    """Periodically requeue scan runs whose remote agent stopped renewing its lease"""
+    if _current_flask_app is None:
+        logger.error("CRITICAL: Flask app instance (_current_flask_app) is None in expire_scan_agent_leases.")
+        return
+
+    with _current_flask_app.app_context():
+        try:
+            expired = expire_agent_leases()
+            if expired:
+                logger.info(f"Expired {expired} scan agent lease(s)")
+        except Exception as e:
+            logger.error(f"Error expiring scan agent leases: {e}", exc_info=True)
+            if db.session.is_active:
+                db.session.rollback()
+
+def resolve_deferred_targets():
+    """Periodically resolve the target hostnames that did not resolve while their group was saved"""
+    if _current_flask_app is None:
+        logger.error("CRITICAL: Flask app instance (_current_flask_app) is None in resolve_deferred_targets.")
+        return
+
+    with _current_flask_app.app_context():
+        try:
+            finished, pending = resolve_pending_targets()
+            if finished or pending:
+                logger.info(f"Resolved {finished} deferred target hostname(s); {pending} still resolving")
+        except Exception as e:
+            logger.error(f"Error resolving deferred target hostnames: {e}", exc_info=True)
+            if db.session.is_active:
+                db.session.rollback()
+
+def enforce_report_retention():
+    """Periodically delete the reports beyond each task's maximum report setting"""
+    if _current_flask_app is None:
+        logger.error("CRITICAL: Flask app instance (_current_flask_app) is None in enforce_report_retention.")
+        return
+
+    with _current_flask_app.app_context():
+        try:
+            deleted, remaining = purge_expired_reports()
+            if deleted or remaining:
+                logger.info(f"Report retention deleted {deleted} report(s); {remaining} left for the next run")
+        except Exception as e:
+            logger.error(f"Error enforcing report retention: {e}", exc_info=True)
+            if db.session.is_active:
+                db.session.rollback()
+
+def process_report_imports():
+    """Periodically run the imports of Nmap XML files uploaded on task pages"""
+    if _current_flask_app is None:
+        logger.error("CRITICAL: Flask app instance (_current_flask_app) is None in process_report_imports.")
+        return
+
+    with _current_flask_app.app_context():
+        try:
+            imported = run_queued_report_imports()
+            if imported:
+                logger.info(f"Ran {imported} queued Nmap XML import(s)")
+        except Exception as e:
+            logger.error(f"Error running queued Nmap XML imports: {e}", exc_info=True)
+            if db.session.is_active:
+                db.session.rollback()
+
 def initialize_scheduled_tasks():
     """Initializes all scheduled tasks from the database and the periodic missed run checker."""
     from app import scheduler, db
@@ -448,6 +602,12 @@ def initialize_scheduled_tasks():
             logger.info(f"Scheduling task: {task.id} - {task.name}")
             schedule_task(task) # schedule_task already imports scheduler locally
 
+        logger.info("Checking for scan runs interrupted by a restart...")
+        recover_interrupted_scan_runs()
+        requeued_imports = requeue_interrupted_report_imports()
+        if requeued_imports:
+            logger.info(f"Requeued {requeued_imports} Nmap XML import(s) interrupted by a restart.")
+
         logger.info("Performing initial check for missed scheduled runs at startup...")
         check_missed_scheduled_runs() # check_missed_scheduled_runs already imports scheduler locally
 
@@ -467,6 +627,26 @@ def initialize_scheduled_tasks():
         scheduler.add_job(func=cleanup_zombie_scan_runs, trigger='interval', minutes=1, id='periodic_zombie_cleanup', replace_existing=True, coalesce=True, max_instances=1)
         logger.info("Scheduled periodic_zombie_cleanup to run every 1 minute.")
 
+        # Keep the learned top ports profile up to date with new reports
+        scheduler.add_job(func=refresh_port_frequencies, trigger='interval', hours=1, id='periodic_port_frequency_refresh', replace_existing=True, coalesce=True, max_instances=1)
+        logger.info("Scheduled periodic_port_frequency_refresh to run every hour.")
+
+        scheduler.add_job(func=purge_expired_scan_results, trigger='interval', hours=1, id='periodic_result_cache_purge', replace_existing=True, coalesce=True, max_instances=1)
+        logger.info("Scheduled periodic_result_cache_purge to run every hour.")
+
+        scheduler.add_job(func=expire_scan_agent_leases, trigger='interval', seconds=30, id='periodic_agent_lease_expiry', replace_existing=True, coalesce=True, max_instances=1)
+        logger.info("Scheduled periodic_agent_lease_expiry to run every 30 seconds.")
+
+        scheduler.add_job(func=resolve_deferred_targets, trigger='interval', seconds=30, id='periodic_target_resolution', replace_existing=True, coalesce=True, max_instances=1)
+        logger.info("Scheduled periodic_target_resolution to run every 30 seconds.")
+
+        retention_interval = current_app.config.get('REPORT_RETENTION_INTERVAL_SECONDS', 60)
+        scheduler.add_job(func=enforce_report_retention, trigger='interval', seconds=retention_interval, id='periodic_report_retention', replace_existing=True, coalesce=True, max_instances=1)
+        logger.info(f"Scheduled periodic_report_retention to run every {retention_interval} seconds.")
+
+        scheduler.add_job(func=process_report_imports, trigger='interval', seconds=10, id='periodic_report_imports', replace_existing=True, coalesce=True, max_instances=1)
+        logger.info("Scheduled periodic_report_imports to run every 10 seconds.")
+
         logger.info("Scheduled tasks initialization complete.")
     except OperationalError as e:
         # This is a fallback. The check above should prevent this, but we keep it for safety.
@@ -0,0 +1,304 @@
+"""
+Sharded Nmap execution: one ScanRun split across several parallel Nmap processes.
+Each shard writes its own XML/normal output, which are merged into the run's output files
+so that the regular report creation path can ingest them as a single scan.
+"""
+import os
+import sys
+import json
+import subprocess
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from flask import current_app
+from app import db
+from app.models.task import ScanRun
+from collections import deque
+from app.tasks.process_monitor import ProcessOutputMonitor, SIGNIFICANT_OUTPUT_RE, OUTPUT_BUFFER_LINES
+from app.tasks.nmap_events import ScanPhaseTracker, PROGRESS_EVENTS, combine_phase_trackers
+from app.tasks.progress import get_progress_reporter
+from app.tasks.scan_deadline import salvage_partial_xml
+
+def merge_nmap_xml(xml_paths, output_path):
+    """
+    Merge several Nmap XML output files into one.
+    The first file provides the <nmaprun> attributes and <scaninfo>; hosts are concatenated
+    and the <runstats> host counters are summed.
+    """
+    merged_root = None
+    hosts_up = hosts_down = hosts_total = 0
+    finished_time = 0
+    elapsed = 0.0
+    finished_elem = None
+
+    for xml_path in xml_paths:
+        root = ET.parse(xml_path).getroot()
+        if merged_root is None:
+            merged_root = ET.Element(root.tag, dict(root.attrib))
+            for child in root:
+                if child.tag in ('scaninfo', 'verbose', 'debugging'):
+                    merged_root.append(child)
+
+        for host_elem in root.findall('host'):
+            merged_root.append(host_elem)
+
+        run_stats = root.find('runstats')
+        if run_stats is not None:
+            finished = run_stats.find('finished')
+            if finished is not None:
+                try:
+                    if int(finished.get('time', '0')) >= finished_time:
+                        finished_time = int(finished.get('time', '0'))
+                        finished_elem = finished
+                    elapsed = max(elapsed, float(finished.get('elapsed', '0')))
+                except ValueError:
+                    pass
+            hosts_stats = run_stats.find('hosts')
+            if hosts_stats is not None:
+                hosts_up += int(hosts_stats.get('up', '0'))
+                hosts_down += int(hosts_stats.get('down', '0'))
+                hosts_total += int(hosts_stats.get('total', '0'))
+
+    if merged_root is None:
+        raise ValueError("No XML files to merge")
+
+    run_stats = ET.SubElement(merged_root, 'runstats')
+    if finished_elem is not None:
+        finished_attrs = dict(finished_elem.attrib)
+        finished_attrs['elapsed'] = f"{elapsed:.2f}"
+        ET.SubElement(run_stats, 'finished', finished_attrs)
+    ET.SubElement(run_stats, 'hosts', {
+        'up': str(hosts_up),
+        'down': str(hosts_down),
+        'total': str(hosts_total)
+    })
+    ET.ElementTree(merged_root).write(output_path, encoding='utf-8', xml_declaration=True)
+
+def merge_normal_outputs(normal_paths, output_path):
+    """Concatenate the normal (-oN) output of every shard into one file."""
+    with open(output_path, 'w') as merged:
+        for index, normal_path in enumerate(normal_paths):
+            merged.write(f"# ---- Shard {index + 1} of {len(normal_paths)} ----\n")
+            if os.path.exists(normal_path):
+                with open(normal_path, 'r', errors='replace') as shard_file:
+                    for line in shard_file:
+                        merged.write(line)
+            merged.write("\n")
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            current_app.logger.warning(f"Could not remove shard output file {path}: {e}")
+
+def build_shard_commands(base_cmd, shards, scan_id, reports_dir, shard_args=None):
+    """
+    Build the Nmap command and output paths of every shard.
+    shard_args optionally holds extra arguments for each shard (e.g. per-group timing options).
+    Returns a list of (cmd, xml_path, normal_path) tuples in shard order.
+    """
+    commands = []
+    for index, (shard_targets, _) in enumerate(shards):
+        shard_xml_path = os.path.join(reports_dir, f"{scan_id}_shard{index + 1}.xml")
+        shard_normal_path = os.path.join(reports_dir, f"{scan_id}_shard{index + 1}.txt")
+        extra_args = f" {shard_args[index]}" if shard_args and shard_args[index] else ''
+        cmd = f"{base_cmd}{extra_args} -oX {shard_xml_path} -oN {shard_normal_path} {' '.join(shard_targets)}"
+        commands.append((cmd, shard_xml_path, shard_normal_path))
+    return commands
+
+def merge_shard_outputs(scan_run_id, shard_xml_paths, shard_normal_paths, xml_output, normal_output):
+    """
+    Merge the shard outputs into the run's output files and remove the shard files.
+    Returns an error message, or None on success.
+    """
+    try:
+        merge_nmap_xml(shard_xml_paths, xml_output)
+        merge_normal_outputs(shard_normal_paths, normal_output)
+        _remove_files(shard_xml_paths + shard_normal_paths)
+        current_app.logger.info(f"[ScanRun {scan_run_id}] Merged {len(shard_xml_paths)} shard outputs into {xml_output}")
+        return None
+    except Exception as e:
+        error_msg = f"Failed to merge shard outputs: {str(e)}"
+        current_app.logger.error(f"[ScanRun {scan_run_id}] {error_msg}", exc_info=True)
+        return error_msg
+
+def salvage_shard_outputs(scan_run_id, shard_xml_paths, shard_normal_paths, xml_output, normal_output):
+    """
+    Merge the completed hosts of shards stopped at the run's deadline into the run's output files.
+    Shards that did not get as far as writing their XML header are left out.
+    Returns an error message, or None on success.
+    """
+    salvaged = [
+        (xml_path, normal_path) for xml_path, normal_path in zip(shard_xml_paths, shard_normal_paths)
+        if salvage_partial_xml(xml_path) is not None
+    ]
+    if not salvaged:
+        _remove_files(shard_xml_paths + shard_normal_paths)
+        return "No shard wrote any output before the deadline"
+    error_msg = merge_shard_outputs(
+        scan_run_id,
+        [xml_path for xml_path, _ in salvaged],
+        [normal_path for _, normal_path in salvaged],
+        xml_output,
+        normal_output
+    )
+    _remove_files(shard_xml_paths + shard_normal_paths)
+    return error_msg
+
+def run_sharded_nmap_scan(scan_run_id, base_cmd, shards, scan_id, reports_dir, xml_output, normal_output, ingester=None, shard_args=None, deadline=None, max_parallel=None):
+    """
+    Run one Nmap process per shard in parallel and merge their output into xml_output/normal_output.
+
+    base_cmd is the full Nmap command without output options and targets.
+    shards is a list of (targets, address_count) tuples as returned by shard_targets(),
+    and shard_args optional extra arguments for each shard.
+    max_parallel limits how many shards run at once; the next shard is launched whenever one exits.
+
+    If an ingester is given, every shard's XML output is tailed into the streamed report.
+    If a deadline is given, the shards are stopped when it is reached and their completed hosts are
+    merged; the caller then finalizes the run with deadline_reached set.
+
+    Returns (return_code, output_buffer, nmap_done, pid_label) once every shard has exited,
+    or a failure dict if the shards could not be started.
+    """
+    shard_total = len(shards)
+    shard_commands = build_shard_commands(base_cmd, shards, scan_id, reports_dir, shard_args)
+    shard_xml_paths = [xml_path for _, xml_path, _ in shard_commands]
+    shard_normal_paths = [normal_path for _, _, normal_path in shard_commands]
+    max_parallel = max(1, min(max_parallel or shard_total, shard_total))
+
+    # One selector watches every shard's output
+    monitor = ProcessOutputMonitor(timeout=current_app.config.get('NMAP_MONITOR_TIMEOUT', 1.0))
+    processes = []
+    pids = []
+
+    def launch_shards():
+        """Start shards until max_parallel are running; returns True if any was started"""
+        started = False
+        while len(processes) < shard_total and monitor.active_count() < max_parallel:
+            index = len(processes)
+            cmd = shard_commands[index][0]
+            current_app.logger.info(f"[ScanRun {scan_run_id}] Executing Nmap shard {index + 1}/{shard_total} ({shards[index][1]} addresses): {cmd}")
+            process = subprocess.Popen(
+                cmd,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+            processes.append(process)
+            pids.append(process.pid)
+            monitor.register(index, process)
+            started = True
+            print(f"TASK_EVENT: [ScanRun {scan_run_id}] Nmap shard {index + 1}/{shard_total} started with PID: {process.pid}", file=sys.stdout)
+            sys.stdout.flush()
+        if started:
+            # Record the shards alive now, which the zombie check looks for
+            running_pids = [process.pid for process in processes if process.poll() is None] or pids[-1:]
+            with current_app.app_context():
+                scan_run = ScanRun.query.get(scan_run_id)
+                if scan_run:
+                    scan_run.status = 'running'
+                    scan_run.nmap_pid = running_pids[0]
+                    scan_run.shard_pids = json.dumps(running_pids)
+                    db.session.commit()
+                    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Committed shard PIDs {running_pids} and status 'running'.", file=sys.stdout)
+                    sys.stdout.flush()
+        return started
+
+    try:
+        launch_shards()
+    except Exception as e:
+        error_msg = f"[ScanRun {scan_run_id}] Error starting Nmap shard {len(processes) + 1}/{shard_total}: {str(e)}"
+        current_app.logger.error(error_msg)
+        print(f"ERROR: {error_msg}", file=sys.stdout)
+        sys.stdout.flush()
+        monitor.close()
+        for process in processes:
+            process.terminate()
+        with current_app.app_context():
+            scan_run = ScanRun.query.get(scan_run_id)
+            if scan_run:
+                scan_run.status = 'failed'
+                scan_run.completed_at = datetime.utcnow()
+                scan_run.error_message = str(e)
+                db.session.commit()
+        return {'status': 'failed', 'message': f'Error starting Nmap shard: {str(e)}', 'scan_run_id': scan_run_id}
+
+    if ingester:
+        for shard_xml_path in shard_xml_paths:
+            ingester.watch(shard_xml_path)
+        ingester.start()
+
+    shard_trackers = [ScanPhaseTracker() for _ in range(shard_total)]
+    shard_weights = [count for _, count in shards]
+    shard_buffers = [deque(maxlen=OUTPUT_BUFFER_LINES) for _ in range(shard_total)]
+    progress_reporter = get_progress_reporter()
+    stopped = False
+
+    while True:
+        for index, output in monitor.lines():
+            if deadline and deadline.check(pids):
+                stopped = True
+            if not stopped and len(processes) < shard_total:
+                launch_shards()
+            if not output:
+                # Idle: write any coalesced progress that is due
+                progress_reporter.tick()
+                continue
+
+            line = output.strip()
+            if not line:
+                continue
+            current_app.logger.debug(f"[ScanRun {scan_run_id}] Nmap shard {index + 1} stdout: {line}")
+
+            if SIGNIFICANT_OUTPUT_RE.search(line):
+                print(f"NMAP_OUTPUT: [ScanRun {scan_run_id}] [shard {index + 1}] {line}", file=sys.stdout)
+                sys.stdout.flush()
+
+            shard_buffers[index].append(line)
+
+            event = shard_trackers[index].feed(line)
+            if event is None or event.kind not in PROGRESS_EVENTS:
+                continue
+
+            # Combine shard progress weighted by the number of addresses in each shard;
+            # shards not launched yet count as not started
+            progress_reporter.update(scan_run_id, *combine_phase_trackers(shard_trackers, shard_weights))
+        # Every running shard has exited; start the next ones unless the deadline stopped the run
+        if stopped or not launch_shards():
+            break
+
+    monitor.close()
+    progress_reporter.finish(scan_run_id)
+    return_codes = [process.wait() for process in processes]
+    print(f"TASK_EVENT: [ScanRun {scan_run_id}] Nmap shards exited with return codes {return_codes}", file=sys.stdout)
+    sys.stdout.flush()
+
+    output_buffer = [line for buffer in shard_buffers for line in buffer]
+    if deadline and deadline.reached:
+        # Shards never launched have no output to salvage
+        shard_xml_paths = shard_xml_paths[:len(processes)]
+        shard_normal_paths = shard_normal_paths[:len(processes)]
+        if ingester:
+            ingester.stop()
+        error_msg = salvage_shard_outputs(scan_run_id, shard_xml_paths, shard_normal_paths, xml_output, normal_output)
+        if error_msg:
+            output_buffer.append(error_msg)
+        return 0, output_buffer, False, ','.join(str(pid) for pid in pids)
+
+    failed_index = next((i for i, code in enumerate(return_codes) if code != 0), None)
+    if failed_index is not None:
+        return return_codes[failed_index], list(shard_buffers[failed_index]), False, ','.join(str(pid) for pid in pids)
+
+    # Ingest the remaining hosts before the shard files are merged and removed
+    if ingester:
+        ingester.stop()
+
+    nmap_done = all(tracker.done for tracker in shard_trackers)
+    if nmap_done:
+        error_msg = merge_shard_outputs(scan_run_id, shard_xml_paths, shard_normal_paths, xml_output, normal_output)
+        if error_msg:
+            return 1, output_buffer + [error_msg], False, ','.join(str(pid) for pid in pids)
+
+    return 0, output_buffer, nmap_done, ','.join(str(pid) for pid in pids)
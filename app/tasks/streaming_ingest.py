@@ -0,0 +1,267 @@
+"""
+Incremental report ingestion: tails the Nmap -oX output while the scan is running and
+commits every completed <host> element to the report in small batches.
+"""
+import os
+import re
+import sys
+import json
+import time
+import codecs
+import threading
+import xml.etree.ElementTree as ET
+from flask import current_app
+from app import db
+from app.models.report import ScanReport
+from app.tasks.report_parsing import parse_nmaprun_summary, parse_host_element, insert_host_findings
+
+HOST_START_RE = re.compile(r'<host[\s>]')
+NMAPRUN_START_RE = re.compile(r'<nmaprun\b[^>]*>')
+RUNSTATS_RE = re.compile(r'<runstats>.*?</runstats>', re.S)
+# Tries of the last flush after Nmap exited; if all fail, the report is failed instead of completed
+FINAL_FLUSH_ATTEMPTS = 3
+
+class _TailState:
+    """Read position and unparsed text of one watched XML file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.buffer = ''
+        self.header_attrs = None
+        self.runstats = None
+
+class StreamingReportIngester:
+    """
+    Tails one or more growing Nmap XML files and ingests completed hosts into a report.
+
+    The report is created with status 'ingesting' when the ingester starts, so readers can
+    see partial results during the scan. finish() adds the summary, marks the report 'complete'
+    and applies the task's report limit; abort() removes the partial report.
+    """
+
+    def __init__(self, scan_run_id, xml_path, normal_path, batch_size=50, flush_interval=5, poll_interval=1):
+        self.app = current_app._get_current_object()
+        self.scan_run_id = scan_run_id
+        self.xml_path = xml_path
+        self.normal_path = normal_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.report_id = None
+        self.hosts_ingested = 0
+        self._states = []
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, path):
+        """Add an XML output file to tail (sharded runs watch one file per shard)"""
+        self._states.append(_TailState(path))
+
+    def start(self):
+        """Create the partial report and start the background tailing thread"""
+        with self.app.app_context():
+            report = ScanReport(
+                scan_run_id=self.scan_run_id,
+                xml_report_path=self.xml_path,
+                normal_report_path=self.normal_path,
+                status='ingesting'
+            )
+            db.session.add(report)
+            db.session.commit()
+            self.report_id = report.id
+        print(f"TASK_EVENT: [ScanRun {self.scan_run_id}] Streaming ingest started into report {self.report_id}", file=sys.stdout)
+        sys.stdout.flush()
+
+        self._thread = threading.Thread(target=self._run, name=f"ingest-scanrun-{self.scan_run_id}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self._poll()
+            except Exception as e:
+                self.app.logger.error(f"[ScanRun {self.scan_run_id}] Error during streaming ingest: {str(e)}", exc_info=True)
+
+    def _poll(self, final=False):
+        """Read new data from every watched file and flush the batch if it is due"""
+        for state in self._states:
+            try:
+                size = os.path.getsize(state.path)
+            except OSError:
+                continue
+            if size < state.offset:
+                # The file was truncated (Nmap restarted); start over from the beginning
+                self.app.logger.warning(f"[ScanRun {self.scan_run_id}] {state.path} was truncated, restarting tail")
+                state.reset()
+            if size == state.offset:
+                continue
+            with open(state.path, 'rb') as xml_file:
+                xml_file.seek(state.offset)
+                data = xml_file.read(size - state.offset)
+            state.offset += len(data)
+            state.buffer += state.decoder.decode(data)
+            self._consume(state)
+
+        if self._pending and (final or len(self._pending) >= self.batch_size
+                              or time.monotonic() - self._last_flush >= self.flush_interval):
+            self._flush()
+
+    def _consume(self, state):
+        """Parse every complete <host> element in the buffer and keep the incomplete remainder"""
+        buf = state.buffer
+        pos = 0
+        while True:
+            match = HOST_START_RE.search(buf, pos)
+            if not match:
+                break
+            end = buf.find('</host>', match.start())
+            if end == -1:
+                break
+            end += len('</host>')
+            self._scan_outside_hosts(state, buf[pos:match.start()])
+            truncated = HOST_START_RE.search(buf, match.start() + 1, end)
+            if truncated:
+                # A host element cut off by an interrupted run, followed by output appended on resume
+                pos = truncated.start()
+                continue
+            try:
+                self._pending.append(parse_host_element(ET.fromstring(buf[match.start():end])))
+            except ET.ParseError as e:
+                self.app.logger.warning(f"[ScanRun {self.scan_run_id}] Skipping unparsable host element: {str(e)}")
+            pos = end
+
+        rest = buf[pos:]
+        match = HOST_START_RE.search(rest)
+        if match:
+            # Keep the incomplete host element for the next read
+            self._scan_outside_hosts(state, rest[:match.start()])
+            state.buffer = rest[match.start():]
+            return
+
+        self._scan_outside_hosts(state, rest)
+        runstats_start = rest.find('<runstats>')
+        if runstats_start != -1 and state.runstats is None:
+            state.buffer = rest[runstats_start:]
+            return
+        # Keep a trailing partial tag in case it is split across reads
+        last_tag = rest.rfind('<')
+        state.buffer = rest[last_tag:] if last_tag != -1 and '>' not in rest[last_tag:] else ''
+
+    def _scan_outside_hosts(self, state, text):
+        """Capture the <nmaprun> attributes and <runstats> element from text between hosts"""
+        if state.header_attrs is None:
+            match = NMAPRUN_START_RE.search(text)
+            if match:
+                try:
+                    state.header_attrs = dict(ET.fromstring(match.group(0) + '</nmaprun>').attrib)
+                except ET.ParseError:
+                    pass
+        if state.runstats is None:
+            match = RUNSTATS_RE.search(text)
+            if match:
+                try:
+                    state.runstats = ET.fromstring(match.group(0))
+                except ET.ParseError:
+                    pass
+
+    def _flush(self):
+        """Commit the pending hosts to the report; on failure they stay pending for the next flush"""
+        batch = self._pending
+        with self.app.app_context():
+            try:
+                insert_host_findings(self.report_id, batch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        self._pending = []
+        self.hosts_ingested += len(batch)
+        self._last_flush = time.monotonic()
+        self.app.logger.debug(f"[ScanRun {self.scan_run_id}] Streamed {len(batch)} hosts into report {self.report_id} ({self.hosts_ingested} total)")
+
+    def stop(self):
+        """Stop the tailing thread and ingest everything written so far; hosts that fail to commit stay pending"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        for attempt in range(1, FINAL_FLUSH_ATTEMPTS + 1):
+            try:
+                self._poll(final=True)
+                return
+            except Exception as e:
+                self.app.logger.warning(f"[ScanRun {self.scan_run_id}] Final streaming ingest flush failed (attempt {attempt}/{FINAL_FLUSH_ATTEMPTS}): {str(e)}")
+                if attempt < FINAL_FLUSH_ATTEMPTS:
+                    time.sleep(self.poll_interval)
+
+    def _build_summary(self):
+        summary = {}
+        for state in self._states:
+            if state.header_attrs is not None:
+                summary = parse_nmaprun_summary(state.header_attrs)
+                break
+        hosts_total = hosts_up = hosts_down = 0
+        found_runstats = False
+        for state in self._states:
+            hosts_stats = state.runstats.find('hosts') if state.runstats is not None else None
+            if hosts_stats is not None:
+                found_runstats = True
+                hosts_total += int(hosts_stats.get('total', '0'))
+                hosts_up += int(hosts_stats.get('up', '0'))
+                hosts_down += int(hosts_stats.get('down', '0'))
+        if found_runstats:
+            summary['hosts_total'] = str(hosts_total)
+            summary['hosts_up'] = str(hosts_up)
+            summary['hosts_down'] = str(hosts_down)
+        return summary
+
+    def finish(self):
+        """
+        Finalize the streamed report after Nmap has exited.
+        Returns the completed ScanReport, or None on failure.
+        """
+        try:
+            self.stop()
+            with self.app.app_context():
+                report = ScanReport.query.get(self.report_id)
+                if not report:
+                    self.app.logger.error(f"[ScanRun {self.scan_run_id}] Streamed report {self.report_id} not found when finishing ingest.")
+                    return None
+                if self._pending:
+                    self.app.logger.error(f"[ScanRun {self.scan_run_id}] {len(self._pending)} hosts could not be written to streamed report {self.report_id}; not completing it.")
+                    return None
+                report.summary = json.dumps(self._build_summary())
+                report.status = 'complete'
+                db.session.commit()
+                self.app.logger.info(f"[ScanRun {self.scan_run_id}] Streaming ingest finished. Report ID: {report.id}, hosts: {self.hosts_ingested}")
+                return report
+        except Exception as e:
+            with self.app.app_context():
+                db.session.rollback()
+            self.app.logger.error(f"[ScanRun {self.scan_run_id}] Error finishing streaming ingest: {str(e)}", exc_info=True)
+            return None
+
+    def abort(self):
+        """Stop ingesting and remove the partial report"""
+        self._stopped = True
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.report_id is None:
+            return
+        with self.app.app_context():
+            report = ScanReport.query.get(self.report_id)
+            if report:
+                db.session.delete(report)
+                db.session.commit()
+        self.app.logger.info(f"[ScanRun {self.scan_run_id}] Discarded partial streamed report {self.report_id}")
@@ -0,0 +1,60 @@
+"""
+Resolution of hostname targets. When a target group is saved its hostnames are resolved
+concurrently within a time budget; those whose lookup failed or had not finished are marked
+pending, and a periodic job resolves them in batches and records their address, or that they
+do not resolve.
+"""
+from datetime import datetime
+from flask import current_app
+from app import db
+from app.models.target import Target
+from app.utils.dns_resolver import resolve_hostnames
+
+def build_targets(target_group_id, valid_targets):
+    """
+    Create the Target rows of validated (value, target_type) pairs of a group, resolving the
+    hostnames within the request budget; target_group_id may be None for a group not inserted yet,
+    whose ID the caller sets afterwards. Must be called within an app context.
+    Returns (targets, deferred), where deferred is the number of hostnames left to the background job.
+    """
+    hostnames = [value for value, target_type in valid_targets if target_type == 'hostname']
+    resolved, failed, pending = resolve_hostnames(hostnames)
+    now = datetime.utcnow()
+    targets = []
+    for value, target_type in valid_targets:
+        target = Target(value=value, target_type=target_type, target_group_id=target_group_id)
+        if target_type == 'hostname':
+            if value in resolved:
+                target.resolved_address = resolved[value]
+                target.resolved_at = now
+            else:
+                target.resolution_pending = True
+        targets.append(target)
+    return targets, len(failed) + len(pending)
+
+def resolve_pending_targets():
+    """
+    Resolve a batch of pending hostname targets. Must be called within an app context.
+    Returns (finished, still_pending) counts.
+    """
+    batch_size = current_app.config.get('DNS_BACKGROUND_BATCH_SIZE', 1000)
+    targets = Target.query.filter_by(resolution_pending=True).order_by(Target.id).limit(batch_size).all()
+    if not targets:
+        return 0, 0
+    resolved, failed, pending = resolve_hostnames(
+        [target.value for target in targets],
+        budget=current_app.config.get('DNS_BACKGROUND_BUDGET_SECONDS', 30)
+    )
+    failed = set(failed)
+    now = datetime.utcnow()
+    for target in targets:
+        if target.value in resolved:
+            target.resolved_address = resolved[target.value]
+        elif target.value in failed:
+            target.resolved_address = None
+        else:
+            continue
+        target.resolved_at = now
+        target.resolution_pending = False
+    db.session.commit()
+    return len(targets) - len(pending), len(pending)
@@ -4,7 +4,7 @@ Task processor module for handling queued tasks
 from app import db, create_app # Removed scheduler, celery shared_task, celery_config
 from app.models.task import ScanRun, ScanTask
 from app.models.settings import SystemSettings
-from app.worker_manager import submit_nmap_scan
+from app.worker_manager import submit_nmap_scan, get_worker_capacity, get_active_scan_count
 from config import Config # Import Config
 import logging
 from datetime import datetime
@@ -23,17 +23,22 @@ def process_queued_tasks():
         try:
             # Get the maximum concurrent tasks setting from SystemSettings
             max_concurrent_tasks_from_ui = SystemSettings.get_int('max_concurrent_tasks', 4)
-            # Get the actual pool size from config
-            actual_pool_size = Config.NMAP_WORKER_POOL_SIZE # This is now an int
+            # Get the actual capacity of the execution backend (pool size, or async supervisor limit)
+            actual_pool_size = get_worker_capacity()
 
             # Effective max concurrent tasks is the lower of the two
             max_concurrent_tasks = min(max_concurrent_tasks_from_ui, actual_pool_size)
             logger.info(f"UI 'max_concurrent_tasks' setting: {max_concurrent_tasks_from_ui}, Actual pool size: {actual_pool_size}. Effective max concurrent tasks: {max_concurrent_tasks}")
 
-            # Count currently running tasks
+            # Count currently running tasks; runs held by remote agents do not use a local slot
             running_tasks_count = ScanRun.query.filter(
-                ScanRun.status == 'running'
+                ScanRun.status == 'running',
+                ScanRun.agent_id.is_(None)
             ).count()
+            # The asyncio supervisor also holds runs it is still preparing, which are not 'running' yet
+            active_scan_count = get_active_scan_count()
+            if active_scan_count is not None:
+                running_tasks_count = max(running_tasks_count, active_scan_count)
 
             # If we're already at or over the limit, don't start any new tasks
             if running_tasks_count >= max_concurrent_tasks:
@@ -43,8 +48,12 @@ def process_queued_tasks():
             # Calculate how many new tasks we can start
             available_slots = max_concurrent_tasks - running_tasks_count
 
-            # Get all queued tasks
-            queued_tasks_query = ScanRun.query.filter(ScanRun.status == 'queued')
+            # Get all queued tasks, except those routed to remote agents, which claim them through the agent API;
+            # runs waiting for packet rate budget are retried here as well
+            queued_tasks_query = ScanRun.query.join(ScanTask).filter(
+                ScanRun.status.in_(['queued', 'waiting']),
+                ScanTask.agent_label.is_(None)
+            )
 
             # Get the queued tasks directly - we'll prioritize based on started_at
             # which is now set to the scheduled run time for scheduled tasks
@@ -94,7 +103,7 @@ def process_queued_tasks():
                 if not submission_successful:
                     logger.error("Failed to submit ScanRun %s (ScanTask %s) to worker pool from task processor.", task.id, task.task_id)
                     # Revert status to queued if submission failed, so it can be retried
-                    task.status = 'queued'
+                    task.status = 'waiting' if task.rate_wait_since else 'queued'
                     # Potentially add an error counter or specific error status to avoid immediate re-pick
                     # For now, just reverting status.
                     db.session.commit() # Commit status revert
@@ -107,7 +116,7 @@ def process_queued_tasks():
             # We can add a summary log if needed after the loop.
             processed_count = sum(1 for t in queued_tasks if t.status == 'running') # Count tasks whose status was changed to running
             if processed_count > 0:
-                current_running_after_processing = ScanRun.query.filter(ScanRun.status == 'running').count()
+                current_running_after_processing = ScanRun.query.filter(ScanRun.status == 'running', ScanRun.agent_id.is_(None)).count()
                 logger.info("Processed %s queued tasks. %s/%s concurrent tasks now running or submitted.", processed_count, current_running_after_processing, max_concurrent_tasks)
 
         except Exception as e:
@@ -0,0 +1,76 @@
+"""
+Compression of stored report files. A compressed artifact keeps its original name with a
+.gz (gzip) or .zst (zstd, when the zstandard package is installed) suffix, so the encoding of
+any stored path is known from its name and uncompressed files written by older versions keep working.
+"""
+import os
+import gzip
+import shutil
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+ENCODING_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def artifact_encoding(path):
+    """Return the Content-Encoding name of a stored artifact ('gzip', 'zstd') or None if it is not compressed"""
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        if path.endswith(suffix):
+            return encoding
+    return None
+
+def resolve_compression(method):
+    """Return the encoding to compress new artifacts with for a configured method, or None for 'none'"""
+    method = (method or 'none').lower()
+    if method == 'zstd' and not ZSTD_AVAILABLE:
+        return 'gzip'
+    return method if method in ENCODING_SUFFIXES else None
+
+def open_artifact(path):
+    """Open a stored artifact for reading its uncompressed bytes"""
+    encoding = artifact_encoding(path)
+    if encoding == 'gzip':
+        return gzip.open(path, 'rb')
+    if encoding == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise OSError(f"Cannot read {path}: the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+def iter_artifact(path, encoded=False):
+    """Yield the bytes of an artifact in chunks, as stored (encoded=True) or decompressed"""
+    with (open(path, 'rb') if encoded else open_artifact(path)) as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def compress_artifact(path, encoding):
+    """
+    Compress a file into path + suffix and return the new path. The original is kept; the caller
+    removes it once nothing refers to it any more. The compressed file is written under a
+    temporary name first, so a failure leaves no partial output behind.
+    """
+    compressed_path = path + ENCODING_SUFFIXES[encoding]
+    temp_path = compressed_path + '.tmp'
+    try:
+        with open(path, 'rb') as src, open(temp_path, 'wb') as dst:
+            if encoding == 'gzip':
+                # The inner name and mtime are left out so the output only depends on the content
+                with gzip.GzipFile(filename='', mode='wb', fileobj=dst, compresslevel=GZIP_LEVEL, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz, COPY_CHUNK_SIZE)
+            else:
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst, read_size=COPY_CHUNK_SIZE)
+        os.replace(temp_path, compressed_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return compressed_path
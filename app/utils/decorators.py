@@ -26,6 +26,35 @@ def admin_required(f):
 
 
 
+def acquire_sqlite_lock(lock_key):
+    """
+    Try to take the SQLite-based lock lock_key. Must be called within an app context.
+    Returns True if the lock was acquired, False if it is already held.
+    """
+    try:
+        db.session.add(TaskLock(lock_key=lock_key))
+        db.session.commit()
+        logger.info("Acquired SQLite lock %s", lock_key)
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        logger.warning("Could not acquire SQLite lock %s, already held.", lock_key)
+        return False
+
+def release_sqlite_lock(lock_key):
+    """Release the SQLite-based lock lock_key. Must be called within an app context."""
+    try:
+        lock_to_delete = db.session.get(TaskLock, lock_key)
+        if lock_to_delete:
+            db.session.delete(lock_to_delete)
+            db.session.commit()
+            logger.info("Released SQLite lock %s", lock_key)
+        else:
+            logger.warning("Attempted to release SQLite lock %s but it was not found.", lock_key)
+    except Exception as e_release:
+        logger.error("Error releasing SQLite lock %s: %s", lock_key, e_release)
+        db.session.rollback()
+
 def sqlite_task_lock(key_template=None, expire=300): # expire is kept for API consistency but not strictly used by SQLite lock yet
     """
     Decorator to ensure a task does not run concurrently using an SQLite-based lock.
@@ -60,7 +89,6 @@ def sqlite_task_lock(key_template=None, expire=300): # expire is kept for API co
                     )
                     raise ValueError(f"Invalid key_template for task {task_name}. Missing argument: {e}") from e
             
-            lock_acquired = False
             # Ensure we are within an application context for database operations
             # Use current_app if available (e.g. in a Flask request context), else create a new app context.
             # This is crucial for background tasks that might run outside a request.
@@ -72,38 +100,13 @@ def sqlite_task_lock(key_template=None, expire=300): # expire is kept for API co
                 app_context_manager = app_for_context.app_context()
 
             with app_context_manager:
+                if not acquire_sqlite_lock(lock_key_val):
+                    logger.warning("Skipping execution of task %s, lock %s is held.", task_name, lock_key_val)
+                    return None # Task did not run
                 try:
-                    # Attempt to acquire the lock
-                    new_lock = TaskLock(lock_key=lock_key_val)
-                    db.session.add(new_lock)
-                    db.session.commit()
-                    lock_acquired = True
-                    logger.info("Acquired SQLite lock %s for task %s", lock_key_val, task_name)
-                    
                     # Execute the decorated function
-                    result = func(*args, **kwargs)
-                    return result
-                
-                except IntegrityError:
-                    # Lock is already held
-                    db.session.rollback() # Rollback the failed commit
-                    logger.warning("Could not acquire SQLite lock %s for task %s, skipping execution.", lock_key_val, task_name)
-                    return None # Task did not run
-                
+                    return func(*args, **kwargs)
                 finally:
-                    if lock_acquired:
-                        # Release the lock
-                        try:
-                            # Query within the same session that created/committed the lock
-                            lock_to_delete = db.session.query(TaskLock).get(lock_key_val)
-                            if lock_to_delete:
-                                db.session.delete(lock_to_delete)
-                                db.session.commit()
-                                logger.info("Released SQLite lock %s for task %s", lock_key_val, task_name)
-                            else:
-                                logger.warning("Attempted to release SQLite lock %s but it was not found post-commit.", lock_key_val)
-                        except Exception as e_release:
-                            logger.error("Error releasing SQLite lock %s: %s", lock_key_val, e_release)
-                            db.session.rollback() # Rollback on error during release
+                    release_sqlite_lock(lock_key_val)
         return wrapper
     return decorator
\ No newline at end of file
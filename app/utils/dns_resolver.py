@@ -0,0 +1,135 @@
+"""
+Concurrent hostname resolution for target validation.
+
+Lookups run on a shared thread pool, so the many hostnames of a large target group resolve in
+parallel, and their results are kept in a TTL-bounded LRU cache (failed lookups for a shorter
+time). A request only waits for its lookups up to a time budget; names that failed or are still
+resolving are left to the background target resolution job.
+"""
+import time
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app
+
+class TTLCache:
+    """Least recently used cache of at most max_size entries that expire after their TTL"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, value) for a live entry, or (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class HostnameResolver:
+    """
+    Resolves hostnames to IPv4 addresses on a thread pool with a shared cache.
+    A name already being looked up is not looked up again; later callers wait for the same lookup.
+    """
+
+    def __init__(self, max_workers=32, cache_size=10000, ttl=300, negative_ttl=60):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(cache_size)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dns-resolver')
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, hostname):
+        try:
+            address = socket.gethostbyname(hostname)
+        except (socket.gaierror, socket.herror, UnicodeError):
+            address = None
+        self.cache.set(hostname, address, self.ttl if address else self.negative_ttl)
+        with self._lock:
+            self._in_flight.pop(hostname, None)
+        return address
+
+    def _submit(self, hostname):
+        with self._lock:
+            future = self._in_flight.get(hostname)
+            if future is None:
+                future = self._executor.submit(self._lookup, hostname)
+                self._in_flight[hostname] = future
+            return future
+
+    def resolve_many(self, hostnames, budget):
+        """
+        Resolve hostnames, waiting at most budget seconds for the lookups not in the cache.
+        Returns (resolved, failed, pending): resolved maps each name that resolved to its address,
+        failed lists the names whose lookup found no address and pending those still resolving
+        when the budget ran out, which keep going in the background and fill the cache.
+        """
+        resolved = {}
+        failed = []
+        pending = []
+        futures = {}
+        for hostname in dict.fromkeys(hostnames):
+            found, address = self.cache.get(hostname)
+            if not found:
+                futures[hostname] = self._submit(hostname)
+            elif address:
+                resolved[hostname] = address
+            else:
+                failed.append(hostname)
+
+        if futures:
+            wait(futures.values(), timeout=budget)
+        for hostname, future in futures.items():
+            if not future.done():
+                pending.append(hostname)
+            elif future.result():
+                resolved[hostname] = future.result()
+            else:
+                failed.append(hostname)
+        return resolved, failed, pending
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_hostname_resolver():
+    """Return the process-wide HostnameResolver, created from the app config on first use"""
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = HostnameResolver(
+                max_workers=current_app.config.get('DNS_RESOLVER_THREADS', 32),
+                cache_size=current_app.config.get('DNS_CACHE_SIZE', 10000),
+                ttl=current_app.config.get('DNS_CACHE_TTL', 300),
+                negative_ttl=current_app.config.get('DNS_NEGATIVE_CACHE_TTL', 60)
+            )
+        return _resolver
+
+def resolve_hostnames(hostnames, budget=None):
+    """
+    Resolve hostnames within the request time budget (DNS_RESOLVE_BUDGET_SECONDS by default).
+    Returns (resolved, failed, pending) as HostnameResolver.resolve_many() does.
+    """
+    if not hostnames:
+        return {}, [], []
+    if budget is None:
+        budget = current_app.config.get('DNS_RESOLVE_BUDGET_SECONDS', 2.0)
+    return get_hostname_resolver().resolve_many(hostnames, budget)
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, TextAreaField, SelectField, SelectMultipleField, IntegerField, SubmitField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, Optional, ValidationError, NumberRange
+from wtforms.validators import DataRequired, Email, EqualTo, Length, Optional, ValidationError, NumberRange, Regexp
 from app.models.user import User
 from app import db
 from config import Config
@@ -117,6 +117,7 @@ class ScanTaskForm(FlaskForm):
     # Create choices for scan profiles from config
     scan_profile_choices = [(k, k.replace('_', ' ').title()) for k in Config.NMAP_SCAN_PROFILES.keys()]
     scan_profile_choices.insert(0, ('custom', 'Custom Arguments'))
+    scan_profile_choices.append((Config.NMAP_LEARNED_PROFILE, f'Learned Top {Config.NMAP_LEARNED_TOP_PORTS} Ports'))
     
     scan_profile = SelectField('Scan Profile', choices=scan_profile_choices, validators=[DataRequired()])
     custom_args = StringField('Custom Nmap Arguments', validators=[Optional()])
@@ -127,6 +128,22 @@ class ScanTaskForm(FlaskForm):
     max_reports = IntegerField('Maximum Reports to Keep', validators=[Optional(), NumberRange(min=1, max=100)],
                              description='Maximum number of reports to keep for this task (overrides global setting)')
     
+    # Execution settings
+    shard_count = IntegerField('Parallel Shards', default=1,
+                               validators=[Optional(), NumberRange(min=1, max=Config.NMAP_MAX_SHARDS)],
+                               description='Split the targets across this many parallel Nmap processes (1 = single process)')
+    adaptive_timing = BooleanField('Adaptive Timing', default=False,
+                                   description='Tune --min-rate, --max-retries, --min-hostgroup and --host-timeout for each target group from the timing of previous runs')
+    agent_label = StringField('Remote Agent Label', validators=[Optional(), Length(max=64), Regexp(r'^[A-Za-z0-9_.-]*$', message='Use letters, digits, dots, dashes and underscores only')],
+                              description="Run on a remote scan agent with this label ('any' for any agent) instead of this server; leave empty to scan locally")
+    scan_engine = SelectField('Scan Engine', choices=[
+        ('nmap', 'Nmap'),
+        ('sweep', 'Fast sweep + Nmap service scan')
+    ], default='nmap',
+                              description='Fast sweep: masscan (or Nmap -sS --min-rate) finds the open ports of the whole range first, then Nmap -sV scans only those ports in parallel batches')
+    deadline_minutes = IntegerField('Deadline (minutes)', validators=[Optional(), NumberRange(min=0)],
+                                    description='Stop Nmap after this many minutes and keep the hosts it finished as a partial report (empty or 0 uses the global default)')
+    
     run_now = BooleanField('Run Immediately')
     submit = SubmitField('Save')
     
@@ -192,4 +209,16 @@ class SystemSettingsForm(FlaskForm):
                                   validators=[NumberRange(min=5, max=100)],
                                   description='Default number of items to display per page in listings (tasks, reports, etc.)')
     
+    liveness_skip_down_runs = IntegerField('Skip Hosts Down For (Runs)',
+                                           validators=[NumberRange(min=0, max=100)],
+                                           description='Scheduled scans skip addresses that were down in this many consecutive runs (0 = never skip)')
+    
+    liveness_full_sweep_days = IntegerField('Full Sweep Interval (Days)',
+                                            validators=[NumberRange(min=1, max=365)],
+                                            description='Scheduled scans scan every address, including skipped ones, at least this often')
+    
+    global_max_rate = IntegerField('Global Packet Rate Budget (pps)',
+                                   validators=[NumberRange(min=0, max=10000000)],
+                                   description='Total packets per second; every scan gets an equal share as --max-rate, sized for the maximum concurrent tasks (0 = no limit)')
+    
     submit = SubmitField('Save Settings')
@@ -0,0 +1,98 @@
+"""
+In-place upgrade of the database schema of an existing install.
+
+db.create_all() only creates missing tables, so columns added to the models of existing tables
+are added here with ALTER TABLE ... ADD COLUMN, checked against the live table definition
+(PRAGMA table_info on SQLite). Scalar Python defaults become the column's DEFAULT so that old
+rows get the same value as new ones; a NOT NULL column without one is added as nullable, since
+existing rows could not satisfy it. Every step is idempotent.
+"""
+import os
+import fcntl
+import logging
+import tempfile
+from sqlalchemy import inspect, literal, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Serializes the upgrade between the web workers starting at the same time
+SCHEMA_LOCK_FILE = os.path.join(tempfile.gettempdir(), 'nmapwebui_schema.lock')
+
+def _column_ddl(column, dialect):
+    ddl = f"{column.name} {column.type.compile(dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        ddl += f" DEFAULT {literal(default, type_=column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    for foreign_key in column.foreign_keys:
+        ddl += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+    return ddl
+
+def add_missing_columns(table):
+    """
+    Add the columns of a model table that its database table lacks, then create its missing
+    indexes. Must be called within an app context. Returns the names of the columns added.
+    """
+    inspector = inspect(db.engine)
+    if not inspector.has_table(table.name):
+        return []
+    existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing_columns:
+            continue
+        try:
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column, db.engine.dialect)}"))
+            db.session.commit()
+        except (OperationalError, ProgrammingError):
+            # Added by another process in the meantime; anything else is raised again
+            db.session.rollback()
+            if column.name not in {c['name'] for c in inspect(db.engine).get_columns(table.name)}:
+                raise
+            continue
+        added.append(column.name)
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
+    return added
+
+def find_missing_columns():
+    """Return 'table.column' for every model column the database does not have"""
+    inspector = inspect(db.engine)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.extend(f"{table.name}.{column.name}" for column in table.columns)
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in existing_columns)
+    return missing
+
+def upgrade_schema():
+    """
+    Create missing tables, add missing columns to existing ones and convert data stored in an
+    older layout. Must be called within an app context. Returns (columns added, port findings
+    converted); raises RuntimeError if any model column is still missing afterwards.
+    """
+    # Imported here: finding_lookups uses add_missing_columns from this module
+    from app.tasks.finding_lookups import migrate_legacy_port_findings
+
+    with open(SCHEMA_LOCK_FILE, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            db.create_all()
+            added = []
+            for table in db.metadata.sorted_tables:
+                added.extend(f"{table.name}.{name}" for name in add_missing_columns(table))
+            if added:
+                logger.info(f"Added columns to the database: {', '.join(added)}")
+            converted = migrate_legacy_port_findings()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    missing = find_missing_columns()
+    if missing:
+        raise RuntimeError(f"Database columns still missing after the upgrade: {', '.join(missing)}")
+    return added, converted
@@ -0,0 +1,53 @@
+"""
+Helpers for mapping scanned hosts back to the target groups whose targets cover them.
+"""
+
+import ipaddress
+from typing import Iterable, List, Optional, Set, Tuple
+
+GroupMatcher = Tuple[int, list, Set[str]]
+
+def build_group_matchers(target_groups) -> List[GroupMatcher]:
+    """
+    Build a matcher for each target group from its targets.
+
+    Args:
+        target_groups: TargetGroup objects
+
+    Returns:
+        List of (group_id, networks, hostnames) tuples
+    """
+    matchers = []
+    for group in target_groups:
+        networks, hostnames = [], set()
+        for target in group.targets:
+            try:
+                networks.append(ipaddress.ip_network(target.value.strip(), strict=False))
+            except ValueError:
+                hostnames.add(target.value.strip().lower())
+        matchers.append((group.id, networks, hostnames))
+    return matchers
+
+def match_target_group(matchers: List[GroupMatcher], ip_address: str, hostnames: Iterable[str] = ()) -> Optional[int]:
+    """
+    Return the ID of the first target group covering a host.
+
+    Args:
+        matchers: Matchers returned by build_group_matchers()
+        ip_address: The address of the host
+        hostnames: Hostnames reported for the host (lowercase)
+
+    Returns:
+        The target group ID, or None if no group covers the host
+    """
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        address = None
+    hostnames = set(hostnames)
+    for group_id, networks, group_hostnames in matchers:
+        if address is not None and any(address.version == network.version and address in network for network in networks):
+            return group_id
+        if group_hostnames & hostnames:
+            return group_id
+    return None
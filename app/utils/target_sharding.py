@@ -0,0 +1,106 @@
+"""
+Target sharding utilities for splitting one scan across several parallel Nmap processes.
+CIDR ranges are chunked into smaller subnets so that large networks can be balanced across shards.
+"""
+
+import heapq
+import ipaddress
+import math
+from typing import List, Tuple
+
+# Never chunk CIDR ranges into subnets smaller than these prefixes.
+# Smaller chunks only make the Nmap command line longer without improving the balance.
+MIN_CHUNK_PREFIX_V4 = 24
+MIN_CHUNK_PREFIX_V6 = 120
+
+# Aim for several units per shard so that the largest-first assignment can balance the load
+UNITS_PER_SHARD = 4
+
+def target_address_count(target: str) -> int:
+    """
+    Return the number of addresses a target covers.
+
+    Args:
+        target: A sanitized target (IP address, CIDR or hostname)
+
+    Returns:
+        The number of addresses (1 for hostnames and single IPs)
+    """
+    if '/' in target:
+        try:
+            return ipaddress.ip_network(target, strict=False).num_addresses
+        except ValueError:
+            return 1
+    return 1
+
+def expand_targets(targets: List[str], chunk_size: int) -> List[Tuple[str, int]]:
+    """
+    Expand targets into shardable units, chunking CIDR ranges larger than chunk_size.
+
+    Args:
+        targets: List of sanitized targets
+        chunk_size: Preferred maximum number of addresses per unit
+
+    Returns:
+        List of (target, address_count) tuples
+    """
+    units = []
+    for target in targets:
+        if '/' not in target:
+            units.append((target, 1))
+            continue
+        try:
+            network = ipaddress.ip_network(target, strict=False)
+        except ValueError:
+            units.append((target, 1))
+            continue
+
+        if network.num_addresses <= chunk_size:
+            units.append((str(network), network.num_addresses))
+            continue
+
+        # Pick the largest subnet that still fits in chunk_size, bounded by the minimum chunk prefix
+        min_prefix = MIN_CHUNK_PREFIX_V4 if network.version == 4 else MIN_CHUNK_PREFIX_V6
+        new_prefix = network.max_prefixlen - int(math.floor(math.log2(max(1, chunk_size))))
+        new_prefix = max(network.prefixlen, min(new_prefix, min_prefix))
+        if new_prefix == network.prefixlen:
+            units.append((str(network), network.num_addresses))
+            continue
+        for subnet in network.subnets(new_prefix=new_prefix):
+            units.append((str(subnet), subnet.num_addresses))
+    return units
+
+def shard_targets(targets: List[str], shard_count: int) -> List[Tuple[List[str], int]]:
+    """
+    Split targets into at most shard_count balanced shards.
+
+    CIDR ranges are chunked first, then units are assigned largest-first to the
+    shard with the fewest addresses so far.
+
+    Args:
+        targets: List of sanitized targets
+        shard_count: Maximum number of shards to produce
+
+    Returns:
+        List of (targets, address_count) tuples, one per non-empty shard
+    """
+    if not targets:
+        return []
+    if shard_count <= 1:
+        return [(list(targets), sum(target_address_count(t) for t in targets))]
+
+    total_addresses = sum(target_address_count(t) for t in targets)
+    chunk_size = max(1, int(math.ceil(total_addresses / float(shard_count * UNITS_PER_SHARD))))
+    units = expand_targets(targets, chunk_size)
+    units.sort(key=lambda unit: unit[1], reverse=True)
+
+    shard_total = min(shard_count, len(units))
+    shards = [[] for _ in range(shard_total)]
+    heap = [(0, index) for index in range(shard_total)]
+    for target, count in units:
+        load, index = heapq.heappop(heap)
+        shards[index].append(target)
+        heapq.heappush(heap, (load + count, index))
+
+    loads = {index: load for load, index in heap}
+    return [(shards[index], loads[index]) for index in range(shard_total) if shards[index]]
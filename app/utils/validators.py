@@ -1,5 +1,4 @@
 import re
-import socket
 from ipaddress import ip_network, ip_address
 from app.utils.sanitize import sanitize_ip_address, sanitize_hostname, sanitize_nmap_command, sanitize_nmap_target
 
@@ -10,6 +9,8 @@ def validate_targets(targets_list):
     valid_targets is a list of tuples (target_value, target_type)
     
     This function now uses the sanitize module for more robust validation.
+    Hostnames are only checked for syntax; they are resolved in bulk with
+    app.utils.dns_resolver.resolve_hostnames() so a large group does not wait on DNS one name at a time.
     """
     valid_targets = []
     invalid_targets = []
@@ -40,14 +41,8 @@ def validate_targets(targets_list):
         else:
             sanitized = sanitize_hostname(target)
             if sanitized:
-                try:
-                    # Try to resolve the hostname
-                    socket.gethostbyname(sanitized)
-                    valid_targets.append((sanitized, 'hostname'))
-                except socket.gaierror:
-                    # Still add it as a hostname even if it doesn't resolve
-                    # It might be a valid hostname that's not in DNS
-                    valid_targets.append((sanitized, 'hostname'))
+                # Added even if it does not resolve; it might be a valid hostname that's not in DNS
+                valid_targets.append((sanitized, 'hostname'))
             else:
                 invalid_targets.append(target)
     
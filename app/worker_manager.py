@@ -8,6 +8,7 @@ from datetime import datetime
 import pytz # For timezone-aware ended_at, if used
 
 from app.tasks.nmap_tasks import run_nmap_scan
+from app.tasks.nmap_preflight import probe_nmap_capabilities, set_nmap_capabilities, describe_nmap_capabilities
 from config import Config
 from app import _current_flask_app, db # Assuming _current_flask_app is accessible from app package
 from app.models.task import ScanRun
@@ -26,10 +27,57 @@ except NotImplementedError:
     pool_size = DEFAULT_POOL_SIZE
 
 WORKER_POOL = None
+ASYNC_SUPERVISOR = None
 
-def initialize_worker_pool():
-    """Initializes the global worker pool."""
-    global WORKER_POOL
+def get_worker_capacity():
+    """Return how many scans the configured execution backend can run at once."""
+    if Config.NMAP_EXECUTION_BACKEND == 'asyncio':
+        return Config.NMAP_ASYNC_MAX_SCANS
+    return Config.NMAP_WORKER_POOL_SIZE
+
+def get_active_scan_count():
+    """
+    Return how many scans the asyncio supervisor of this process holds, including runs still
+    being prepared that are not 'running' yet, or None without a supervisor in this process.
+    """
+    if ASYNC_SUPERVISOR is None:
+        return None
+    return ASYNC_SUPERVISOR.active_scan_count()
+
+def cancel_scan(scan_run_id):
+    """
+    Cancel a scan run held by the asyncio supervisor of this process, which kills its Nmap
+    processes and discards its partial report. Returns False if this process does not hold the run.
+    """
+    if ASYNC_SUPERVISOR is None:
+        return False
+    return ASYNC_SUPERVISOR.cancel(scan_run_id)
+
+def preflight_nmap():
+    """Probe the Nmap binary and its privileges once for the scan workers of this process."""
+    capabilities = probe_nmap_capabilities(Config.NMAP_PATH)
+    print(f"WORKER_POOL: Nmap preflight: {describe_nmap_capabilities(capabilities)}", file=sys.stdout)
+    sys.stdout.flush()
+    if capabilities.error:
+        logger.error("Nmap preflight failed: %s", capabilities.error)
+    return capabilities
+
+def initialize_worker_pool(app=None):
+    """Initializes the global worker pool, or the asyncio supervisor if that backend is configured."""
+    global WORKER_POOL, ASYNC_SUPERVISOR
+    if Config.NMAP_EXECUTION_BACKEND == 'asyncio':
+        if ASYNC_SUPERVISOR is None:
+            set_nmap_capabilities(preflight_nmap())
+            from app.async_supervisor import AsyncScanSupervisor
+            print(f"WORKER_POOL: Starting asyncio scan supervisor (max {Config.NMAP_ASYNC_MAX_SCANS} concurrent scans)", file=sys.stdout)
+            sys.stdout.flush()
+            ASYNC_SUPERVISOR = AsyncScanSupervisor(
+                app or _current_flask_app,
+                max_concurrent_scans=Config.NMAP_ASYNC_MAX_SCANS,
+                result_callback=scan_success_callback
+            )
+            ASYNC_SUPERVISOR.start()
+        return
     if WORKER_POOL is None:
         logger.info("Initializing worker pool with %s processes.", pool_size)
         print(f"WORKER_POOL: Initializing worker pool with {pool_size} processes", file=sys.stdout)
@@ -38,7 +86,8 @@ def initialize_worker_pool():
         # Set daemon=False explicitly to prevent "daemonic processes are not allowed to have children" error
         # This ensures the pool processes can spawn nmap child processes
         ctx = multiprocessing.get_context('spawn')  # Use 'spawn' context for better cross-platform compatibility
-        WORKER_POOL = ctx.Pool(processes=pool_size)
+        # Probe Nmap once here and hand the result to every worker instead of probing per scan
+        WORKER_POOL = ctx.Pool(processes=pool_size, initializer=set_nmap_capabilities, initargs=(preflight_nmap(),))
         
         logger.info("Worker pool initialized.")
         print(f"WORKER_POOL: Worker pool initialized successfully", file=sys.stdout)
@@ -46,7 +95,10 @@ def initialize_worker_pool():
 
 def shutdown_worker_pool():
     """Shuts down the global worker pool gracefully."""
-    global WORKER_POOL
+    global WORKER_POOL, ASYNC_SUPERVISOR
+    if ASYNC_SUPERVISOR is not None:
+        ASYNC_SUPERVISOR.shutdown()
+        ASYNC_SUPERVISOR = None
     if WORKER_POOL is not None:
         logger.info("Shutting down worker pool...")
         WORKER_POOL.close()  # No more tasks
@@ -111,6 +163,8 @@ def scan_success_callback(scan_run_id, result_from_run_nmap_scan):
                         logger.info(f"Updated ScanRun {scan_run_id} to 'failed' based on task function's 'failed' return. Message: {task_message}")
                     else:
                         logger.info(f"ScanRun {scan_run_id} already in terminal state '{scan_run.status}' or task reported failure for already completed task. No update from task's 'failed' return.")
+                elif task_status == 'waiting':
+                    logger.info(f"ScanRun {scan_run_id} went back to the queue to wait for packet rate budget.")
                 else:
                     logger.warning(f"ScanRun {scan_run_id} received an unexpected status '{task_status}' in result dictionary: {result_from_run_nmap_scan}")
             
@@ -153,6 +207,11 @@ def submit_nmap_scan(scan_run_id, scan_task_id_for_lock):
     # Get current process ID for logging
     process_id = os.getpid()
     
+    # The asyncio backend runs the scan in this process's supervisor
+    if ASYNC_SUPERVISOR is not None:
+        logger.info(f"Worker PID={process_id} submitting nmap scan for scan_run_id: {scan_run_id} to async supervisor.")
+        return ASYNC_SUPERVISOR.submit(scan_run_id, scan_task_id_for_lock)
+    
     # Check if this worker has an initialized worker pool (only primary worker should)
     if WORKER_POOL is None:
         logger.warning(f"Worker PID={process_id} has no worker pool initialized (non-primary worker).")
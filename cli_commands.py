@@ -10,6 +10,9 @@ from flask.cli import with_appcontext
 from app import db
 from app.models.user import User
 from app.models.settings import SystemSettings
+from app.models.task import ScanTask
+from app.tasks.report_import import import_nmap_xml
+from app.utils.schema_upgrade import upgrade_schema
 
 @click.command('init-db')
 @with_appcontext
@@ -17,8 +20,8 @@ def init_db_command():
     """Initialize the database with the required tables."""
     click.echo("Initializing database...")
     
-    # Create all tables
-    db.create_all()
+    # Create all tables and bring the tables of an older database up to date
+    upgrade_schema()
     
     # Initialize system settings with default values if they don't exist
     if SystemSettings.get_setting('max_concurrent_tasks') is None:
@@ -33,6 +36,18 @@ def init_db_command():
         SystemSettings.set_setting('pagination_rows', 20,
                                  'Default number of items to display per page in listings')
     
+    if SystemSettings.get_setting('liveness_skip_down_runs') is None:
+        SystemSettings.set_setting('liveness_skip_down_runs', 3,
+                                 'Scheduled scans skip addresses down in this many consecutive runs (0 = never)')
+    
+    if SystemSettings.get_setting('liveness_full_sweep_days') is None:
+        SystemSettings.set_setting('liveness_full_sweep_days', 7,
+                                 'Days between full sweeps that scan skipped addresses again')
+    
+    if SystemSettings.get_setting('global_max_rate') is None:
+        SystemSettings.set_setting('global_max_rate', 0,
+                                 'Total packets per second shared by all concurrent scans (0 = no limit)')
+    
     click.echo("Database initialization complete!")
 
 @click.command('create-admin')
@@ -92,7 +107,41 @@ def create_admin_command():
     click.echo(f"\nAdmin user '{username}' created successfully!")
     click.echo("You can now log in to the application with these credentials.")
 
+@click.command('import-xml')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--task-id', type=int, required=True, help='Scan task the imported reports are added to')
+@click.option('--workers', type=int, default=None, help='Processes hashing and parsing the files (default: IMPORT_WORKERS)')
+@with_appcontext
+def import_xml_command(source, task_id, workers):
+    """Import external Nmap XML files (a directory, tarball, zip archive or single file) into a task."""
+    scan_task = ScanTask.query.get(task_id)
+    if not scan_task:
+        click.echo(f"Error: Scan task {task_id} does not exist.")
+        return
+    
+    click.echo(f"Importing {source} into task '{scan_task.name}'...")
+    try:
+        stats = import_nmap_xml(source, scan_task, workers)
+    except ValueError as e:
+        click.echo(f"Error: {str(e)}")
+        return
+    click.echo(stats.describe())
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables and columns and convert the data of a database created by an older version."""
+    try:
+        added, converted = upgrade_schema()
+    except Exception as e:
+        raise click.ClickException(f"Database upgrade failed: {str(e)}")
+    for column in added:
+        click.echo(f"Added column {column}")
+    click.echo(f"Database is up to date ({len(added)} columns added, {converted} port findings converted).")
+
 def register_commands(app):
     """Register CLI commands with the Flask application."""
     app.cli.add_command(init_db_command)
     app.cli.add_command(create_admin_command)
+    app.cli.add_command(import_xml_command)
+    app.cli.add_command(upgrade_db_command)
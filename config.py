@@ -10,6 +10,11 @@ class Config:
 
     NMAP_WORKER_POOL_SIZE = int(os.environ.get('NMAP_WORKER_POOL_SIZE', 2))
     
+    # Scan execution backend: 'pool' (one worker process per scan) or 'asyncio'
+    # (one supervisor thread in the primary worker runs all scans as asyncio subprocesses)
+    NMAP_EXECUTION_BACKEND = os.environ.get('NMAP_EXECUTION_BACKEND', 'pool').lower()
+    NMAP_ASYNC_MAX_SCANS = int(os.environ.get('NMAP_ASYNC_MAX_SCANS', 32))
+    
     # SQLAlchemy configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:////home/firman/coding/python/nmapwebui/instance/app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -23,6 +28,95 @@ class Config:
     # Ensure reports directory exists
     os.makedirs(NMAP_REPORTS_DIR, exist_ok=True)
     
+    # Nmap binary; probed once at worker startup for its version and how it can get root privileges
+    NMAP_PATH = os.environ.get('NMAP_PATH', '/usr/bin/nmap')
+    
+    # Maximum number of parallel Nmap processes a single scan run may be split into
+    NMAP_MAX_SHARDS = int(os.environ.get('NMAP_MAX_SHARDS', 8))
+    
+    # Streaming ingestion: commit hosts to the report in batches while Nmap is still running
+    NMAP_STREAMING_INGEST = os.environ.get('NMAP_STREAMING_INGEST', 'false').lower() in ('true', '1', 'yes')
+    NMAP_STREAMING_BATCH_SIZE = int(os.environ.get('NMAP_STREAMING_BATCH_SIZE', 50))
+    NMAP_STREAMING_FLUSH_SECONDS = int(os.environ.get('NMAP_STREAMING_FLUSH_SECONDS', 5))
+    
+    # Processes hashing and parsing the files of a bulk import of external Nmap XML (flask import-xml, task page upload)
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 4))
+    # Total size in MB the XML files of one imported archive may extract to (0 for no limit); an archive
+    # exceeding it is rejected, which stops decompression bombs from filling the disk
+    IMPORT_MAX_EXTRACT_MB = int(os.environ.get('IMPORT_MAX_EXTRACT_MB', 5120))
+    
+    # Largest request body accepted, in MB (0 for no limit); bounds the Nmap XML uploaded on task pages,
+    # which is saved under NMAP_REPORTS_DIR/imports and imported by a background job
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB', 512)) * 1024 * 1024 or None
+    
+    # Compression of a run's XML and normal output files once its report is ingested: 'none', 'gzip' or
+    # 'zstd' (needs the zstandard package, gzip is used without it); downloads are decompressed for
+    # clients that do not accept the encoding
+    NMAP_ARTIFACT_COMPRESSION = os.environ.get('NMAP_ARTIFACT_COMPRESSION', 'none').lower()
+    
+    # Reports beyond each task's maximum are deleted by a background job every REPORT_RETENTION_INTERVAL_SECONDS:
+    # REPORT_RETENTION_CHUNK_REPORTS reports at a time, their findings REPORT_RETENTION_CHUNK_HOSTS hosts per
+    # transaction with a pause in between, for at most REPORT_RETENTION_MAX_SECONDS per run
+    REPORT_RETENTION_INTERVAL_SECONDS = int(os.environ.get('REPORT_RETENTION_INTERVAL_SECONDS', 60))
+    REPORT_RETENTION_CHUNK_REPORTS = int(os.environ.get('REPORT_RETENTION_CHUNK_REPORTS', 20))
+    REPORT_RETENTION_CHUNK_HOSTS = int(os.environ.get('REPORT_RETENTION_CHUNK_HOSTS', 1000))
+    REPORT_RETENTION_PAUSE_SECONDS = float(os.environ.get('REPORT_RETENTION_PAUSE_SECONDS', 0.1))
+    REPORT_RETENTION_MAX_SECONDS = int(os.environ.get('REPORT_RETENTION_MAX_SECONDS', 30))
+    
+    # Reports written from the finished XML file are parsed incrementally and committed this many hosts at a time
+    NMAP_INGEST_BATCH_SIZE = int(os.environ.get('NMAP_INGEST_BATCH_SIZE', 500))
+    
+    # Seconds the output monitor waits in select() before waking up when Nmap is quiet
+    NMAP_MONITOR_TIMEOUT = float(os.environ.get('NMAP_MONITOR_TIMEOUT', 1.0))
+    
+    # Scan progress is written when it changes by at least this many percent, or after the flush interval
+    NMAP_PROGRESS_MIN_DELTA = int(os.environ.get('NMAP_PROGRESS_MIN_DELTA', 5))
+    NMAP_PROGRESS_FLUSH_SECONDS = float(os.environ.get('NMAP_PROGRESS_FLUSH_SECONDS', 10))
+
+    # Relaunch scans interrupted by a worker or host crash with nmap --resume instead of failing them
+    NMAP_RESUME_INTERRUPTED = os.environ.get('NMAP_RESUME_INTERRUPTED', 'true').lower() in ('true', '1', 'yes')
+    NMAP_MAX_RESUME_ATTEMPTS = int(os.environ.get('NMAP_MAX_RESUME_ATTEMPTS', 3))
+
+    # Default wall-clock limit of a scan run in minutes for tasks without their own (0 for none); at the
+    # deadline Nmap is interrupted, killed after the grace period, and the hosts it finished are kept
+    NMAP_SCAN_DEADLINE_MINUTES = int(os.environ.get('NMAP_SCAN_DEADLINE_MINUTES', 0))
+    NMAP_DEADLINE_GRACE_SECONDS = int(os.environ.get('NMAP_DEADLINE_GRACE_SECONDS', 30))
+
+    # Sweep engine: masscan binary (Nmap -sS --min-rate sweeps when it is missing), sweep packets per second,
+    # ports swept when the task's arguments name none, and the hosts per service scan batch and batches run
+    # at once (a task's shard count overrides the latter)
+    MASSCAN_PATH = os.environ.get('MASSCAN_PATH', '/usr/bin/masscan')
+    NMAP_SWEEP_RATE = int(os.environ.get('NMAP_SWEEP_RATE', 10000))
+    NMAP_SWEEP_PORTS = os.environ.get('NMAP_SWEEP_PORTS', '1-65535')
+    NMAP_SWEEP_BATCH_HOSTS = int(os.environ.get('NMAP_SWEEP_BATCH_HOSTS', 64))
+    NMAP_SWEEP_PARALLEL_BATCHES = int(os.environ.get('NMAP_SWEEP_PARALLEL_BATCHES', 4))
+
+    # Resource limits of Nmap processes so that scans cannot starve the web worker:
+    # niceness (0 leaves it unchanged), IO class ('idle', 'best-effort' or '' to leave it unchanged) and level,
+    # CPU list for taskset (e.g. '2-3', empty for any CPU), address space cap and open file limit (0 for no cap)
+    NMAP_NICE = int(os.environ.get('NMAP_NICE', 10))
+    NMAP_IONICE_CLASS = os.environ.get('NMAP_IONICE_CLASS', 'best-effort').lower()
+    NMAP_IONICE_LEVEL = int(os.environ.get('NMAP_IONICE_LEVEL', 7))
+    NMAP_CPU_AFFINITY = os.environ.get('NMAP_CPU_AFFINITY', '')
+    NMAP_MAX_MEMORY_MB = int(os.environ.get('NMAP_MAX_MEMORY_MB', 0))
+    NMAP_MAX_OPEN_FILES = int(os.environ.get('NMAP_MAX_OPEN_FILES', 0))
+
+    # Per-profile overrides of the resource limits above
+    NMAP_PROFILE_RESOURCE_LIMITS = {
+        'intense_scan': {'nice': 15},
+        'intense_scan_Pn': {'nice': 15},
+        'comprehensive': {'nice': 19, 'ionice_class': 'idle'}
+    }
+
+    # Runs wait in the queue for a share of the global packet rate budget (a system setting) for at most this many seconds
+    NMAP_RATE_BUDGET_MAX_WAIT = int(os.environ.get('NMAP_RATE_BUDGET_MAX_WAIT', 3600))
+
+    # Remote scan agents (run_agent.py) register with this shared secret; empty disables the agent API.
+    # A claimed run goes back to the queue if its agent does not renew the lease in time.
+    AGENT_REGISTRATION_TOKEN = os.environ.get('AGENT_REGISTRATION_TOKEN', '')
+    AGENT_LEASE_SECONDS = int(os.environ.get('AGENT_LEASE_SECONDS', 120))
+    AGENT_MAX_LEASES = int(os.environ.get('AGENT_MAX_LEASES', 3))
+
     # Predefined Nmap scan profiles
     NMAP_SCAN_PROFILES = {
         'quick_scan': '-T4 -F',
@@ -35,6 +129,39 @@ class Config:
         'comprehensive': '-T4 -A -v -p- -Pn'
     }
     
+    # Generated profile scanning the ports most often found open in our own reports
+    NMAP_LEARNED_PROFILE = 'learned_top_ports'
+    NMAP_LEARNED_PROFILE_ARGS = os.environ.get('NMAP_LEARNED_PROFILE_ARGS', '-T4')
+    NMAP_LEARNED_TOP_PORTS = int(os.environ.get('NMAP_LEARNED_TOP_PORTS', 100))
+
+    # Reuse the host results of an identical scan (same address, same arguments) finished within a TTL;
+    # the TTL in seconds is looked up by profile, NMAP_RESULT_CACHE_TTL applies to the rest (0 disables).
+    # Off by default: with it on, a run repeated within the TTL returns the earlier results without running Nmap
+    NMAP_RESULT_CACHE = os.environ.get('NMAP_RESULT_CACHE', 'false').lower() in ('true', '1', 'yes')
+    NMAP_RESULT_CACHE_TTL = int(os.environ.get('NMAP_RESULT_CACHE_TTL', 900))
+    NMAP_RESULT_CACHE_TTLS = {
+        'quick_scan': 1800,
+        'intense_scan': 3600,
+        'intense_scan_Pn': 3600,
+        'ping_scan': 600,
+        'port_scan': 1800,
+        'service_scan': 3600,
+        'os_detection': 3600,
+        'comprehensive': 7200
+    }
+    # Networks larger than this are always sent to Nmap as a whole
+    NMAP_RESULT_CACHE_MAX_ADDRESSES = int(os.environ.get('NMAP_RESULT_CACHE_MAX_ADDRESSES', 4096))
+
+    # Hostnames of target groups are resolved concurrently on DNS_RESOLVER_THREADS threads with an LRU cache;
+    # saving a group waits at most DNS_RESOLVE_BUDGET_SECONDS, the rest is resolved by a background job
+    DNS_RESOLVER_THREADS = int(os.environ.get('DNS_RESOLVER_THREADS', 32))
+    DNS_RESOLVE_BUDGET_SECONDS = float(os.environ.get('DNS_RESOLVE_BUDGET_SECONDS', 2.0))
+    DNS_CACHE_SIZE = int(os.environ.get('DNS_CACHE_SIZE', 10000))
+    DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))
+    DNS_NEGATIVE_CACHE_TTL = int(os.environ.get('DNS_NEGATIVE_CACHE_TTL', 60))
+    DNS_BACKGROUND_BATCH_SIZE = int(os.environ.get('DNS_BACKGROUND_BATCH_SIZE', 1000))
+    DNS_BACKGROUND_BUDGET_SECONDS = float(os.environ.get('DNS_BACKGROUND_BUDGET_SECONDS', 30))
+
     # APScheduler configuration
     SCHEDULER_API_ENABLED = True
     SCHEDULER_TIMEZONE = 'UTC'
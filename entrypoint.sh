@@ -23,6 +23,9 @@ if [ ! -f "$DB_PATH" ]; then
     python create_admin.py
 else
     echo "Database file ($DB_PATH) already exists. Skipping initial setup."
+    # Add the tables and columns of newer versions and convert data stored by an older version
+    echo "Upgrading database..."
+    flask upgrade-db
 fi
 
 # Execute the main command passed as arguments to the script (e.g., supervisord)
@@ -9,10 +9,12 @@ import os
 from dotenv import load_dotenv
 from app import create_app, db
 from app.models.user import User
-from app.models.target import TargetGroup, Target
+from app.models.target import TargetGroup, Target, TargetGroupTiming
 from app.models.task import ScanTask, ScanRun
-from app.models.report import ScanReport, HostFinding, PortFinding
+from app.models.agent import ScanAgent
+from app.models.report import ScanReport, HostFinding, PortFinding, HostLiveness, PortFrequency, ScanResultCache
 from app.models.settings import SystemSettings
+from app.utils.schema_upgrade import upgrade_schema
 
 def init_db():
     """Initialize the database with the required tables."""
@@ -25,8 +27,8 @@ def init_db():
     app = create_app()
     
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create all tables and bring the tables of an older database up to date
+        upgrade_schema()
         
         # Initialize system settings with default values if they don't exist
         if SystemSettings.get_setting('max_concurrent_tasks') is None:
@@ -41,6 +43,18 @@ def init_db():
             SystemSettings.set_setting('pagination_rows', 20,
                                      'Default number of items to display per page in listings')
         
+        if SystemSettings.get_setting('liveness_skip_down_runs') is None:
+            SystemSettings.set_setting('liveness_skip_down_runs', 3,
+                                     'Scheduled scans skip addresses down in this many consecutive runs (0 = never)')
+        
+        if SystemSettings.get_setting('liveness_full_sweep_days') is None:
+            SystemSettings.set_setting('liveness_full_sweep_days', 7,
+                                     'Days between full sweeps that scan skipped addresses again')
+        
+        if SystemSettings.get_setting('global_max_rate') is None:
+            SystemSettings.set_setting('global_max_rate', 0,
+                                     'Total packets per second shared by all concurrent scans (0 = no limit)')
+        
         print("Database initialization complete!")
         
         # Print database location
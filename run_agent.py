@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+NmapWebUI Remote Scan Agent
+---------------------------
+This script runs scans for a central NmapWebUI server from another host, e.g. inside a network
+segment the server cannot reach. It registers with the server, claims queued scan runs of tasks
+whose agent label matches one of its labels, runs Nmap locally while renewing the run's lease
+and uploads the XML and normal output, which the server ingests like a local scan.
+
+The agent only needs Python 3 and Nmap; it does not use the application's database.
+
+Usage:
+$ AGENT_SERVER_URL=https://nmapwebui.example.com AGENT_REGISTRATION_TOKEN=secret \\
+  python3 run_agent.py --name dmz-agent-1 --labels dmz --capacity 2
+
+For a local test against a development server:
+$ AGENT_REGISTRATION_TOKEN=secret python3 run_agent.py --server http://127.0.0.1:5000 --labels any
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shlex
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import collections
+import urllib.request
+import urllib.error
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+PROGRESS_RE = re.compile(r'About (\d+\.\d+)% done')
+# Options Nmap refuses to run without root; the agent then runs Nmap through sudo -n
+ROOT_FLAGS = ('-O', '-sS', '-sU', '-sA', '-sW', '-sM', '--osscan-guess', '--osscan-limit')
+# Seconds Nmap gets to exit after being interrupted at the run's deadline
+DEADLINE_GRACE_SECONDS = 30
+# Console lines sent back with the result, for the server's error reporting
+OUTPUT_TAIL_LINES = 50
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentClient:
+    """HTTP client of the server's agent API"""
+
+    def __init__(self, server_url, token_file, timeout=30):
+        self.server_url = server_url.rstrip('/')
+        self.token_file = token_file
+        self.timeout = timeout
+        self.token = None
+        if os.path.exists(token_file):
+            with open(token_file) as f:
+                self.token = f.read().strip() or None
+
+    def _request(self, method, path, data=None, content_type='application/json'):
+        headers = {'Content-Type': content_type}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if data is not None and content_type == 'application/json':
+            data = json.dumps(data).encode('utf-8')
+        request = urllib.request.Request(f'{self.server_url}/api/agents{path}', data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                return response.status, json.loads(body) if body else None
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            try:
+                return e.code, json.loads(body) if body else None
+            except ValueError:
+                return e.code, {'error': body.decode('utf-8', 'replace')}
+        except (urllib.error.URLError, OSError) as e:
+            raise AgentError(f'Cannot reach {self.server_url}: {e}')
+
+    def register(self, registration_token, name, labels, capacity):
+        status, body = self._request('POST', '/register', {
+            'registration_token': registration_token,
+            'name': name,
+            'labels': labels,
+            'capacity': capacity
+        })
+        if status != 200:
+            raise AgentError(f"Registration failed ({status}): {(body or {}).get('error')}")
+        self.token = body['token']
+        with open(os.open(self.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(self.token)
+        return body
+
+    def claim(self):
+        status, body = self._request('POST', '/claim', {})
+        if status == 204:
+            return None
+        if status == 401:
+            raise PermissionError((body or {}).get('error'))
+        if status != 200:
+            raise AgentError(f"Claim failed ({status}): {(body or {}).get('error')}")
+        return body
+
+    def heartbeat(self, scan_run_id, progress):
+        status, body = self._request('POST', f'/runs/{scan_run_id}/heartbeat', {'progress': progress})
+        return (body or {}).get('status', 'lost') if status in (200, 409) else 'running'
+
+    def upload_result(self, scan_run_id, return_code, output, xml_path, normal_path):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in (('return_code', str(return_code)), ('output', output)):
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode('utf-8') + value.encode('utf-8') + b'\r\n')
+        for name, path in (('xml', xml_path), ('normal', normal_path)):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                content = f.read()
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{os.path.basename(path)}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + content + b'\r\n'
+            )
+        parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+        status, body = self._request('POST', f'/runs/{scan_run_id}/result', b''.join(parts), f'multipart/form-data; boundary={boundary}')
+        if status != 200:
+            raise AgentError(f"Upload failed ({status}): {(body or {}).get('error')}")
+        return body
+
+
+def log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} AGENT: {message}", file=sys.stdout)
+    sys.stdout.flush()
+
+
+def build_command(job, nmap_path, work_dir):
+    """Return the Nmap argv of a job and its XML and normal output paths"""
+    xml_output = os.path.join(work_dir, 'scan.xml')
+    normal_output = os.path.join(work_dir, 'scan.txt')
+    nmap_args = shlex.split(job['nmap_args'])
+    cmd = [nmap_path, '-v'] + nmap_args
+    if job.get('exclude'):
+        exclude_path = os.path.join(work_dir, 'exclude.txt')
+        with open(exclude_path, 'w') as f:
+            f.write('\n'.join(job['exclude']) + '\n')
+        cmd += ['--excludefile', exclude_path]
+    cmd += ['-oX', xml_output, '-oN', normal_output, '--stats-every', '5s'] + job['targets']
+    if os.geteuid() != 0 and any(arg in ROOT_FLAGS for arg in nmap_args):
+        cmd = ['sudo', '-n'] + cmd
+    return cmd, xml_output, normal_output
+
+
+def run_job(client, job, nmap_path):
+    """Run the Nmap scan of a claimed job, renewing its lease, and upload the output"""
+    scan_run_id = job['scan_run_id']
+    heartbeat_interval = max(5, job.get('lease_seconds', 120) / 3)
+    work_dir = tempfile.mkdtemp(prefix=f'nmapwebui_agent_{scan_run_id}_')
+    try:
+        cmd, xml_output, normal_output = build_command(job, nmap_path, work_dir)
+        log(f"[ScanRun {scan_run_id}] Running {job.get('task_name', '')}: {' '.join(cmd)}")
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+
+        output_tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+        progress = {'value': 0}
+
+        def read_output():
+            for line in process.stdout:
+                line = line.rstrip()
+                if not line:
+                    continue
+                output_tail.append(line)
+                match = PROGRESS_RE.search(line)
+                if match:
+                    progress['value'] = int(float(match.group(1)))
+
+        reader = threading.Thread(target=read_output, daemon=True)
+        reader.start()
+        try:
+            client.heartbeat(scan_run_id, 0)
+        except AgentError as e:
+            log(f"[ScanRun {scan_run_id}] Heartbeat failed: {e}")
+        while True:
+            reader.join(heartbeat_interval)
+            if not reader.is_alive():
+                break
+            try:
+                status = client.heartbeat(scan_run_id, progress['value'])
+            except AgentError as e:
+                log(f"[ScanRun {scan_run_id}] Heartbeat failed: {e}")
+                continue
+            if status == 'deadline':
+                # Interrupt Nmap like Ctrl+C and upload what it finished; the server keeps a partial report
+                log(f"[ScanRun {scan_run_id}] Deadline reached; interrupting Nmap")
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(DEADLINE_GRACE_SECONDS)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                reader.join(5)
+                break
+            if status != 'running':
+                log(f"[ScanRun {scan_run_id}] Server reports the run as {status}; stopping Nmap")
+                process.terminate()
+                process.wait()
+                return
+        return_code = process.wait()
+        log(f"[ScanRun {scan_run_id}] Nmap exited with return code {return_code}; uploading output")
+
+        for attempt in range(5):
+            try:
+                result = client.upload_result(scan_run_id, return_code, '\n'.join(output_tail), xml_output, normal_output)
+                log(f"[ScanRun {scan_run_id}] Server result: {result.get('status')}")
+                return
+            except AgentError as e:
+                log(f"[ScanRun {scan_run_id}] {e}; retrying")
+                time.sleep(min(60, 5 * 2 ** attempt))
+        log(f"[ScanRun {scan_run_id}] Giving up uploading the output; the server will requeue the run")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def worker_loop(client, args, registration_lock):
+    while True:
+        try:
+            job = client.claim()
+        except PermissionError:
+            # The token was revoked or the server forgot the agent; register again
+            with registration_lock:
+                log("Agent token rejected; registering again")
+                client.register(args.registration_token, args.name, args.labels, args.capacity)
+            continue
+        except AgentError as e:
+            log(str(e))
+            time.sleep(args.poll_seconds)
+            continue
+        if not job:
+            time.sleep(args.poll_seconds)
+            continue
+        try:
+            run_job(client, job, args.nmap)
+        except Exception as e:
+            log(f"[ScanRun {job.get('scan_run_id')}] Error running job: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NmapWebUI remote scan agent')
+    parser.add_argument('--server', default=os.environ.get('AGENT_SERVER_URL', 'http://127.0.0.1:5000'), help='URL of the NmapWebUI server')
+    parser.add_argument('--registration-token', default=os.environ.get('AGENT_REGISTRATION_TOKEN', ''), help="The server's AGENT_REGISTRATION_TOKEN")
+    parser.add_argument('--name', default=os.environ.get('AGENT_NAME', socket.gethostname()), help='Unique agent name')
+    parser.add_argument('--labels', default=os.environ.get('AGENT_LABELS', ''), help='Comma separated labels of the tasks this agent runs')
+    parser.add_argument('--capacity', type=int, default=int(os.environ.get('AGENT_CAPACITY', 1)), help='Scans run at the same time')
+    parser.add_argument('--poll-seconds', type=float, default=float(os.environ.get('AGENT_POLL_SECONDS', 10)), help='Seconds between claims while idle')
+    parser.add_argument('--nmap', default=os.environ.get('AGENT_NMAP_PATH', shutil.which('nmap') or '/usr/bin/nmap'), help='Path of the Nmap binary')
+    parser.add_argument('--token-file', default=os.environ.get('AGENT_TOKEN_FILE', os.path.expanduser('~/.nmapwebui_agent_token')), help='Where the agent token is kept')
+    args = parser.parse_args()
+    args.labels = [label.strip() for label in args.labels.split(',') if label.strip()]
+    args.capacity = max(1, args.capacity)
+
+    # Registering at every start applies changed labels and capacity; without the registration
+    # token the agent keeps using the token it got last time
+    client = AgentClient(args.server, args.token_file)
+    if args.registration_token:
+        client.register(args.registration_token, args.name, args.labels, args.capacity)
+    elif not client.token:
+        parser.error('--registration-token (or AGENT_REGISTRATION_TOKEN) is required to register the agent')
+    log(f"Agent '{args.name}' serving labels {args.labels or ['any']} with {args.capacity} slot(s) for {args.server}")
+
+    registration_lock = threading.Lock()
+    workers = [threading.Thread(target=worker_loop, args=(client, args, registration_lock), daemon=True) for _ in range(args.capacity)]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        log('Stopping agent')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Storage and query benchmark of dictionary-encoded service columns.
+
+Ingests a generated Nmap XML file with create_scan_report(), which stores service names, products,
+versions and CPEs as foreign keys to their lookup tables, and copies the same ports into a table
+laid out as port_findings was before (service as "name product extrainfo" text, version text).
+One port in a hundred hosts is switched to a rare product first. Prints the size of each table
+with its indexes and the time of counting the hosts that run the rare product: an indexed join
+through service_products, against a LIKE scan of the service text.
+
+Usage:
+$ python3 scripts/benchmark_finding_lookups.py
+$ python3 scripts/benchmark_finding_lookups.py --hosts 20000 --ports 25 --queries 50
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from sqlalchemy import text, func
+
+# Add the parent directory to the path so we can import the app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import db
+from app.models.report import PortFinding, ServiceProduct
+from app.tasks.nmap_tasks import create_scan_report
+from app.tasks.finding_lookups import resolve_lookup_ids
+from benchmark_report_ingest import write_nmap_xml, make_app
+
+RARE_PRODUCT = 'lighttpd'
+MARK_RARE_PRODUCT = """
+UPDATE port_findings SET product_id = :product_id WHERE port_number = 1001 AND host_id % 100 = 0
+"""
+LEGACY_TABLE = """
+CREATE TABLE legacy_port_findings (
+    id INTEGER PRIMARY KEY,
+    host_id INTEGER NOT NULL REFERENCES host_findings (id),
+    port_number INTEGER NOT NULL,
+    protocol VARCHAR(10) NOT NULL,
+    state VARCHAR(20) NOT NULL,
+    service VARCHAR(64),
+    version VARCHAR(255)
+)"""
+COPY_LEGACY_ROWS = """
+INSERT INTO legacy_port_findings (host_id, port_number, protocol, state, service, version)
+SELECT p.host_id, p.port_number, p.protocol, p.state,
+       trim(coalesce(n.value, '') || ' ' || coalesce(pr.value, '') || ' ' || coalesce(p.extrainfo, '')), v.value
+FROM port_findings p
+LEFT JOIN service_names n ON n.id = p.service_name_id
+LEFT JOIN service_products pr ON pr.id = p.product_id
+LEFT JOIN service_versions v ON v.id = p.version_id
+"""
+LEGACY_QUERY = """
+SELECT count(DISTINCT p.host_id) FROM legacy_port_findings p WHERE p.state = 'open' AND p.service LIKE :pattern
+"""
+
+def table_bytes(name):
+    """(table, indexes) bytes used by a table, from SQLite's dbstat virtual table"""
+    table = db.session.execute(text("SELECT sum(pgsize) FROM dbstat WHERE name = :name"), {'name': name}).scalar() or 0
+    indexes = db.session.execute(text(
+        "SELECT sum(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name)"
+    ), {'name': name}).scalar() or 0
+    return table, indexes
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dictionary-encoded service columns')
+    parser.add_argument('--hosts', type=int, default=5000, help='Hosts in the generated scan')
+    parser.add_argument('--ports', type=int, default=20, help='Open ports per host')
+    parser.add_argument('--queries', type=int, default=20, help='Repetitions of each product query')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='nmapwebui-bench-lookups-')
+    try:
+        xml_path = os.path.join(workdir, 'scan.xml')
+        write_nmap_xml(xml_path, args.hosts, args.ports)
+        app, scan_run_id = make_app(os.path.join(workdir, 'bench.db'), 500)
+        with app.app_context():
+            create_scan_report(scan_run_id, xml_path, None)
+            product_id = resolve_lookup_ids(ServiceProduct, [RARE_PRODUCT])[RARE_PRODUCT]
+            db.session.execute(text(MARK_RARE_PRODUCT), {'product_id': product_id})
+            db.session.execute(text(LEGACY_TABLE))
+            db.session.execute(text(COPY_LEGACY_ROWS))
+            db.session.commit()
+            db.session.execute(text('ANALYZE'))
+            print(f"{args.hosts} hosts x {args.ports} ports")
+
+            lookup_bytes = sum(sum(table_bytes(name)) for name in ('service_names', 'service_products', 'service_versions', 'service_cpes'))
+            for name, label in (('legacy_port_findings', 'text columns'), ('port_findings', 'encoded')):
+                table, indexes = table_bytes(name)
+                print(f"  {label:<14} rows {table / 1e6:6.2f} MB, indexes {indexes / 1e6:6.2f} MB")
+            print(f"  lookup tables  {lookup_bytes / 1e3:.1f} kB")
+
+            encoded_query = db.session.query(func.count(PortFinding.host_id.distinct())) \
+                .join(ServiceProduct, ServiceProduct.id == PortFinding.product_id) \
+                .filter(ServiceProduct.value == RARE_PRODUCT, PortFinding.state == 'open')
+            legacy_time, legacy_hosts = timed(lambda: db.session.execute(text(LEGACY_QUERY), {'pattern': f"% {RARE_PRODUCT} %"}).scalar(), args.queries)
+            encoded_time, encoded_hosts = timed(encoded_query.scalar, args.queries)
+            check = '' if legacy_hosts == encoded_hosts else f"  (LIKE found {legacy_hosts}!)"
+            print(f"  hosts running {RARE_PRODUCT}: LIKE scan {legacy_time * 1000:.2f} ms, indexed join {encoded_time * 1000:.2f} ms, "
+                  f"{encoded_hosts} hosts{check}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the Nmap output event parser against recorded Nmap output.
+
+Replays scripts/data/nmap_verbose_output.txt (or the -v output given with --input) through
+parse_nmap_line() and ScanPhaseTracker, and through the substring checks the scan loop used
+before, and prints the throughput of each in lines per second.
+
+Usage:
+$ python3 scripts/benchmark_nmap_events.py
+$ python3 scripts/benchmark_nmap_events.py --input /tmp/nmap_console.log --repeat 20000
+"""
+import os
+import re
+import sys
+import argparse
+import timeit
+
+# Add the parent directory to the path so we can import the app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.tasks.nmap_events import parse_nmap_line, ScanPhaseTracker, PROGRESS, PORT_DISCOVERED, SCAN_DONE
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'nmap_verbose_output.txt')
+LEGACY_PROGRESS_RE = re.compile(r'About\s+([\d.]+)% done')
+
+def legacy_scan(lines):
+    """The per-line checks of the scan loop before the event parser"""
+    buffer = []
+    progress = 0
+    done = False
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) > 10:
+            buffer.pop(0)
+        if any(msg in line for msg in [
+            'requires root privileges',
+            'requires privileged access',
+            'TCP/IP fingerprinting (for OS scan) requires root privileges'
+        ]):
+            pass
+        if 'QUITTING!' in line:
+            for recent_line in buffer:
+                if any(msg in recent_line for msg in ['root privileges', 'privileged access', 'TCP/IP fingerprinting']):
+                    break
+        match = LEGACY_PROGRESS_RE.search(line)
+        if match:
+            progress = int(float(match.group(1)))
+        if 'Nmap done' in line:
+            done = True
+    return progress, done
+
+def parse_all(lines):
+    return [parse_nmap_line(line) for line in lines]
+
+def track_all(lines):
+    tracker = ScanPhaseTracker()
+    for line in lines:
+        tracker.feed(line)
+    return tracker
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Nmap output event parser')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='Recorded Nmap -v console output')
+    parser.add_argument('--repeat', type=int, default=5000, help='Times the recording is replayed per measurement')
+    parser.add_argument('--rounds', type=int, default=5, help='Measurements per benchmark; the best is reported')
+    args = parser.parse_args()
+
+    with open(args.input, 'r', errors='replace') as f:
+        recording = [line.strip() for line in f if line.strip()]
+    lines = recording * args.repeat
+
+    # Check the parser on the recording before timing it
+    events = [event for event in parse_all(recording) if event]
+    kinds = [event.kind for event in events]
+    tracker = track_all(recording)
+    print(f"Recording: {len(recording)} lines, {len(events)} events "
+          f"({kinds.count(PROGRESS)} progress, {kinds.count(PORT_DISCOVERED)} ports, {kinds.count(SCAN_DONE)} done)")
+    print(f"Final state: phase={tracker.phase!r} progress={tracker.progress} done={tracker.done} "
+          f"hosts_up={tracker.hosts_up} ports_found={tracker.ports_found} warnings={tracker.warnings}")
+
+    print(f"Replaying {len(lines)} lines, best of {args.rounds}:")
+    for name, func in (('legacy substring checks', legacy_scan), ('parse_nmap_line', parse_all), ('ScanPhaseTracker.feed', track_all)):
+        best = min(timeit.repeat(lambda: func(lines), number=1, repeat=args.rounds))
+        print(f"  {name:<24} {best * 1000:8.1f} ms  {len(lines) / best / 1e6:6.2f} M lines/s  {best / len(lines) * 1e9:7.0f} ns/line")
+
+if __name__ == '__main__':
+    main()
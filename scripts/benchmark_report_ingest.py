@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark of report ingestion from Nmap XML output.
+
+Generates synthetic Nmap XML files of increasing size and ingests each one in a fresh process,
+once the way create_scan_report() did before (ET.parse of the whole file, every host built in
+the session, one commit) and once with create_scan_report() itself, which parses the file with
+iterparse and commits the hosts in batches. For each it prints the time taken and how much the
+peak RSS of the process grew; the streaming figure should stay flat as the file grows.
+
+Usage:
+$ python3 scripts/benchmark_report_ingest.py
+$ python3 scripts/benchmark_report_ingest.py --hosts 1000 10000 50000 --ports 20
+$ python3 scripts/benchmark_report_ingest.py --streaming-only --hosts 200000
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+# Add the parent directory to the path so we can import the app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+from app import db
+from app.models.user import User
+from app.models.task import ScanTask, ScanRun
+from app.models.report import ScanReport, HostFinding, PortFinding
+from app.tasks.report_parsing import LXML_AVAILABLE, parse_nmaprun_summary, parse_runstats, parse_host_element
+from app.tasks.nmap_tasks import create_scan_report
+from app.tasks.finding_lookups import encode_port_rows
+
+SERVICES = (('ssh', 'OpenSSH', '8.9p1'), ('http', 'nginx', '1.24.0'), ('https', 'Apache httpd', '2.4.58'), ('mysql', 'MySQL', '8.0.36'))
+
+def write_nmap_xml(path, host_count, ports_per_host):
+    """Write an Nmap -oX style file of host_count up hosts with ports_per_host open ports each"""
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE nmaprun>\n')
+        f.write('<nmaprun scanner="nmap" args="nmap -sV -p- 10.0.0.0/16" start="1700000000" '
+                'startstr="Tue Nov 14 22:13:20 2023" version="7.94" xmloutputversion="1.05">\n')
+        f.write('<scaninfo type="syn" protocol="tcp" numservices="65535" services="1-65535"/>\n<verbose level="1"/>\n<debugging level="0"/>\n')
+        for i in range(host_count):
+            address = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+            f.write(f'<host starttime="1700000001" endtime="1700000100"><status state="up" reason="syn-ack" reason_ttl="0"/>\n'
+                    f'<address addr="{address}" addrtype="ipv4"/>\n'
+                    f'<hostnames><hostname name="host-{i}.example.com" type="PTR"/></hostnames>\n<ports>')
+            for p in range(ports_per_host):
+                name, product, version = SERVICES[p % len(SERVICES)]
+                f.write(f'<port protocol="tcp" portid="{1000 + p}"><state state="open" reason="syn-ack" reason_ttl="64"/>'
+                        f'<service name="{name}" product="{product}" version="{version}" extrainfo="Ubuntu Linux; protocol 2.0" method="probed" conf="10">'
+                        f'<cpe>cpe:/a:{product.lower().replace(" ", "_")}:{version}</cpe></service></port>\n')
+            f.write('</ports>\n<os><osmatch name="Linux 5.0 - 5.14" accuracy="98" line="67000">'
+                    '<osclass type="general purpose" vendor="Linux" osfamily="Linux" osgen="5.X" accuracy="98"/></osmatch></os>\n'
+                    '<times srtt="420" rttvar="120" to="100000"/>\n</host>\n')
+        f.write(f'<runstats><finished time="1700001000" timestr="Tue Nov 14 22:30:00 2023" elapsed="1000" exit="success"/>'
+                f'<hosts up="{host_count}" down="0" total="{host_count}"/></runstats>\n</nmaprun>\n')
+
+def build_host_finding(host_data):
+    """A HostFinding with its PortFinding children, as report creation used to build for every host"""
+    host_finding = HostFinding(ip_address=host_data['ip_address'], hostname=host_data['hostname'], status=host_data['status'], os_info=host_data['os_info'])
+    port_rows = encode_port_rows([{
+        'port_number': int(port_data['port_number']),
+        'protocol': port_data['protocol'],
+        'state': port_data['state'],
+        'service_name': port_data['service_name'],
+        'product': port_data['product'],
+        'version': port_data['version'],
+        'cpe': port_data['cpe'],
+        'extrainfo': port_data['extrainfo']
+    } for port_data in host_data['ports']])
+    for port_row in port_rows:
+        host_finding.ports.append(PortFinding(**port_row))
+    return host_finding
+
+def legacy_create_report(scan_run_id, xml_path):
+    """Report creation as it was before incremental ingestion: the whole file and report in memory"""
+    root = ET.parse(xml_path).getroot()
+    summary = parse_nmaprun_summary(root.attrib)
+    parse_runstats(root.find('runstats'), summary)
+    hosts = [parse_host_element(host_elem) for host_elem in root.findall('host')]
+    report = ScanReport(scan_run_id=scan_run_id, xml_report_path=xml_path, summary=json.dumps(summary))
+    for host_data in hosts:
+        report.hosts.append(build_host_finding(host_data))
+    db.session.add(report)
+    db.session.commit()
+    return report
+
+def make_app(database_path, batch_size):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['NMAP_INGEST_BATCH_SIZE'] = batch_size
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User('bench', 'bench@example.com', 'benchmark')
+        db.session.add(user)
+        db.session.flush()
+        task = ScanTask(name='bench', scan_profile='quick_scan', user_id=user.id, use_global_max_reports=False, max_reports=1000)
+        db.session.add(task)
+        db.session.flush()
+        scan_run = ScanRun(task_id=task.id, status='running')
+        db.session.add(scan_run)
+        db.session.commit()
+        return app, scan_run.id
+
+def peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def current_rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def run_ingest(mode, xml_path, database_path, batch_size, results):
+    """Ingest one file in this (fresh) process and report its time and peak RSS growth"""
+    app, scan_run_id = make_app(database_path, batch_size)
+    with app.app_context():
+        baseline = current_rss_bytes()
+        started = time.perf_counter()
+        if mode == 'legacy':
+            report = legacy_create_report(scan_run_id, xml_path)
+        else:
+            report = create_scan_report(scan_run_id, xml_path, None)
+        elapsed = time.perf_counter() - started
+        hosts = HostFinding.query.filter_by(report_id=report.id).count()
+        ports = PortFinding.query.join(HostFinding).filter(HostFinding.report_id == report.id).count()
+    results.put((elapsed, max(0, peak_rss_bytes() - baseline), hosts, ports))
+
+def measure(mode, xml_path, batch_size):
+    workdir = tempfile.mkdtemp(prefix='nmapwebui-bench-db-')
+    try:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_ingest, args=(mode, xml_path, os.path.join(workdir, 'bench.db'), batch_size, results))
+        process.start()
+        result = results.get()
+        process.join()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the memory use of report ingestion')
+    parser.add_argument('--hosts', type=int, nargs='+', default=[500, 2000, 8000], help='Host counts of the generated XML files')
+    parser.add_argument('--ports', type=int, default=10, help='Open ports per host')
+    parser.add_argument('--batch-size', type=int, default=500, help='NMAP_INGEST_BATCH_SIZE of the streaming ingest')
+    parser.add_argument('--streaming-only', action='store_true', help='Skip the in-memory ingest (for files too large for it)')
+    args = parser.parse_args()
+
+    # fork would hand each child the memory of earlier measurements' parents; keep children independent
+    multiprocessing.set_start_method('spawn')
+    print(f"XML parser: {'lxml' if LXML_AVAILABLE else 'xml.etree.ElementTree'}, batch size {args.batch_size}")
+    print(f"{'hosts':>8} {'XML MB':>8}  {'mode':<10} {'seconds':>8} {'peak RSS growth MB':>19} {'hosts/s':>9}")
+    modes = ('streaming',) if args.streaming_only else ('legacy', 'streaming')
+    workdir = tempfile.mkdtemp(prefix='nmapwebui-bench-xml-')
+    try:
+        for host_count in args.hosts:
+            xml_path = os.path.join(workdir, f"scan_{host_count}.xml")
+            write_nmap_xml(xml_path, host_count, args.ports)
+            size_mb = os.path.getsize(xml_path) / 1e6
+            for mode in modes:
+                elapsed, growth, hosts, ports = measure(mode, xml_path, args.batch_size)
+                if hosts != host_count or ports != host_count * args.ports:
+                    print(f"  {mode}: ingested {hosts} hosts and {ports} ports, expected {host_count} and {host_count * args.ports}")
+                print(f"{host_count:>8} {size_mb:>8.1f}  {mode:<10} {elapsed:>8.2f} {growth / 1e6:>19.1f} {host_count / elapsed:>9.0f}")
+            os.remove(xml_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
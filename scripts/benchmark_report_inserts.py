@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of writing host and port findings to the database.
+
+Compares building HostFinding/PortFinding ORM objects and committing them batch by batch, as
+create_scan_report() did before, with the bulk Core inserts of insert_host_findings(). Each is
+measured on already parsed hosts (the insert cost alone) and end to end from a generated Nmap
+XML file, against a fresh SQLite database, and reported in rows (hosts + ports) per second.
+
+Usage:
+$ python3 scripts/benchmark_report_inserts.py
+$ python3 scripts/benchmark_report_inserts.py --hosts 20000 --ports 25 --batch-size 1000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+# Add the parent directory to the path so we can import the app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import db
+from app.models.report import ScanReport, HostFinding, PortFinding
+from app.tasks.report_parsing import iter_report_hosts, insert_host_findings
+from app.tasks.nmap_tasks import create_scan_report
+from benchmark_report_ingest import write_nmap_xml, make_app, build_host_finding
+
+def orm_insert(report_id, hosts, batch_size):
+    """One ORM object per row, committed every batch_size hosts"""
+    for start in range(0, len(hosts), batch_size):
+        for host_data in hosts[start:start + batch_size]:
+            host_finding = build_host_finding(host_data)
+            host_finding.report_id = report_id
+            db.session.add(host_finding)
+        db.session.commit()
+
+def core_insert(report_id, hosts, batch_size):
+    for start in range(0, len(hosts), batch_size):
+        insert_host_findings(report_id, hosts[start:start + batch_size])
+        db.session.commit()
+
+def orm_create_report(scan_run_id, xml_path, batch_size):
+    """create_scan_report() before bulk inserts: the same incremental parse, ORM objects per batch"""
+    report = ScanReport(scan_run_id=scan_run_id, xml_report_path=xml_path, status='ingesting')
+    db.session.add(report)
+    db.session.commit()
+    batch = []
+    for host_data in iter_report_hosts(xml_path, {}):
+        batch.append(host_data)
+        if len(batch) >= batch_size:
+            orm_insert(report.id, batch, batch_size)
+            batch = []
+    orm_insert(report.id, batch, batch_size)
+    return report
+
+def new_report(scan_run_id):
+    report = ScanReport(scan_run_id=scan_run_id, status='ingesting')
+    db.session.add(report)
+    db.session.commit()
+    return report.id
+
+def count_rows(report_id):
+    hosts = HostFinding.query.filter_by(report_id=report_id).count()
+    ports = PortFinding.query.join(HostFinding).filter(HostFinding.report_id == report_id).count()
+    return hosts + ports
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark host and port finding inserts')
+    parser.add_argument('--hosts', type=int, default=5000, help='Hosts in the generated scan')
+    parser.add_argument('--ports', type=int, default=20, help='Open ports per host')
+    parser.add_argument('--batch-size', type=int, default=500, help='Hosts per commit (NMAP_INGEST_BATCH_SIZE)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='nmapwebui-bench-inserts-')
+    try:
+        xml_path = os.path.join(workdir, 'scan.xml')
+        write_nmap_xml(xml_path, args.hosts, args.ports)
+        hosts = list(iter_report_hosts(xml_path, {}))
+        expected_rows = args.hosts * (args.ports + 1)
+        print(f"{args.hosts} hosts x {args.ports} ports = {expected_rows} rows, {args.batch_size} hosts per commit")
+
+        benchmarks = (
+            ('insert', 'ORM objects', lambda run_id: orm_insert(new_report(run_id), hosts, args.batch_size)),
+            ('insert', 'Core executemany', lambda run_id: core_insert(new_report(run_id), hosts, args.batch_size)),
+            ('end to end', 'ORM objects', lambda run_id: orm_create_report(run_id, xml_path, args.batch_size)),
+            ('end to end', 'create_scan_report', lambda run_id: create_scan_report(run_id, xml_path, None)),
+        )
+        for number, (scope, name, func) in enumerate(benchmarks):
+            app, scan_run_id = make_app(os.path.join(workdir, f"bench_{number}.db"), args.batch_size)
+            with app.app_context():
+                started = time.perf_counter()
+                func(scan_run_id)
+                elapsed = time.perf_counter() - started
+                report_id = ScanReport.query.filter_by(scan_run_id=scan_run_id).one().id
+                rows = count_rows(report_id)
+            check = '' if rows == expected_rows else f"  (wrote {rows} rows!)"
+            print(f"  {scope:<10} {name:<20} {elapsed:8.2f} s  {rows / elapsed:10.0f} rows/s{check}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()